@@ -0,0 +1,321 @@
+"""A stand-in for the Understand Python API, serving synthetic databases, for benchmarks and for trying the tools
+without an Understand license. Point the tools at it with --dllDir=benchmarks/fake_understand and pass a JSON spec
+instead of a UDB (--in=spec.json, --before=..., --after=...):
+
+  {"entities": 100000,         total number of entities: 5% files, 15% classes, 80% routines (override with "files", "classes")
+   "seed": 1,                  different seeds give different metric values
+   "changeSeed": 2,            for before/after DBs: with the same seed, a changeSeed makes the metrics of
+   "changedFraction": 0.1,     this fraction of the entities differ
+   "dirs": 20,                 files are spread over this many dirs
+   "libraryFraction": 0.05,    fraction of classes/routines from a library (skipped by --skipLibs)
+   "unknownFraction": 0.01,    fraction of classes/routines of an Unknown/Unresolved kind
+   "freeFunctionFraction": 0.2,fraction of routines outside of classes
+   "latencyMicros": {"metric": 0, "ref": 0, "ents": 0},   simulated cost of each API call, per entity
+   "metrics": {"Routine": {"CountLineCode": {"distribution": "exponential", "mean": 20, "min": 1}}}}   overrides the defaults below
+
+Entities are not stored: names and kinds are computed from the entity index, and metric values from a hash of
+(seed, index, metric name), so a 1M entity DB costs little more than the entity objects themselves.
+As with the real API, only one DB may be open per process: open() raises DBAlreadyOpen until it is closed.
+"""
+import builtins
+import json
+import math
+import os
+import sys
+import time
+import zlib
+
+try:
+    from utilities.snapshot import kind_matches_query
+except ImportError: # srccheck not installed: use the one of this checkout
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+    from utilities.snapshot import kind_matches_query
+
+DEFAULT_METRICS = {
+    "File": {"CountLineCode": {"distribution": "exponential", "mean": 300, "min": 1},
+             "CountDeclFunction": {"distribution": "exponential", "mean": 15},
+             "CountDeclClass": {"distribution": "exponential", "mean": 2},
+             "CountDeclModule": {"distribution": "uniform", "min": 0, "max": 1},
+             "MaxCyclomaticModified": {"distribution": "exponential", "mean": 8, "min": 1},
+             "MaxNesting": {"distribution": "uniform", "min": 0, "max": 6}},
+    "Class": {"CountDeclMethod": {"distribution": "exponential", "mean": 12},
+              "CountDeclPropertyAuto": {"distribution": "exponential", "mean": 1},
+              "PercentLackOfCohesion": {"distribution": "uniform", "min": 0, "max": 100},
+              "MaxInheritanceTree": {"distribution": "uniform", "min": 1, "max": 6},
+              "CountClassCoupled": {"distribution": "exponential", "mean": 8},
+              "CountLineCode": {"distribution": "exponential", "mean": 200, "min": 1}},
+    "Routine": {"CountLineCode": {"distribution": "exponential", "mean": 20, "min": 1},
+                "CountStmt": {"distribution": "exponential", "mean": 15, "min": 1},
+                "CountPath": {"distribution": "exponential", "mean": 6, "min": 1},
+                "Cyclomatic": {"distribution": "exponential", "mean": 3, "min": 1},
+                "CyclomaticStrict": {"distribution": "exponential", "mean": 4, "min": 1},
+                "CyclomaticModified": {"distribution": "exponential", "mean": 3, "min": 1},
+                "Essential": {"distribution": "uniform", "min": 1, "max": 3},
+                "MaxNesting": {"distribution": "uniform", "min": 0, "max": 5},
+                "Parameters": {"distribution": "uniform", "min": 0, "max": 6}}, # what ents("Define", "Parameter") returns
+}
+
+PROJECT_COUNTS = {"CountDeclFile": "File", "CountDeclClass": "Class", "CountDeclMethod": "Routine", "CountDeclFunction": "Routine"}
+
+
+class UnderstandError(Exception):
+    pass
+
+
+def _spin(micros):
+    if micros > 0: # busy wait: sleep() is far too coarse for microseconds, and the real API burns CPU anyway
+        deadline = time.perf_counter() + micros / 1000000.0
+        while time.perf_counter() < deadline:
+            pass
+
+
+def _unit_hash(seed, index, name):
+    return zlib.crc32(("%d:%d:%s" % (seed, index, name)).encode("ascii")) / 4294967296.0
+
+
+def _value_from_distribution(distribution, u):
+    minimum = distribution.get("min", 0)
+    if distribution["distribution"] == "uniform":
+        return minimum + int(u * (distribution["max"] - minimum + 1))
+    if distribution["distribution"] == "exponential":
+        return minimum + int(-distribution["mean"] * math.log(1.0 - u))
+    if distribution["distribution"] == "constant":
+        return distribution["value"]
+    raise UnderstandError("Unknown distribution: %s" % distribution["distribution"])
+
+
+class Ref:
+    __slots__ = ["_file"]
+
+    def __init__(self, file):
+        self._file = file
+
+    def file(self):
+        return self._file
+
+
+class Entity:
+    __slots__ = ["_db", "_index"]
+
+    def __init__(self, db, index):
+        self._db = db
+        self._index = index
+
+    def id(self):
+        return self._index
+
+    def longname(self):
+        return self._db.longname_of(self._index)
+
+    def relname(self):
+        return self._db.longname_of(self._index).rsplit("/", 1)[-1]
+
+    def name(self):
+        if self._db.scope_of(self._index) == "File":
+            return self.relname()
+        return self._db.longname_of(self._index).rsplit(".", 1)[-1]
+
+    def kindname(self):
+        return self._db.kindname_of(self._index)
+
+    def library(self):
+        return self._db.library_of(self._index)
+
+    def metrics(self):
+        return list(self._db.metric_specs[self._db.scope_of(self._index)].keys())
+
+    def metric(self, metric_names):
+        _spin(self._db.latency.get("metric", 0))
+        if isinstance(metric_names, str):
+            return self._db.metric_of(self._index, metric_names)
+        return {metric_name: self._db.metric_of(self._index, metric_name) for metric_name in metric_names}
+
+    def ref(self, refkindstring=None, entkindstring=None):
+        _spin(self._db.latency.get("ref", 0))
+        file_index = self._db.file_index_of(self._index)
+        if file_index is None:
+            return None
+        return Ref(self._db.entity(file_index))
+
+    def refs(self, refkindstring=None, entkindstring=None, unique=False):
+        ref = self.ref(refkindstring)
+        return [] if ref is None else [ref]
+
+    def ents(self, refkindstring=None, entkindstring=None):
+        _spin(self._db.latency.get("ents", 0))
+        if self._db.scope_of(self._index) != "Routine":
+            return []
+        return [None] * (self._db.metric_of(self._index, "Parameters") or 0)
+
+    def __str__(self):
+        return self.longname()
+
+    def __repr__(self):
+        return "<Entity %i %s>" % (self._index, self.longname())
+
+
+class Db:
+
+    def __init__(self, path, spec):
+        self.path = path
+        entity_count = int(spec.get("entities", 10000))
+        self.file_count = max(1, int(spec.get("files", entity_count // 20)))
+        self.class_count = int(spec.get("classes", entity_count * 3 // 20))
+        self.routine_count = max(0, entity_count - self.file_count - self.class_count)
+        self.seed = int(spec.get("seed", 1))
+        self.change_seed = spec.get("changeSeed", None)
+        self.changed_fraction = float(spec.get("changedFraction", 0.1))
+        self.dir_count = max(1, int(spec.get("dirs", 20)))
+        self.library_fraction = float(spec.get("libraryFraction", 0.05))
+        self.unknown_fraction = float(spec.get("unknownFraction", 0.01))
+        self.free_function_fraction = float(spec.get("freeFunctionFraction", 0.2))
+        self.latency = spec.get("latencyMicros", {})
+        self.metric_specs = {scope_name: dict(metrics) for scope_name, metrics in DEFAULT_METRICS.items()}
+        for scope_name, metrics in spec.get("metrics", {}).items():
+            self.metric_specs.setdefault(scope_name, {}).update(metrics)
+        self._entities = {}
+        self._ents_by_query = {}
+        self._prj_metrics = {}
+
+    # entity layout: files first, then classes, then routines
+    def scope_of(self, index):
+        if index < self.file_count:
+            return "File"
+        if index < self.file_count + self.class_count:
+            return "Class"
+        return "Routine"
+
+    def entity(self, index):
+        entity = self._entities.get(index, None)
+        if entity is None:
+            entity = Entity(self, index)
+            self._entities[index] = entity
+        return entity
+
+    def _is_free_function(self, index):
+        return self.class_count == 0 or _unit_hash(self.seed, index, "free") < self.free_function_fraction
+
+    def _class_index_of(self, index):
+        routine = index - self.file_count - self.class_count
+        return self.file_count + routine * self.class_count // max(1, self.routine_count)
+
+    def file_index_of(self, index):
+        scope_name = self.scope_of(index)
+        if scope_name == "File":
+            return index
+        if scope_name == "Class":
+            return (index - self.file_count) * self.file_count // max(1, self.class_count)
+        if self._is_free_function(index):
+            return (index - self.file_count - self.class_count) * self.file_count // max(1, self.routine_count)
+        return self.file_index_of(self._class_index_of(index))
+
+    def longname_of(self, index):
+        scope_name = self.scope_of(index)
+        if scope_name == "File":
+            return "/src/pkg%i/module%i.py" % (index % self.dir_count, index)
+        if scope_name == "Class":
+            return "pkg%i.module%i.Class%i" % (self.file_index_of(index) % self.dir_count, self.file_index_of(index), index)
+        if self._is_free_function(index):
+            file_index = self.file_index_of(index)
+            return "pkg%i.module%i.function%i" % (file_index % self.dir_count, file_index, index)
+        return "%s.method%i" % (self.longname_of(self._class_index_of(index)), index)
+
+    def library_of(self, index):
+        if self.scope_of(index) == "File" or _unit_hash(self.seed, index, "library") >= self.library_fraction:
+            return ""
+        return "Standard"
+
+    def kindname_of(self, index):
+        scope_name = self.scope_of(index)
+        if scope_name == "File":
+            return "File"
+        unknown = _unit_hash(self.seed, index, "unknown") < self.unknown_fraction
+        if scope_name == "Class":
+            return "Unresolved Class" if unknown else "Class"
+        if self._is_free_function(index):
+            return "Unknown Function" if unknown else "Function"
+        return "Unknown Method" if unknown else "Public Method"
+
+    def metric_of(self, index, metric_name):
+        distribution = self.metric_specs[self.scope_of(index)].get(metric_name, None)
+        if distribution is None:
+            return None
+        seed = self.seed
+        if self.change_seed is not None and _unit_hash(self.change_seed, index, "changed") < self.changed_fraction:
+            seed = int(self.change_seed)
+        return _value_from_distribution(distribution, _unit_hash(seed, index, metric_name))
+
+    # the API
+    def name(self):
+        return self.path
+
+    def language(self):
+        return ["Python"]
+
+    def ents(self, query):
+        _spin(self.latency.get("ents", 0))
+        entities = self._ents_by_query.get(query, None)
+        if entities is None:
+            matches_by_kind = {}
+            entities = []
+            for index in range(self.file_count + self.class_count + self.routine_count):
+                kind_name = self.kindname_of(index)
+                if kind_name not in matches_by_kind:
+                    matches_by_kind[kind_name] = kind_matches_query(kind_name, query)
+                if matches_by_kind[kind_name]:
+                    entities.append(self.entity(index))
+            self._ents_by_query[query] = entities
+        return list(entities)
+
+    def metrics(self):
+        return sorted(set(["CountDeclFile", "CountDeclClass", "CountDeclMethod", "CountDeclFunction"] +
+                          ["%s%s" % (prefix, metric_name) for metric_name in self.metric_specs["Routine"] for prefix in ["", "Avg", "Max", "Sum"]]))
+
+    def _prj_metric(self, metric_name):
+        # Project metrics walk all routines, like the expensive ones of Understand do
+        if metric_name in PROJECT_COUNTS:
+            return {"File": self.file_count, "Class": self.class_count, "Routine": self.routine_count}[PROJECT_COUNTS[metric_name]]
+        prefix = metric_name[:3] if metric_name[:3] in ["Avg", "Max", "Sum"] else ""
+        routine_metric_name = metric_name[len(prefix):]
+        if routine_metric_name not in self.metric_specs["Routine"]:
+            routine_metric_name = "Count%s" % routine_metric_name # AvgLineCode and the like
+        if routine_metric_name not in self.metric_specs["Routine"]:
+            routine_metric_name = metric_name # MaxNesting is the max of the MaxNesting of routines
+        if routine_metric_name not in self.metric_specs["Routine"] or self.routine_count == 0:
+            return None
+        first_routine = self.file_count + self.class_count
+        values = [self.metric_of(index, routine_metric_name) for index in range(first_routine, first_routine + self.routine_count)]
+        if prefix == "Avg":
+            return round(sum(values) / len(values), 2)
+        if prefix == "Max":
+            return max(values)
+        return sum(values)
+
+    def metric(self, metric_names):
+        if isinstance(metric_names, str):
+            metric_names = [metric_names]
+        for metric_name in metric_names:
+            if metric_name not in self._prj_metrics:
+                self._prj_metrics[metric_name] = self._prj_metric(metric_name)
+        return {metric_name: self._prj_metrics[metric_name] for metric_name in metric_names}
+
+    def close(self):
+        global _open_db
+        if _open_db is self:
+            _open_db = None
+
+
+_open_db = None # like the real API: one open db per process (a forked worker inherits it, too)
+
+
+def open(path):
+    global _open_db
+    if _open_db is not None:
+        raise UnderstandError("DBAlreadyOpen: %s is open" % _open_db.name())
+    try:
+        with builtins.open(path) as spec_file:
+            spec = json.load(spec_file)
+    except (IOError, ValueError) as exc:
+        raise UnderstandError("DBUnableOpen: %s (%s)" % (path, exc))
+    _open_db = Db(path, spec)
+    return _open_db
@@ -0,0 +1,234 @@
+"""Benchmarks of the srccheck tools on synthetic databases, served by fake_understand/understand.py.
+
+Usage:
+  run_benchmarks    [--sizes=<sizes>] \r\n \
+                    [--tools=<tools>] \r\n \
+                    [--startupTools=<startupTools>] \r\n \
+                    [--thresholds=<thresholds>] \r\n \
+                    [--outputDir=<outputDir>] \r\n \
+                    [--report=<report>] \r\n \
+                    [--latencyMicros=<latencyMicros>]
+
+
+Options:
+  --sizes=<sizes>                   CSV of database sizes, in entities (k and M suffixes allowed) [default: 10k,100k]
+  --tools=<tools>                   CSV of tools to time, each in a fresh process. Empty for none. [default: srccheck,srchistplot,srcscatterplot,srcdiffplot]
+  --startupTools=<startupTools>     CSV of tools whose import time to measure (python -X importtime). Empty for none. [default: srccheck,srchistplot,srcscatterplot,srcdiffplot,srcinstplot,srcextract,csvkaloi,csvhistplot,csvscatterplot,xmlkaloi,jd2csv]
+  --thresholds=<thresholds>         JSON file with the min/max allowed for each measurement, by size. Each one out of bounds is a regression. [default: thresholds.json]
+  --outputDir=<outputDir>           Where the synthetic DB specs and the files generated by the tools go. Defaults to a temp dir.
+  --report=<report>                 JSON file to save all measurements to.
+  --latencyMicros=<latencyMicros>   Simulated cost of each metric() call of an entity, in microseconds [default: 0]
+
+Measurements, per size:
+  stream.entitiesPerSec             Routines streamed by stream_of_entity_with_metrics per second (in this process), including opening the DB
+  stream.peakMB                     Peak memory allocated by Python while streaming (tracemalloc), including opening the DB
+  <tool>.seconds                    Wall time of the tool
+  <tool>.peakMB                     Peak RSS of the process of the tool (Unix only)
+
+Measurements at startup (not by size), for the --startupTools:
+  <tool>.importMs                   Time to import the tool's module, before it even parses its arguments (best of 3 fresh processes)
+  <tool>.lazyModules                Modules of matplotlib, mpld3 and requests loaded by that import: should be 0, as they load on first use
+
+The exit code is the number of regressions, so it can fail a CI build, just like srccheck does.
+
+Author:
+  Marcio Marchini (marcio@BetterDeveloper.net)
+
+"""
+
+import concurrent.futures
+import contextlib
+import datetime
+import importlib
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from docopt import docopt
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_UNDERSTAND_DIR = os.path.join(BENCHMARKS_DIR, "fake_understand")
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR)) # this checkout of srccheck, even if another one is installed
+
+from utilities import VERSION
+from utilities.utils import open_db_or_snapshot, stream_of_entity_with_metrics, EntityFilter
+
+ROUTINE_QUERY = "function ~Unknown ~Unresolved,method ~Unknown ~Unresolved,procedure ~Unknown ~Unresolved,routine ~Unknown ~Unresolved,classmethod ~Unknown ~Unresolved"
+ROUTINE_METRICS = ["CountLineCode", "CountParams", "CyclomaticStrict", "CyclomaticModified", "MaxNesting"]
+LAZY_MODULES = ["matplotlib", "mpld3", "requests"] # slow to import, so only imported by the code that uses them
+
+
+def parse_size(size):
+    size = size.strip()
+    multiplier = {"k": 1000, "m": 1000000}.get(size[-1:].lower(), 1)
+    return int(size[:-1] if multiplier > 1 else size) * multiplier
+
+
+def write_spec(output_dir, size_name, entity_count, latency_micros, **extra):
+    spec = {"entities": entity_count, "seed": 1, "latencyMicros": {"metric": latency_micros}}
+    spec.update(extra)
+    spec_path = os.path.join(output_dir, "%s%s.json" % (size_name, "-after" if "changeSeed" in spec else ""))
+    with open(spec_path, "w") as spec_file:
+        json.dump(spec, spec_file)
+    return spec_path
+
+
+def _stream_routines(spec_path):
+    db = open_db_or_snapshot(spec_path, FAKE_UNDERSTAND_DIR, snapshot=False)
+    entity_count = 0
+    for entity, container_file, metric_dict in stream_of_entity_with_metrics(db.ents(ROUTINE_QUERY), ROUTINE_METRICS, False, True,
+                                                                             EntityFilter(None, None, {}), "Routine"):
+        entity_count += 1
+    db.close()
+    return entity_count
+
+
+def measure_stream(spec_path):
+    start_time = time.perf_counter()
+    entity_count = _stream_routines(spec_path)
+    seconds = time.perf_counter() - start_time
+    tracemalloc.start() # a 2nd pass, as tracing slows everything down
+    _stream_routines(spec_path)
+    current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"stream.entitiesPerSec": entity_count / seconds, "stream.peakMB": peak_bytes / 1048576.0}
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1048576.0 if sys.platform == "darwin" else peak / 1024.0 # bytes on macOS, KB elsewhere
+
+
+def run_tool(tool, argv):
+    # runs in a fresh process (see measure_tool), so the peak RSS is the tool's own
+    sys.argv = [tool] + argv
+    start_time = time.perf_counter()
+    exit_code = 0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            importlib.import_module("utilities.%s" % tool).main()
+        except SystemExit as exit:
+            exit_code = exit.code if isinstance(exit.code, int) else 0
+    return [time.perf_counter() - start_time, _peak_rss_mb(), exit_code]
+
+
+def measure_tool(tool, argv):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        seconds, peak_mb, exit_code = executor.submit(run_tool, tool, argv).result()
+    measurements = {"%s.seconds" % tool: seconds}
+    if peak_mb is not None:
+        measurements["%s.peakMB" % tool] = peak_mb
+    return measurements
+
+
+def _imported_modules(tool):
+    """[[cumulative microseconds, module name]] of each module imported by "import utilities.<tool>", in a fresh process."""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import utilities.%s" % tool],
+                               cwd=os.path.dirname(BENCHMARKS_DIR), stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    modules = []
+    for line in completed.stderr.splitlines():
+        fields = line[len("import time:"):].split("|") if line.startswith("import time:") else []
+        if len(fields) == 3 and fields[1].strip().isdigit(): # not the header
+            modules.append([int(fields[1]), fields[2].strip()])
+    return modules
+
+
+def measure_startup(tool, runs=3):
+    import_micros = []
+    for run in range(runs):
+        modules = _imported_modules(tool)
+        import_micros.append(dict([[name, micros] for micros, name in modules])["utilities.%s" % tool])
+    lazy_modules = [name for micros, name in modules if name.split(".")[0] in LAZY_MODULES]
+    return {"%s.importMs" % tool: min(import_micros) / 1000.0, "%s.lazyModules" % tool: len(lazy_modules)}
+
+
+def tool_arguments(tool, spec_path, spec_after_path, output_dir):
+    common = ["--dllDir=%s" % FAKE_UNDERSTAND_DIR, "--outputDir=%s" % output_dir]
+    if tool == "srcdiffplot":
+        return ["--before=%s" % spec_path, "--after=%s" % spec_after_path] + common
+    return ["--in=%s" % spec_path] + common
+
+
+def check_thresholds(size_name, measurements, thresholds):
+    regressions = []
+    size_thresholds = thresholds.get(size_name, {})
+    for name, min_value in size_thresholds.get("min", {}).items():
+        if name in measurements and measurements[name] < min_value:
+            regressions.append("%s %s: %.2f<%s" % (size_name, name, measurements[name], min_value))
+    for name, max_value in size_thresholds.get("max", {}).items():
+        if name in measurements and measurements[name] > max_value:
+            regressions.append("%s %s: %.2f>%s" % (size_name, name, measurements[name], max_value))
+    return regressions
+
+
+def main():
+    start_time = datetime.datetime.now()
+    arguments = docopt(__doc__, version=VERSION)
+    print ("\r\n====== run_benchmarks @ https://github.com/sglebs/srccheck ==========")
+    print(arguments)
+    thresholds_path = arguments["--thresholds"]
+    if not os.path.exists(thresholds_path):
+        thresholds_path = os.path.join(BENCHMARKS_DIR, thresholds_path)
+    try:
+        with open(thresholds_path) as thresholds_file:
+            thresholds = json.load(thresholds_file)
+    except (IOError, ValueError) as ex:
+        print("SEVERE WARNING loading json: %s" % ex)
+        thresholds = {}
+    output_dir = arguments["--outputDir"] or tempfile.mkdtemp(prefix="srccheck-benchmarks-")
+    os.makedirs(output_dir, exist_ok=True)
+    tools = [tool.strip() for tool in arguments["--tools"].split(",") if len(tool.strip()) > 0]
+    latency_micros = int(arguments["--latencyMicros"])
+    measurements_by_size = {}
+    regressions = []
+    for size_name in [size.strip() for size in arguments["--sizes"].split(",") if len(size.strip()) > 0]:
+        entity_count = parse_size(size_name)
+        print ("\r\n====== %s entities ==========" % size_name)
+        spec_path = write_spec(output_dir, size_name, entity_count, latency_micros)
+        spec_after_path = write_spec(output_dir, size_name, entity_count, latency_micros, changeSeed=2, changedFraction=0.1)
+        measurements = measure_stream(spec_path)
+        for tool in tools:
+            tool_output_dir = os.path.join(output_dir, "%s-%s" % (size_name, tool))
+            os.makedirs(tool_output_dir, exist_ok=True)
+            measurements.update(measure_tool(tool, tool_arguments(tool, spec_path, spec_after_path, tool_output_dir)))
+        for name, value in sorted(measurements.items()):
+            print("%s = %.2f" % (name, value))
+        measurements_by_size[size_name] = measurements
+        regressions.extend(check_thresholds(size_name, measurements, thresholds))
+    startup_tools = [tool.strip() for tool in arguments["--startupTools"].split(",") if len(tool.strip()) > 0]
+    if len(startup_tools) > 0:
+        print ("\r\n====== startup ==========")
+        measurements = {}
+        for tool in startup_tools:
+            measurements.update(measure_startup(tool))
+        for name, value in sorted(measurements.items()):
+            print("%s = %.2f" % (name, value))
+        measurements_by_size["startup"] = measurements
+        regressions.extend(check_thresholds("startup", measurements, thresholds))
+    print ("\r\n====== Regressions ===========")
+    for regression in regressions:
+        print(regression)
+    if arguments["--report"]:
+        with open(arguments["--report"], "w") as report_file:
+            json.dump(measurements_by_size, report_file, indent=2, sort_keys=True)
+        print("+++ Measurements saved to %s" % arguments["--report"])
+    end_time = datetime.datetime.now()
+    print ("\r\n--------------------------------------------------")
+    print ("Started : %s" % str(start_time))
+    print ("Finished: %s" % str(end_time))
+    print ("Total: %s" % str(end_time - start_time))
+    print ("Regressions: %i" % len(regressions))
+    print ("--------------------------------------------------")
+    sys.exit(len(regressions))
+
+if __name__ == '__main__':
+    main()
@@ -30,6 +30,7 @@ setup(
             'csvscatterplot = utilities.csvscatterplot:main',
             'xmlkaloi = utilities.xmlkaloi:main',
             'jd2csv = utilities.jd2csv:main',
+            'srcextract = utilities.srcextract:main',
         ],
     }
 )
@@ -0,0 +1,21 @@
+# Importing a tool must not import matplotlib, mpld3 or requests: those load on first use, so tools that don't plot, or
+# runs that don't post to Sonar, start fast. Each tool is imported in a fresh interpreter, as other tests may load them.
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS = ["srccheck", "srchistplot", "srcscatterplot", "srcdiffplot", "srcinstplot", "srcextract",
+         "csvkaloi", "csvhistplot", "csvscatterplot", "xmlkaloi", "jd2csv"]
+LAZY_MODULES = ["matplotlib", "mpld3", "requests"]
+
+
+@pytest.mark.parametrize("tool", TOOLS)
+def test_tool_import_leaves_lazy_modules_unloaded(tool):
+    completed = subprocess.run([sys.executable, "-c", "import sys, utilities.%s; print('\\n'.join(sys.modules))" % tool],
+                               cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert completed.returncode == 0, completed.stderr
+    loaded = [name for name in completed.stdout.splitlines() if name.split(".")[0] in LAZY_MODULES]
+    assert loaded == []
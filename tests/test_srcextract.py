@@ -0,0 +1,36 @@
+# srccheck must give the same verdict from a snapshot saved by a default srcextract run as from the UDB itself.
+# Runs the tools on the fake Understand API of benchmarks/fake_understand, each in its own process.
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_UNDERSTAND_DIR = os.path.join(REPO_DIR, "benchmarks", "fake_understand")
+
+
+def run_tool(tool, *args):
+    completed = subprocess.run([sys.executable, "-m", "utilities.%s" % tool, "--dllDir=%s" % FAKE_UNDERSTAND_DIR] + list(args),
+                               cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    return completed.returncode, completed.stdout
+
+
+def violations_of(output):
+    return [line for line in output.splitlines() if line.startswith("Violations:")]
+
+
+def test_srccheck_of_default_snapshot_matches_udb(tmp_path):
+    spec_path = str(tmp_path / "spec.json")
+    with open(spec_path, "w") as spec_file:
+        json.dump({"entities": 2000}, spec_file)
+    snapshot_path = str(tmp_path / "spec.npz")
+    returncode, output = run_tool("srcextract", "--in=%s" % spec_path, "--out=%s" % snapshot_path)
+    assert returncode == 0, output
+    for thresholds in [[], # srccheck's defaults
+                       ['--maxClassMetrics={"CountDeclMethodNonStub":20}']]: # synthetic, stored with its base metrics
+        udb_returncode, udb_output = run_tool("srccheck", "--in=%s" % spec_path, "--outputDir=%s" % tmp_path, *thresholds)
+        snapshot_returncode, snapshot_output = run_tool("srccheck", "--snapshot=%s" % snapshot_path, "--outputDir=%s" % tmp_path, *thresholds)
+        assert "Error" not in snapshot_output, snapshot_output
+        assert len(violations_of(udb_output)) == 1, udb_output
+        assert violations_of(snapshot_output) == violations_of(udb_output)
+        assert snapshot_returncode == udb_returncode
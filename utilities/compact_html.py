@@ -0,0 +1,279 @@
+# Compact HTML for scatter plots (--htmlWriter=compact). mpld3 writes the JSON of the whole figure, with one object and
+# one tooltip string per point, into each HTML file. Here the points go as base64 typed arrays instead (Float32Array
+# coordinates and sizes, Uint32Array indices into tables of the distinct colors and names), drawn on a <canvas> by one
+# small renderer, srcscatter.js, saved once next to the HTML files. Python just dumps arrays: no per-point JSON.
+import base64
+import json
+import os
+
+import numpy as np
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize, to_hex
+
+RENDERER_FILE_NAME = "srcscatter.js"
+
+RENDERER_JAVASCRIPT = r"""// srcscatter.js - renders the scatter plots saved by srccheck tools with --htmlWriter=compact
+var srcscatter = (function () {
+    var WIDTH = 640, HEIGHT = 480, MARGIN = {left: 70, right: 20, top: 40, bottom: 50};
+    var PIXELS_PER_POINT = 100 / 72; // sizes are areas in points^2, as in matplotlib
+
+    function decode(base64, ArrayType) {
+        var bytes = atob(base64), view = new Uint8Array(bytes.length);
+        for (var i = 0; i < bytes.length; i++) {
+            view[i] = bytes.charCodeAt(i);
+        }
+        return new ArrayType(view.buffer);
+    }
+
+    function niceTicks(low, high) {
+        var span = (high - low) || 1, step = Math.pow(10, Math.floor(Math.log(span / 8) / Math.LN10)), ratio = span / 8 / step;
+        step *= ratio > 5 ? 10 : ratio > 2 ? 5 : ratio > 1 ? 2 : 1;
+        var ticks = [];
+        for (var tick = Math.ceil(low / step) * step; tick <= high + step * 1e-9; tick += step) {
+            ticks.push(Math.abs(tick) < step * 1e-9 ? 0 : tick);
+        }
+        return ticks;
+    }
+
+    function label(value) {
+        return String(Math.round(value * 1e6) / 1e6);
+    }
+
+    function range(values, extra) {
+        var low = Infinity, high = -Infinity;
+        values.forEach(function (array) {
+            for (var i = 0; i < array.length; i++) {
+                low = Math.min(low, array[i]);
+                high = Math.max(high, array[i]);
+            }
+        });
+        extra.forEach(function (value) {
+            low = Math.min(low, value);
+            high = Math.max(high, value);
+        });
+        if (!(high > low)) {
+            low = (isFinite(low) ? low : 0) - 0.5;
+            high = low + 1;
+        }
+        var margin = (high - low) * 0.05; // like matplotlib's default margins
+        return [low - margin, high + margin];
+    }
+
+    function render(container, plot) {
+        var layers = plot.layers.map(function (layer) {
+            var x = decode(layer.x, Float32Array), order = new Uint32Array(x.length);
+            for (var i = 0; i < order.length; i++) {
+                order[i] = i; // drawing order: a click sends a point to the back, so the ones below can be reached
+            }
+            return {x: x, y: decode(layer.y, Float32Array), sizes: decode(layer.sizes, Float32Array),
+                    colorIndex: decode(layer.colorIndex, Uint32Array), nameIndex: decode(layer.nameIndex, Uint32Array),
+                    colors: layer.colors, names: layer.names, alpha: layer.alpha, square: layer.marker === "square", order: order};
+        });
+        var lineXs = [], lineYs = [];
+        plot.lines.forEach(function (line) {
+            lineXs.push(line[0], line[2]);
+            lineYs.push(line[1], line[3]);
+        });
+        var xRange = range(layers.map(function (layer) { return layer.x; }), lineXs.concat(plot.xTicks || []));
+        var yRange = range(layers.map(function (layer) { return layer.y; }), lineYs.concat(plot.yTicks || []));
+        var plotWidth = WIDTH - MARGIN.left - MARGIN.right, plotHeight = HEIGHT - MARGIN.top - MARGIN.bottom;
+        function xPixel(x) { return MARGIN.left + (x - xRange[0]) / (xRange[1] - xRange[0]) * plotWidth; }
+        function yPixel(y) { return MARGIN.top + (yRange[1] - y) / (yRange[1] - yRange[0]) * plotHeight; }
+        function radius(layer, i) { return Math.sqrt(layer.sizes[i]) / 2 * PIXELS_PER_POINT; }
+
+        container.style.position = "relative";
+        var ratio = window.devicePixelRatio || 1, canvas = document.createElement("canvas");
+        canvas.width = WIDTH * ratio;
+        canvas.height = HEIGHT * ratio;
+        canvas.style.width = WIDTH + "px";
+        canvas.style.height = HEIGHT + "px";
+        container.appendChild(canvas);
+        var tooltip = document.createElement("div");
+        tooltip.style.cssText = "position:absolute;display:none;pointer-events:none;background:white;font:12px sans-serif;";
+        container.appendChild(tooltip);
+        var position = document.createElement("div");
+        position.style.cssText = "position:absolute;right:" + MARGIN.right + "px;top:" + (MARGIN.top + 4) + "px;font:12px sans-serif;";
+        container.appendChild(position);
+        var context = canvas.getContext("2d");
+        context.scale(ratio, ratio);
+
+        function draw() {
+            context.clearRect(0, 0, WIDTH, HEIGHT);
+            context.save();
+            context.beginPath();
+            context.rect(MARGIN.left, MARGIN.top, plotWidth, plotHeight);
+            context.clip();
+            layers.forEach(function (layer) {
+                context.globalAlpha = layer.alpha;
+                for (var j = 0; j < layer.order.length; j++) {
+                    var i = layer.order[j], r = radius(layer, i), x = xPixel(layer.x[i]), y = yPixel(layer.y[i]);
+                    context.fillStyle = layer.colors[layer.colorIndex[i]];
+                    if (layer.square) {
+                        context.fillRect(x - r, y - r, 2 * r, 2 * r);
+                    } else {
+                        context.beginPath();
+                        context.arc(x, y, r, 0, 2 * Math.PI);
+                        context.fill();
+                    }
+                }
+            });
+            plot.lines.forEach(function (line) { // [x0, y0, x1, y1, color, width, alpha], dashed
+                context.globalAlpha = line[6];
+                context.strokeStyle = line[4];
+                context.lineWidth = line[5];
+                context.setLineDash([6, 4]);
+                context.beginPath();
+                context.moveTo(xPixel(line[0]), yPixel(line[1]));
+                context.lineTo(xPixel(line[2]), yPixel(line[3]));
+                context.stroke();
+            });
+            context.restore();
+            context.globalAlpha = 1;
+            context.setLineDash([]);
+            context.strokeStyle = "black";
+            context.lineWidth = 1;
+            context.strokeRect(MARGIN.left, MARGIN.top, plotWidth, plotHeight);
+            context.fillStyle = "black";
+            context.font = "12px sans-serif";
+            context.textAlign = "center";
+            (plot.xTicks || niceTicks(xRange[0], xRange[1])).forEach(function (tick) {
+                var x = xPixel(tick);
+                context.fillText(label(tick), x, MARGIN.top + plotHeight + 16);
+                if (plot.grid) {
+                    context.strokeStyle = "#b0b0b0";
+                    context.beginPath();
+                    context.moveTo(x, MARGIN.top);
+                    context.lineTo(x, MARGIN.top + plotHeight);
+                    context.stroke();
+                }
+            });
+            context.textAlign = "right";
+            (plot.yTicks || niceTicks(yRange[0], yRange[1])).forEach(function (tick) {
+                var y = yPixel(tick);
+                context.fillText(label(tick), MARGIN.left - 6, y + 4);
+                if (plot.grid) {
+                    context.strokeStyle = "#b0b0b0";
+                    context.beginPath();
+                    context.moveTo(MARGIN.left, y);
+                    context.lineTo(MARGIN.left + plotWidth, y);
+                    context.stroke();
+                }
+            });
+            context.textAlign = "center";
+            context.fillText(plot.xLabel, MARGIN.left + plotWidth / 2, HEIGHT - 12);
+            context.font = "14px sans-serif";
+            context.fillText(plot.title, WIDTH / 2, MARGIN.top - 14);
+            context.save();
+            context.font = "12px sans-serif";
+            context.translate(16, MARGIN.top + plotHeight / 2);
+            context.rotate(-Math.PI / 2);
+            context.fillText(plot.yLabel, 0, 0);
+            context.restore();
+        }
+
+        function pointAt(event) { // the topmost point under the mouse: [layer, position in its drawing order]
+            var bounds = canvas.getBoundingClientRect(), mouseX = event.clientX - bounds.left, mouseY = event.clientY - bounds.top;
+            for (var l = layers.length - 1; l >= 0; l--) {
+                var layer = layers[l];
+                for (var j = layer.order.length - 1; j >= 0; j--) {
+                    var i = layer.order[j], r = radius(layer, i), dx = mouseX - xPixel(layer.x[i]), dy = mouseY - yPixel(layer.y[i]);
+                    if (layer.square ? (Math.abs(dx) <= r && Math.abs(dy) <= r) : (dx * dx + dy * dy <= r * r)) {
+                        return [layer, j];
+                    }
+                }
+            }
+            return null;
+        }
+
+        canvas.addEventListener("mousemove", function (event) {
+            var bounds = canvas.getBoundingClientRect(), mouseX = event.clientX - bounds.left, mouseY = event.clientY - bounds.top;
+            position.textContent = (xRange[0] + (mouseX - MARGIN.left) / plotWidth * (xRange[1] - xRange[0])).toFixed(2) + " " +
+                                   (yRange[1] - (mouseY - MARGIN.top) / plotHeight * (yRange[1] - yRange[0])).toFixed(2);
+            var hit = pointAt(event);
+            if (hit === null) {
+                tooltip.style.display = "none";
+                return;
+            }
+            tooltip.innerHTML = hit[0].names[hit[0].nameIndex[hit[0].order[hit[1]]]];
+            tooltip.style.left = (mouseX + 10) + "px";
+            tooltip.style.top = (mouseY - 25) + "px";
+            tooltip.style.display = "block";
+        });
+        canvas.addEventListener("mouseleave", function () {
+            tooltip.style.display = "none";
+        });
+        canvas.addEventListener("mousedown", function (event) {
+            var hit = pointAt(event);
+            if (hit !== null) {
+                var order = hit[0].order, i = order[hit[1]];
+                order.copyWithin(1, 0, hit[1]);
+                order[0] = i;
+                draw();
+            }
+        });
+        draw();
+    }
+
+    return {render: render};
+})();
+"""
+
+
+def _packed(values, dtype):
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode("ascii")
+
+
+def _distinct(values):
+    """[distinct values, in order of appearance], [index of each value in them]"""
+    index_by_value = {}
+    indices = [index_by_value.setdefault(value, len(index_by_value)) for value in values]
+    return [list(index_by_value), indices]
+
+
+def _colors(color_values, point_count, cmap, vmin):
+    """[distinct colors, as #rrggbb], [index of the color of each point]: numbers through cmap, as ax.scatter(c=...) does."""
+    if np.ndim(color_values) == 0 or (point_count > 0 and isinstance(color_values[0], str)):
+        colors, indices = _distinct([color_values] * point_count if np.ndim(color_values) == 0 else color_values)
+        return [[to_hex(color) for color in colors], indices]
+    numbers = np.asarray(color_values, dtype=np.float64)
+    distinct_numbers, indices = np.unique(numbers, return_inverse=True)
+    mappable = ScalarMappable(norm=Normalize(vmin=vmin, vmax=numbers.max() if point_count > 0 else None), cmap=cmap)
+    colors, color_indices = _distinct([to_hex(rgba) for rgba in mappable.to_rgba(distinct_numbers)])
+    return [colors, np.asarray(color_indices)[indices]]
+
+
+def scatter_layer(x_values, y_values, sizes, color_values, names, alpha=0.5, marker="circle", cmap="viridis", vmin=None):
+    """One ax.scatter of points with tooltips (names, which are HTML), in the compact format."""
+    point_count = len(x_values)
+    colors, color_indices = _colors(color_values, point_count, cmap, vmin)
+    distinct_names, name_indices = _distinct(names)
+    return {"x": _packed(x_values, "<f4"),
+            "y": _packed(y_values, "<f4"),
+            "sizes": _packed(np.broadcast_to(np.asarray(sizes, dtype=np.float64), (point_count,)), "<f4"),
+            "colors": colors,
+            "colorIndex": _packed(color_indices, "<u4"),
+            "names": distinct_names,
+            "nameIndex": _packed(name_indices, "<u4"),
+            "alpha": alpha,
+            "marker": marker}
+
+
+def save_compact_scatter_html(filename, title, x_label, y_label, layers, lines=(), x_ticks=None, y_ticks=None, grid=False):
+    """Saves the HTML of a scatter plot of layers (see scatter_layer), plus dashed lines [x0, y0, x1, y1, color, width, alpha],
+    and srcscatter.js in the same dir, if not there yet."""
+    renderer_path = os.path.join(os.path.dirname(filename), RENDERER_FILE_NAME)
+    try:
+        with open(renderer_path) as renderer_file:
+            up_to_date = renderer_file.read() == RENDERER_JAVASCRIPT
+    except IOError:
+        up_to_date = False
+    if not up_to_date:
+        with open(renderer_path, "w") as renderer_file:
+            renderer_file.write(RENDERER_JAVASCRIPT)
+    plot = {"title": title, "xLabel": x_label, "yLabel": y_label, "layers": layers, "lines": [list(line) for line in lines],
+            "xTicks": x_ticks, "yTicks": y_ticks, "grid": grid}
+    with open(filename, "w") as output_file:
+        output_file.write('<html><head><meta charset="utf-8"><script src="%s"></script></head><body>' % RENDERER_FILE_NAME)
+        output_file.write('<div id="srcscatter"></div><script>srcscatter.render(document.getElementById("srcscatter"), ')
+        output_file.write(json.dumps(plot).replace("</", "<\\/")) # no "</script>" in names can end the script early
+        output_file.write(");</script></body></html>")
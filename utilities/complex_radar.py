@@ -18,67 +18,41 @@ def _scale_data(data, ranges):
     return result
 
 class ComplexRadar():
+    """Radar (kiviat) chart with a scale per variable, on a single polar axes: values are drawn scaled from their
+    variable's range to [AX_MIN_VALUE, AX_MAX_VALUE] and each spoke is labeled with the levels of its own range.
+    Plot/fill as many series as needed on the same radar. (It used to take one polar axes per variable, and one
+    radar per series: with 40+ variables, 80+ overlaid axes to render.)"""
     def __init__(self, fig, variables, ranges,
                  n_ordinate_levels=6, precision=2, textsize="smaller", numberssize="smaller", textposrate=1.08, textposrotation=60):
         angles = np.arange(0, 360, 360./len(variables))
 
-        axes = [fig.add_axes([AX_MIN_VALUE,AX_MIN_VALUE,AX_MAX_VALUE,AX_MAX_VALUE],polar=True,
-                label = "axes{}".format(i))
-                for i in range(len(variables))]
-        #mqm - apparently axes[0] is the circle perimeter, with the var names
-        l, text = axes[0].set_thetagrids(angles,
-                                         labels=variables,
-                                         #frac=textposrate, #no longer exists
-                                         horizontalalignment='left',
-                                         position=(0.1,1-textposrate),
-                                         size=textsize)
+        ax = fig.add_axes([AX_MIN_VALUE,AX_MIN_VALUE,AX_MAX_VALUE,AX_MAX_VALUE],polar=True, label="radar")
+        #mqm - the circle perimeter, with the var names
+        l, text = ax.set_thetagrids(angles,
+                                    labels=variables,
+                                    #frac=textposrate, #no longer exists
+                                    horizontalalignment='left',
+                                    position=(0.1,1-textposrate),
+                                    size=textsize)
 
         #Rotation is a mistery in newer versions of matplotlib
         # was: [txt.set_rotation(angle - textposrotation) for txt, angle in zip(text, angles)]
 
-        #works but same value for all. Useless
-        #axes[0].tick_params(axis='x', labelrotation=60)
-
-        #does not work
-        #[txt.set_rotation(angle-textposrotation) for txt, angle in zip(text, angles)]
-
-        #does not work
-        #locs, labels = axes[0].get_xticks()
-        #[label.set_rotation(180) for label in labels]
-
-        #does not work
-        #for label,angle in zip (axes[0].get_xticklabels(), angles): # https://stackoverflow.com/questions/43152502/how-can-i-rotate-xticklabels-in-matplotlib-so-that-the-spacing-between-each-xtic
-        #    #label.set_ha("left") # works
-        #    label.set_rotation(angle-textposrotation) # does not work
-
-
-        for ax in axes[1:]:
-            ax.patch.set_visible(False)
-            ax.grid(False)
-            ax.xaxis.set_visible(False)
-        for i, ax in enumerate(axes):
-            grid = np.linspace(*ranges[i],
-                               num=n_ordinate_levels)
-            adjusted_range = [(AX_MIN_VALUE,AX_MAX_VALUE) for i in range(len(ranges))] # radial grids must be strictly positive in matplotlib
-            adjusted_grid = np.linspace(*adjusted_range[i],
-                               num=n_ordinate_levels)
-            gridlabel = ["{}".format(round(x,precision))
-                         for x in grid]
-            if ranges[i][0] > ranges[i][1]:
-                grid = grid[::-1] # hack to invert grid
-                          # gridlabels aren't reversed
-            gridlabel[0] = "" # clean up origin
-            ax.set_rgrids(adjusted_grid, labels=gridlabel,
-                         angle=angles[i], size=numberssize)
-            #ax.spines["polar"].set_visible(False)
-            ax.set_ylim(*adjusted_range[i])
+        adjusted_grid = np.linspace(AX_MIN_VALUE, AX_MAX_VALUE, num=n_ordinate_levels) # radial grids must be strictly positive in matplotlib
+        ax.set_rgrids(adjusted_grid, labels=[""] * n_ordinate_levels, angle=angles[0]) # the circles, shared by all scales
+        ax.set_ylim(AX_MIN_VALUE, AX_MAX_VALUE)
+        for angle, variable_range in zip(np.deg2rad(angles), ranges):
+            grid = np.linspace(*variable_range, num=n_ordinate_levels)
+            for radius, level in list(zip(adjusted_grid, grid))[1:]: # no label at the origin
+                ax.text(angle, radius, "{}".format(round(level,precision)), size=numberssize,
+                        horizontalalignment="center", verticalalignment="center")
         # variables for plotting
         self.angle = np.deg2rad(np.r_[angles, angles[0]])
         self.ranges = ranges
-        self.ax = axes[0]
+        self.ax = ax
     def plot(self, data, *args, **kw):
         sdata = _scale_data(data, self.ranges)
         self.ax.plot(self.angle, np.r_[sdata, sdata[0]], *args, **kw)
     def fill(self, data, *args, **kw):
         sdata = _scale_data(data, self.ranges)
-        self.ax.fill(self.angle, np.r_[sdata, sdata[0]], *args, **kw)
\ No newline at end of file
+        self.ax.fill(self.angle, np.r_[sdata, sdata[0]], *args, **kw)
@@ -5,7 +5,8 @@ Usage:
                 [--outputDir=<path to dir where to save files>] \r\n \
                 [--histogramColumn=<columnName>] \r\n \
                 [--logarithmic]  \r\n \
-                [--showMeanMedian]
+                [--showMeanMedian] \r\n \
+                [--plotCache=<plotCache>]
 
 
 Options:
@@ -14,6 +15,7 @@ Options:
     -m, --showMeanMedian                If you want to show dotted lines for mean (blue) and median (red) [default: false]
     -l, --logarithmic                   If you want logarithmic y scale. [default: false]
     --outputDir=<path>                  Where files should be generated. [default: .]
+    --plotCache=<plotCache>             Dir of a plot cache, created if needed. Plots drawn from the same values and options as in a previous run are hard-linked (or copied) from it instead of being rendered again.
 
 
 Author:
@@ -25,6 +27,7 @@ import datetime
 import os
 import csv
 from docopt import docopt
+from utilities.plotcache import plot_cache
 from utilities.utils import save_histogram
 from utilities import VERSION
 import math
@@ -59,7 +62,10 @@ def main():
     arguments = docopt(__doc__, version=VERSION)
     print("\r\n====== csvhistplot @ https://github.com/sglebs/srccheck ==========")
     print("Processing %s" % arguments["--in"])
+    plot_cache.start(arguments["--plotCache"])
     hist_plot(arguments)
+    if plot_cache.enabled:
+        print(plot_cache.summary())
     end_time = datetime.datetime.now()
     print("\r\n--------------------------------------------------")
     print("Started : %s" % str(start_time))
@@ -5,7 +5,8 @@ Usage:
                 [--maxMetrics=<maxMetrics>]\r\n \
                 [--columnWithItemName=<aName>]\r\n \
                 [--showHighest]  \r\n \
-                [--adaptive]
+                [--adaptive] \r\n \
+                [--profileReport=<profileReport>]
 
 Options:
   --in=<inputCSV>                     Input CSV file path. [default: instability.csv]
@@ -13,6 +14,7 @@ Options:
   --columnWithItemName=<aName>        The name of the CSV column where the element names are, for printing purposes. [default: Component]
   -s, --showHighest                   If you want to show (print) the highest valued elements (highest metric) even if not a violation. [default: false]
   -a, --adaptive                      If you want csvkaloi to be adaptive and update the input json files with current max values
+  --profileReport=<profileReport>     Path of a JSON file to save the wall time, CPU time, peak memory and row counts of each phase of the run to. Slows the run down.
 
 
 Author:
@@ -32,91 +34,64 @@ import csv
 from docopt import docopt
 
 from utilities import VERSION
-
-STATS_LAMBDAS = {"AVG": statistics.mean,
-                 "MEDIAN": statistics.median,
-                 "MEDIANHIGH": statistics.median_high,
-                 "MEDIANLOW": statistics.median_low,
-                 "MEDIANGROUPED": statistics.median_grouped,
-                 "MODE": statistics.mode,
-                 "STDEV": statistics.pstdev,
-                 "VARIANCE": statistics.pvariance}
-
-def metric_name_for_sorting(metric_name):
-    if ":" not in metric_name:
-        return metric_name
-    else:
-        parts = metric_name.split(":")
-        return parts[-1] + parts[0]
+from utilities.profiling import profiler
+from utilities.stats import column_stats, metric_name_for_sorting, split_stats_metric
+
+import numpy as np
+
+def read_csv_columns(csv_path, column_with_name, metric_columns):
+    """One pass over the CSV: the item names, and a NumPy column of floats per metric."""
+    names = []
+    values_by_metric = {metric: [] for metric in metric_columns}
+    with open(csv_path) as csvfile:
+        for row in profiler.counted("CSV read", csv.DictReader(csvfile)):
+            names.append(row[column_with_name])
+            for metric, values in values_by_metric.items():
+                values.append(float(row[metric]))
+    return [names, {metric: np.asarray(values, dtype=np.float64) for metric, values in values_by_metric.items()}]
 
 def process_csv_metrics (cmdline_arguments, max_values_allowed_by_metric):
     violation_count = 0
     highest_values_found_by_metric = {}
-    last_processed_metric = "" # fix for #21, to reuse values
-    last_all_values = [] # fix for #21, to reuse values
-    last_max_value_found = -1
-    stats_cache = {}  # fix for #22 - use cached value for stats
     sorted_metrics = sorted(max_values_allowed_by_metric.keys(), key=metric_name_for_sorting)
+    stat_names_by_metric = {} # all the stats of a column are computed together
+    for metric in sorted_metrics:
+        lambda_name, adjusted_metric, lambda_stats = split_stats_metric(metric)
+        stat_names = stat_names_by_metric.setdefault(adjusted_metric, [])
+        if lambda_stats is not None:
+            stat_names.append(lambda_name)
+    names, values_by_metric = read_csv_columns(cmdline_arguments.get("--in", False),
+                                               cmdline_arguments.get("--columnWithItemName", False),
+                                               stat_names_by_metric.keys())
+    with profiler.phase("CSV stats"):
+        stats_values_by_metric = {metric: column_stats(values_by_metric[metric], stat_names)
+                                  for metric, stat_names in stat_names_by_metric.items() if len(stat_names) > 0}
     for metric in sorted_metrics:
         max_allowed_value = max_values_allowed_by_metric[metric]
-        all_values = [] # we may need to collect all values, if we are going to save a histogram
-        lambda_stats = None
-        adjusted_metric = metric
-        if metric.count(':') == 1: #fix for #42 - can have only 1 :
-            lambda_name, adjusted_metric = metric.split(":")
-            lambda_stats = STATS_LAMBDAS.get(lambda_name.upper().strip(), None)
-
-        def metric_values(): # generator of a stream of float values, to be consumed by the stats functions
-            with open(cmdline_arguments.get("--in", False)) as csvfile:
-                reader = csv.DictReader(csvfile)
-                column_with_name = cmdline_arguments.get("--columnWithItemName", False)
-                for row in reader:
-                    yield [row[column_with_name], float(row[adjusted_metric])]
-
+        lambda_name, adjusted_metric, lambda_stats = split_stats_metric(metric)
+        values = values_by_metric[adjusted_metric]
         if lambda_stats is None:  # regular, not stats
-            max_value_found = -1
-            entity_with_max_value_found = None
-            has_stats_counterpart = (":%s" % metric) in "".join(sorted_metrics)
-            for entity, metric_value in metric_values():
-                if has_stats_counterpart: # fix for #22 - cache values for stats
-                    all_values.append(metric_value)
-                if metric_value > highest_values_found_by_metric.get(metric, -1): # even a zero we want to tag as a max
-                    highest_values_found_by_metric[metric] = metric_value
-                max_allowed = max_values_allowed_by_metric[metric]
-                if metric_value > max_allowed: # we found a violation
-                    violation_count = violation_count + 1
-                    print("'%s' violated '%s' threshold: %f > %f"% (entity, metric, metric_value, max_allowed))
-                if metric_value > max_value_found: # max found, which could be a violator or not
-                    max_value_found = metric_value
-                    entity_with_max_value_found = entity
-            if entity_with_max_value_found is not None:
+            for position in np.flatnonzero(values > max_allowed_value): # we found violations
+                violation_count = violation_count + 1
+                print("'%s' violated '%s' threshold: %f > %f"% (names[position], metric, values[position], max_allowed_value))
+            candidates = np.flatnonzero(values > -1) # even a zero we want to tag as a max
+            if len(candidates) > 0:
+                position = candidates[np.argmax(values[candidates])] # max found (the 1st one), which could be a violator or not
+                max_value_found = values[position].item()
+                highest_values_found_by_metric[metric] = max_value_found
                 if bool(cmdline_arguments["--showHighest"]):
                     print("...........................................")
                     kind = "violator"
                     if max_value_found <= max_allowed_value:
                         kind = "non violator"
                     print("INFO: HIGHEST %s %s found (violation threshold is %s):\t" % (metric, kind, max_allowed_value), end="")
-                    print("'%s' violated '%s' threshold: %f > %f"% (entity_with_max_value_found, metric, max_value_found, max_allowed_value))
-                    #lambda_to_print(entity_with_max_value_found, metric, max_value_found, container_file=container_file) # prints the max found, which may be a violator or not
+                    print("'%s' violated '%s' threshold: %f > %f"% (names[position], metric, max_value_found, max_allowed_value))
                     print("...........................................")
-            last_processed_metric = metric  # fix for #21, to reuse values
-            last_all_values = all_values  # fix for #21, to reuse values
-            last_max_value_found = max_value_found
-        else: # stats, compute on the whole population
-            if adjusted_metric == last_processed_metric: # fix for #21 - reuses values, thanks to sorting we know teh pure metric must have come just before
-                all_values = last_all_values
-                max_value_found = last_max_value_found
-            else:
-                all_values = [value for entity, value in metric_values()]
-                last_processed_metric = adjusted_metric  # fix for 21. in case only stats functions are used, not the pure one.
-                last_all_values = all_values  # fix for #21, same as above
-            stats_value = stats_cache.get(adjusted_metric, {}).get(lambda_name, None) # fix for #22 - used cached value for stats
-            if stats_value is None:
-                try:
-                    stats_value = lambda_stats(all_values)
-                except statistics.StatisticsError as se:
-                    print ("ERROR in %s: %s" % (metric, se))
-                    continue
+        else: # stats, computed on the whole population
+            stats_value = stats_values_by_metric[adjusted_metric][lambda_name]
+            if isinstance(stats_value, statistics.StatisticsError):
+                print ("ERROR in %s: %s" % (metric, stats_value))
+                continue
 
             highest_values_found_by_metric[metric] = stats_value
             if stats_value > max_allowed_value:  # we found a violation
@@ -127,10 +102,6 @@ def process_csv_metrics (cmdline_arguments, max_values_allowed_by_metric):
                     print("...........................................")
                     print("INFO(STATS): %s = %s (violation threshold is %s):" % (metric, stats_value, max_allowed_value))
                     print("...........................................")
-            #if mean is not None:
-            #    stats_cache[metric] = {"AVG": mean, "MEDIAN": median, "STDEV": pstdev} # fix for #22 - used cached value for stats
-            #if verbose:
-            #    print("Saved %s" % file_name)
 
     return [violation_count, highest_values_found_by_metric]
 
@@ -155,6 +126,7 @@ def write_metrics_thresholds(json_path, new_max_metrics):
 def main():
     start_time = datetime.datetime.now()
     arguments = docopt(__doc__, version=VERSION)
+    profiler.start(arguments["--profileReport"], "csvkaloi")
     print("\r\n====== csvkaloi @ https://github.com/sglebs/srccheck ==========")
     print(arguments)
 
@@ -175,6 +147,7 @@ def main():
     print("Total: %s" % str(end_time-start_time))
     print("Violations: %i" % total_violation_count)
     print("--------------------------------------------------")
+    profiler.save()
     sys.exit(total_violation_count)
 
 if __name__ == '__main__':
@@ -12,6 +12,9 @@ Usage:
                    [--ballSizeMin=<aNumber>] \r\n \
                    [--ballSizeMax=<aNumber>] \r\n \
                    [--ballSizeRate=<aNumber>] \r\n \
+                   [--maxPoints=<maxPoints>] \r\n \
+                   [--htmlWriter=<htmlWriter>] \r\n \
+                   [--plotCache=<plotCache>] \r\n \
 
 
 Options:
@@ -26,6 +29,9 @@ Options:
   --entityNames=<columnName>  Name(s) of the column(s) in the CSV for names in the circles. Separate with ",". [default: Component]
   --colors=<columnName>       Name of the column in the CSV for colors of the circles.
   --outputDir=<path>          Where files should be generated. [default: .]
+  --maxPoints=<maxPoints>     Max circles (each with its tooltip). Beyond that, only the outliers are circles, the other rows are counted in grey cells. 0 for no limit. [default: 0]
+  --htmlWriter=<htmlWriter>   mpld3 (the whole figure) or compact (the points as typed arrays, drawn by srcscatter.js, saved next to the HTML files): much smaller files, which open faster. [default: mpld3]
+  --plotCache=<plotCache>     Dir of a plot cache, created if needed. Plots drawn from the same values and options as in a previous run are hard-linked (or copied) from it instead of being rendered again.
 
 
 Author:
@@ -35,8 +41,10 @@ Author:
 
 import datetime
 import os
+import sys
 from docopt import docopt
-from utilities.utils import stream_of_entity_with_metrics, save_scatter
+from utilities.plotcache import plot_cache
+from utilities.utils import stream_of_entity_with_metrics, save_scatter, HTML_WRITERS
 from utilities import VERSION
 import csv
 from math import sqrt
@@ -79,7 +87,8 @@ def scatter_plot (cmdline_arguments,
     output_dir = cmdline_arguments["--outputDir"]
     file_prefix = "%s%s%s" % (output_dir, os.sep, "csv")
     file_name = save_scatter(x_values, x_metric_name, y_values, y_metric_name, ball_values, ball_metric_name,
-                             color_values, entity_column_name, annotations, file_prefix, "")
+                             color_values, entity_column_name, annotations, file_prefix, "",
+                             max_points=int(cmdline_arguments["--maxPoints"]), html_writer=cmdline_arguments["--htmlWriter"])
     print("Saved %s" % file_name)
     return True
 
@@ -89,6 +98,10 @@ def main():
     arguments = docopt(__doc__, version=VERSION)
     print("\r\n====== csvscatterplot @ https://github.com/sglebs/srccheck ==========")
     print("Processing %s" % arguments["--in"])
+    if arguments["--htmlWriter"] not in HTML_WRITERS:
+        print ("Invalid --htmlWriter: %s (use %s)" % (arguments["--htmlWriter"], " or ".join(HTML_WRITERS)))
+        sys.exit(-3)
+    plot_cache.start(arguments["--plotCache"])
     ok = scatter_plot(arguments,
                       arguments["--xMetric"],
                       arguments["--yMetric"],
@@ -102,6 +115,8 @@ def main():
                       )
     if not ok:
         print("WARNING/SKIPPING: Could not create plot")
+    if plot_cache.enabled:
+        print(plot_cache.summary())
     end_time = datetime.datetime.now()
     print("\r\n--------------------------------------------------")
     print("Started : %s" % str(start_time))
@@ -0,0 +1,100 @@
+# Persistent metric cache (sqlite), for incremental runs: the metric values of the entities of a file are reused
+# while the file on disk is unchanged (same mtime and size, or else same SHA-1 of its contents), and only the
+# entities of changed files are queried through the Understand API again. Entities whose container file is not on
+# disk (or that have no container file) are never cached.
+# Note that a few metrics depend on other files too (CountClassCoupled, MaxInheritanceTree, ...): their cached
+# values are only refreshed when the entity's own file changes.
+import hashlib
+import os
+import sqlite3
+
+_SCHEMA = ["CREATE TABLE IF NOT EXISTS files (path TEXT, scope TEXT, mtime REAL, size INTEGER, sha1 TEXT, PRIMARY KEY (path, scope))",
+           "CREATE TABLE IF NOT EXISTS metrics (path TEXT, scope TEXT, longname TEXT, kind TEXT, occurrence INTEGER, metric TEXT, value, "
+           "PRIMARY KEY (path, scope, longname, kind, occurrence, metric))"]
+ROWS_PER_COMMIT = 10000 # metric rows written per transaction: short ones, so other workers sharing the file are not locked out
+
+
+def _sha1_of_file(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class MetricCache:
+
+    def __init__(self, cache_path):
+        self.connection = sqlite3.connect(cache_path, timeout=60) # several worker processes may share it (--jobs, --shards)
+        for statement in _SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+        self.entries_by_file = {} # [path, scope] -> {entity key: metric_dict} for unchanged files, None for files not on disk
+        self.occurrences = {} # entity key -> how many times seen (overloads may share a longname)
+        self.pending_rows = []
+        self.reused_count = 0
+        self.queried_count = 0
+
+    def _entries_of_file(self, path, scope_name):
+        file_key = (path, scope_name)
+        if file_key in self.entries_by_file:
+            return self.entries_by_file[file_key]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.entries_by_file[file_key] = None
+            return None
+        row = self.connection.execute("SELECT mtime, size, sha1 FROM files WHERE path=? AND scope=?", file_key).fetchone()
+        unchanged = row is not None and row[0] == stat.st_mtime and row[1] == stat.st_size
+        if not unchanged:
+            sha1 = _sha1_of_file(path)
+            unchanged = row is not None and row[2] == sha1 # touched but same contents
+            if not unchanged:
+                self.connection.execute("DELETE FROM metrics WHERE path=? AND scope=?", file_key)
+            self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", (path, scope_name, stat.st_mtime, stat.st_size, sha1))
+            self.connection.commit() # not at close(): till then, other workers (--jobs, --shards) could not write at all
+        entries = {}
+        if unchanged:
+            for longname, kind, occurrence, metric, value in self.connection.execute(
+                    "SELECT longname, kind, occurrence, metric, value FROM metrics WHERE path=? AND scope=?", file_key):
+                entries.setdefault((path, scope_name, longname, kind, occurrence), {})[metric] = value
+        self.entries_by_file[file_key] = entries
+        return entries
+
+    def lookup(self, container_path, scope_name, longname, kind_name, metrics):
+        """Returns [key, metric_dict], metric_dict being None when the metrics must be queried (and then stored with that key).
+        The key is None for entities which can't be cached."""
+        if container_path is None:
+            return [None, None]
+        entries = self._entries_of_file(container_path, scope_name)
+        if entries is None:
+            return [None, None]
+        partial_key = (container_path, scope_name, longname, kind_name)
+        occurrence = self.occurrences.get(partial_key, 0)
+        self.occurrences[partial_key] = occurrence + 1
+        key = partial_key + (occurrence,)
+        cached_metrics = entries.get(key, None)
+        if cached_metrics is None or any(metric not in cached_metrics for metric in metrics):
+            self.queried_count += 1
+            return [key, None]
+        self.reused_count += 1
+        return [key, {metric: cached_metrics[metric] for metric in metrics}]
+
+    def store(self, key, metric_dict):
+        if key is None:
+            return
+        self.pending_rows.extend(key + (metric, value) for metric, value in metric_dict.items())
+        if len(self.pending_rows) >= ROWS_PER_COMMIT:
+            self._write_pending_rows()
+
+    def _write_pending_rows(self):
+        self.connection.executemany("INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?)", self.pending_rows)
+        self.connection.commit()
+        self.pending_rows = []
+
+    def close(self):
+        self._write_pending_rows()
+        self.connection.close()
+
+    def summary(self):
+        return "Metric cache: %i entities reused, %i queried" % (self.reused_count, self.queried_count)
@@ -0,0 +1,45 @@
+# The mpld3 side of the HTML plots. Imported by utils on the first HTML plot, not at start-up: mpld3 imports pyplot,
+# so this is also where the backend is chosen.
+from matplotlib import use as backend_use
+backend_use('Agg') # fixes #32 - change backend to simple one, BEFORE any other import.
+import mpld3
+
+
+class ClickSendToBack(mpld3.plugins.PluginBase):
+    """Plugin for sending element to the back. Combined https://mpld3.github.io/notebooks/custom_plugins.html and http://bl.ocks.org/eesur/4e0a69d57d3bfc8a82c2"""
+
+    JAVASCRIPT = """
+    d3.selection.prototype.moveToBack = function() {
+        return this.each(function() {
+            var firstChild = this.parentNode.firstChild;
+            if (firstChild) {
+                this.parentNode.insertBefore(this, firstChild);
+            }
+        });
+    };
+    mpld3.register_plugin("clicksendtoback", ClickSendToBackPlugin);
+    ClickSendToBackPlugin.prototype = Object.create(mpld3.Plugin.prototype);
+    ClickSendToBackPlugin.prototype.constructor = ClickSendToBackPlugin;
+    ClickSendToBackPlugin.prototype.requiredProps = ["id"];
+    function ClickSendToBackPlugin(fig, props){
+        mpld3.Plugin.call(this, fig, props);
+    };
+
+    ClickSendToBackPlugin.prototype.draw = function(){
+        var obj = mpld3.get_element(this.props.id);
+        obj.elements().on("mousedown",
+                          function(d, i){d3.select(this).moveToBack();});
+    }
+    """
+
+    def __init__(self, points):
+        self.dict_ = {"type": "clicksendtoback",
+                      "id": mpld3.utils.get_id(points)}
+
+
+def save_figure_as_html(fig, filename):
+    with open(filename, "w") as output_file:
+        output_file.write("<html><head></head><body>")
+        mpld3.save_html(fig, output_file)
+        output_file.write("</body></html>")
+
@@ -0,0 +1,125 @@
+# Content-addressed plot cache, for --plotCache: each plot saved by utils (histogram, scatter, kiviat) is keyed by the
+# SHA-256 of everything it is drawn from (values, labels, options), of the versions of the plotting libraries and of the
+# source of the plotting modules. When a file with that key is in the cache, the plot is hard-linked (or copied) from it
+# instead of being rendered again: on a nightly run, the plots of unchanged modules cost a hash, not a matplotlib render.
+# Disabled (a no-op) unless a tool calls plot_cache.start(cache_dir).
+# Note plots restored from the cache are hard links to the cache files: delete them rather than overwrite them in place.
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+_LIBRARIES = ["matplotlib", "mpld3", "numpy"] # whose version is part of every key
+_PLOTTING_SOURCES = ["utils.py", "complex_radar.py", "mpld3_plugins.py"] # so is their source: a plot drawn differently gets new keys
+
+
+def _jsonable(value): # numpy arrays & scalars, array.array, NumberColumn...
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if hasattr(value, "__iter__"):
+        return list(value)
+    return repr(value)
+
+
+def _renderer_fingerprint():
+    from importlib import metadata
+    sha256 = hashlib.sha256()
+    for library in _LIBRARIES:
+        try:
+            sha256.update(("%s %s\n" % (library, metadata.version(library))).encode("utf-8"))
+        except metadata.PackageNotFoundError:
+            sha256.update(("%s -\n" % library).encode("utf-8"))
+    for source in _PLOTTING_SOURCES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), source), "rb") as source_file:
+            sha256.update(source_file.read())
+    return sha256.hexdigest()
+
+
+class PlotCache:
+
+    def __init__(self):
+        self.cache_dir = None
+        self.fingerprint = None
+        self.reused_count = 0
+        self.rendered_count = 0
+        self._counts_lock = threading.Lock() # render threads (--renderPool=thread) count at once
+
+    @property
+    def enabled(self):
+        return self.cache_dir is not None
+
+    def start(self, cache_dir):
+        """Resets the counts. No cache_dir, no caching."""
+        self.cache_dir = cache_dir
+        self.reused_count = 0
+        self.rendered_count = 0
+        if not self.enabled:
+            return
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True) # several processes may get here at once (--jobs)
+        self.fingerprint = _renderer_fingerprint()
+
+    def key(self, kind, *inputs):
+        """The key of a plot of that kind drawn from those inputs (any mix of JSON-able values, lists, numpy arrays...).
+        None when disabled, without hashing anything."""
+        if not self.enabled:
+            return None
+        sha256 = hashlib.sha256()
+        sha256.update(self.fingerprint.encode("ascii"))
+        sha256.update(json.dumps([kind, inputs], default=_jsonable, separators=(",", ":")).encode("utf-8"))
+        return sha256.hexdigest()
+
+    def _cached_path(self, key, filename):
+        return os.path.join(self.cache_dir, key[:2], key + os.path.splitext(filename)[1]) # the extension too: .png, .html...
+
+    def restore(self, key, filename):
+        """Saves the cached plot of that key as filename (a hard link, or else a copy). False when there is none: the plot
+        must be rendered, then stored."""
+        if key is None:
+            return False
+        if os.path.lexists(filename): # never render into a hard link to a cache file of a previous run
+            os.remove(filename)
+        cached_path = self._cached_path(key, filename)
+        if not os.path.isfile(cached_path):
+            self.add_counts(0, 1)
+            return False
+        try:
+            os.link(cached_path, filename)
+        except OSError: # another file system, no hard links (FAT)...
+            shutil.copyfile(cached_path, filename)
+        self.add_counts(1, 0)
+        return True
+
+    def store(self, key, filename):
+        """Copies the plot just rendered as filename into the cache, under that key."""
+        if key is None:
+            return
+        cached_path = self._cached_path(key, filename)
+        try:
+            if not os.path.isdir(os.path.dirname(cached_path)):
+                os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+            file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(cached_path))
+            os.close(file_descriptor)
+            try:
+                shutil.copyfile(filename, temp_path)
+                shutil.copymode(filename, temp_path) # not mkstemp's 0600: the plots restored are this file
+                os.replace(temp_path, cached_path) # atomic: other threads/processes never see half a file
+            except OSError:
+                os.remove(temp_path)
+                raise
+        except OSError as exc:
+            print("WARNING: could not cache %s: %s" % (filename, exc))
+
+    def add_counts(self, reused_count, rendered_count):
+        """Also counts the plots reused & rendered by a worker process (--renderJobs)."""
+        with self._counts_lock:
+            self.reused_count += reused_count
+            self.rendered_count += rendered_count
+
+    def summary(self):
+        return "Plot cache: %i plots reused, %i rendered" % (self.reused_count, self.rendered_count)
+
+
+plot_cache = PlotCache() # one per process
@@ -0,0 +1,140 @@
+# Per-phase profiling, for --profileReport: wall time, CPU time, peak memory (tracemalloc) and entity counts of
+# each phase of a run (DB open, project metrics, each scope's extraction and stats, each plot, CSV, Sonar...),
+# saved as JSON, to tell whether a slow run is spending its time in Understand, matplotlib or the network.
+# Disabled (a no-op) unless a tool calls profiler.start(report_path). Note tracemalloc slows Python down.
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class Phase:
+    __slots__ = ["name", "entities", "wall_seconds", "cpu_seconds", "peak_bytes"]
+
+    def __init__(self, name):
+        self.name = name
+        self.entities = None # set by whoever knows how many entities went through the phase
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_bytes = 0
+
+    def as_dict(self):
+        phase_dict = {"name": self.name,
+                      "wallSeconds": round(self.wall_seconds, 6),
+                      "cpuSeconds": round(self.cpu_seconds, 6),
+                      "peakMB": round(self.peak_bytes / 1048576.0, 3)}
+        if self.entities is not None:
+            phase_dict["entities"] = self.entities
+            phase_dict["entitiesPerSec"] = round(self.entities / self.wall_seconds, 1) if self.wall_seconds > 0 else None
+        return phase_dict
+
+
+_NO_PHASE = Phase("") # what phase() yields when disabled: setting its entities is harmless
+
+
+class PhaseProfiler:
+
+    def __init__(self):
+        self.report_path = None
+        self.tool_name = None
+        self.phase_dicts = []
+        self._local = threading.local()
+        self._start_wall = None
+        self._start_cpu = None
+        self._started = None
+
+    @property
+    def enabled(self):
+        return self.report_path is not None
+
+    @property
+    def _open_phases(self): # one stack per thread: phases of threads running at once (--renderPool=thread) do not nest in each other
+        open_phases = getattr(self._local, "open_phases", None)
+        if open_phases is None:
+            open_phases = self._local.open_phases = []
+        return open_phases
+
+    def start(self, report_path, tool_name=""):
+        """Starts over (also in worker processes, which inherit the parent's profiler). No report_path, no profiling."""
+        self.report_path = report_path
+        self.tool_name = tool_name
+        self.phase_dicts = []
+        self._local = threading.local()
+        if not self.enabled:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._started = datetime.datetime.now()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield _NO_PHASE
+            return
+        phase = Phase(" > ".join([open_phase.name for open_phase in self._open_phases] + [name]))
+        if len(self._open_phases) > 0: # the peak so far belongs to the enclosing phase
+            parent = self._open_phases[-1]
+            parent.peak_bytes = max(parent.peak_bytes, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self._open_phases.append(phase)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield phase
+        finally:
+            phase.wall_seconds = time.perf_counter() - start_wall
+            phase.cpu_seconds = time.process_time() - start_cpu
+            phase.peak_bytes = max(phase.peak_bytes, tracemalloc.get_traced_memory()[1])
+            self._open_phases.pop()
+            if len(self._open_phases) > 0:
+                parent = self._open_phases[-1]
+                parent.peak_bytes = max(parent.peak_bytes, phase.peak_bytes)
+            self.phase_dicts.append(phase.as_dict())
+
+    def counted(self, name, items):
+        """Profiles the consumption of items (say, a stream of entities) as a phase, counting them as entities."""
+        if not self.enabled:
+            return items
+        return self._counted(name, items)
+
+    def _counted(self, name, items):
+        with self.phase(name) as phase:
+            phase.entities = 0
+            for item in items:
+                phase.entities += 1
+                yield item
+
+    def add_phase_dicts(self, phase_dicts, prefix):
+        """Phases profiled by a worker process (--jobs)."""
+        for phase_dict in phase_dicts:
+            phase_dict = dict(phase_dict)
+            phase_dict["name"] = "%s > %s" % (prefix, phase_dict["name"])
+            self.phase_dicts.append(phase_dict)
+
+    def save(self):
+        if not self.enabled:
+            return None
+        report = {"tool": self.tool_name,
+                  "started": str(self._started),
+                  "argv": [("%s=***" % arg.split("=")[0]) if arg.startswith("--sonarPass") else arg for arg in sys.argv[1:]],
+                  "wallSeconds": round(time.perf_counter() - self._start_wall, 6),
+                  "cpuSeconds": round(time.process_time() - self._start_cpu, 6),
+                  "peakMB": max([phase_dict["peakMB"] for phase_dict in self.phase_dicts] +
+                                [round(tracemalloc.get_traced_memory()[1] / 1048576.0, 3)]),
+                  "phases": self.phase_dicts}
+        report_dir = os.path.dirname(self.report_path)
+        if len(report_dir) > 0 and not os.path.isdir(report_dir):
+            os.makedirs(report_dir)
+        with open(self.report_path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        print("Profile report saved to %s" % self.report_path)
+        return self.report_path
+
+
+profiler = PhaseProfiler() # one per process
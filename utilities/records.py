@@ -0,0 +1,141 @@
+# Compact records for the entity/metric pipeline. Big DBs have millions of entities, so what is kept per entity
+# must not be a dict (one per entity, plus a key string and a number object per metric):
+#  * EntityRecord: what stream_of_entity_with_metrics yields, unpacks like the [entity, container_file, metric_dict] it replaces
+#  * MetricValues: the metric values of one entity, a tuple plus an index of interned metric names shared by all entities
+#  * NumberColumn: values of one metric for a population, in an array (int64 until a float shows up, then float64)
+#  * BeforeAfterTable: the metrics of the entities of 2 DBs, one NumberColumn per metric per DB, rows by entity name
+from array import array
+import sys
+
+_index_by_metrics = {}
+
+
+def metric_index(metrics):
+    metrics = tuple(metrics)
+    index = _index_by_metrics.get(metrics, None)
+    if index is None:
+        index = {sys.intern(metric): i for i, metric in enumerate(dict.fromkeys(metrics))} # positions of the distinct names: from_dict has no repeats
+        _index_by_metrics[metrics] = index
+    return index
+
+
+class MetricValues:
+    """Read-only, dict-like: metric name -> value (None when the entity does not have it)."""
+    __slots__ = ["_index", "_values"]
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    @classmethod
+    def from_dict(cls, index, metric_dict):
+        return cls(index, tuple([metric_dict.get(metric, None) for metric in index]))
+
+    def __getitem__(self, metric):
+        return self._values[self._index[metric]]
+
+    def get(self, metric, default=None):
+        position = self._index.get(metric, None)
+        return default if position is None else self._values[position]
+
+    def __contains__(self, metric):
+        return metric in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._index, self._values)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class EntityRecord:
+    __slots__ = ["entity", "container_file", "metric_values"]
+
+    def __init__(self, entity, container_file, metric_values):
+        self.entity = entity
+        self.container_file = container_file
+        self.metric_values = metric_values
+
+    def __iter__(self): # for entity, container_file, metric_dict in stream_of_entity_with_metrics(...)
+        yield self.entity
+        yield self.container_file
+        yield self.metric_values
+
+    def __getitem__(self, i):
+        return (self.entity, self.container_file, self.metric_values)[i]
+
+
+class NumberColumn:
+    """Appendable column of numbers. Ints stay ints (so stats like MODE/MEDIAN print as before) until the 1st float."""
+    __slots__ = ["array"]
+
+    def __init__(self, values=()):
+        self.array = array("q")
+        for value in values:
+            self.append(value)
+
+    def _to_floats(self):
+        self.array = array("d", self.array)
+
+    def append(self, value):
+        if self.array.typecode == "q":
+            if isinstance(value, int) and -9223372036854775808 <= value <= 9223372036854775807:
+                self.array.append(value)
+                return
+            self._to_floats()
+        self.array.append(value)
+
+    def __setitem__(self, i, value):
+        if self.array.typecode == "q" and not isinstance(value, int):
+            self._to_floats()
+        self.array[i] = value
+
+    def __getitem__(self, i):
+        return self.array[i]
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        return iter(self.array)
+
+
+class BeforeAfterTable:
+    """The metrics of the entities of a "before" and an "after" DB, matched by entity name. Missing is 0."""
+
+    def __init__(self, metric_names):
+        self.metric_names = list(metric_names)
+        self.entity_names = []
+        self.row_by_name = {}
+        self.columns = {tag: {metric: NumberColumn() for metric in self.metric_names} for tag in ["before", "after"]}
+
+    def __len__(self):
+        return len(self.entity_names)
+
+    def set_metrics(self, tag, entity_name, metric_values):
+        row = self.row_by_name.get(entity_name, None)
+        if row is None:
+            row = len(self.entity_names)
+            self.row_by_name[entity_name] = row
+            self.entity_names.append(sys.intern(entity_name))
+            for columns in self.columns.values():
+                for column in columns.values():
+                    column.append(0)
+        for metric, column in self.columns[tag].items():
+            value = metric_values.get(metric, 0)
+            column[row] = 0 if value is None else value
+
+    def column(self, tag, metric):
+        return self.columns[tag][metric]
@@ -0,0 +1,84 @@
+# Sharded extraction: the entities of a scope are split by a stable hash of their container file across N
+# worker processes. Each worker opens the UDB/snapshot itself (Understand allows only one open db per process),
+# runs the regular filtered stream over its shard and sends back a compact MetricTable. The parent merges the
+# shards back into the original entity order, so whatever consumes the stream (maxima, violations, values
+# for stats) gives the same results as a single process would.
+import concurrent.futures
+import contextlib
+import heapq
+import io
+import multiprocessing
+import sys
+
+from utilities.metriccache import MetricCache
+from utilities.records import EntityRecord, MetricValues, metric_index
+from utilities.snapshot import MetricTable, SnapshotDb, SnapshotEntity, NO_FILE
+from utilities.utils import open_db_or_snapshot, stream_of_entity_with_metrics, entity_filter_from_arguments
+
+
+def extract_shard (db_path, dll_dir, snapshot, entity_query, metrics, verbose, skipLibraries, cmdline_arguments, scope_name, shard):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output): # replayed by the parent, in shard order
+        try:
+            db = open_db_or_snapshot(db_path, dll_dir, snapshot=snapshot)
+            metric_cache = None
+            if cmdline_arguments.get("--metricCache", None) is not None:
+                metric_cache = MetricCache(cmdline_arguments["--metricCache"])
+            try:
+                entity_filter = entity_filter_from_arguments(cmdline_arguments)
+                table = MetricTable(scope_name, entity_query, metrics)
+                file_index_by_longname = {}
+                ordinals = []
+                ordinal = [-1]
+                def counted(entities): # remembers the position of each entity in db.ents(), for the merge
+                    for ordinal[0], entity in enumerate(entities):
+                        yield entity
+                for entity, container_file, metric_dict in stream_of_entity_with_metrics(counted(db.ents(entity_query)), metrics, verbose,
+                                                                                         skipLibraries, entity_filter, scope_name, shard=shard,
+                                                                                         metric_cache=metric_cache):
+                    file_index = NO_FILE
+                    if container_file is not None:
+                        file_index = file_index_by_longname.setdefault(entity_filter.resolve(container_file).longname, len(file_index_by_longname))
+                    table.append(entity.longname(), entity.relname(), entity.kindname(), entity.library(), file_index, metric_dict)
+                    ordinals.append(ordinal[0])
+                if metric_cache is not None:
+                    print("Shard %i/%i: %s" % (shard[0] + 1, shard[1], metric_cache.summary()))
+            finally:
+                if metric_cache is not None:
+                    metric_cache.close()
+                db.close()
+        except SystemExit as exc: # open_db_or_snapshot & co print why, then exit: the parent replays that and exits
+            return [output.getvalue(), exc, None, None]
+    file_longnames = sorted(file_index_by_longname.keys(), key=file_index_by_longname.get)
+    return [output.getvalue(), table, file_longnames, ordinals]
+
+
+def _rows_of_shard (shard_index, ordinals):
+    for row, ordinal in enumerate(ordinals):
+        yield (ordinal, shard_index, row)
+
+
+def sharded_stream_of_entity_with_metrics (db_path, dll_dir, snapshot, entity_query, metrics, verbose, skipLibraries, cmdline_arguments, scope_name, shard_count):
+    """Same [entity, container_file, metric_dict] items as stream_of_entity_with_metrics, in the same order,
+    extracted by shard_count worker processes. The entities are snapshot entities (see snapshot.py)."""
+    # spawned, not forked: a forked worker would inherit the caller's open db, and Understand allows only one per process (DBAlreadyOpen)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=shard_count, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(extract_shard, db_path, dll_dir, snapshot, entity_query, metrics, verbose,
+                                   skipLibraries, cmdline_arguments, scope_name, [shard_index, shard_count])
+                   for shard_index in range(shard_count)]
+        shards = []
+        for future in futures:
+            output, table, file_longnames, ordinals = future.result()
+            print(output, end="")
+            if isinstance(table, SystemExit):
+                executor.shutdown(cancel_futures=True)
+                sys.exit(table.code)
+            shards.append([SnapshotDb("", "", file_longnames, [table], {}), table, ordinals])
+    index = metric_index(metrics)
+    rows_by_shard = [_rows_of_shard(shard_index, ordinals) for shard_index, [shard_db, table, ordinals] in enumerate(shards)]
+    for ordinal, shard_index, row in heapq.merge(*rows_by_shard):
+        shard_db, table, ordinals = shards[shard_index]
+        entity = SnapshotEntity(shard_db, table, row)
+        file_index = table.file_indexes[row]
+        container_file = None if file_index == NO_FILE else shard_db.file(file_index)
+        yield EntityRecord(entity, container_file, MetricValues.from_dict(index, entity.metric(table.metric_names)))
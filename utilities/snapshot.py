@@ -0,0 +1,324 @@
+# Columnar metric snapshots: the File/Class/Routine/Project metrics of a UDB, extracted once by srcextract
+# and saved as a NumPy .npz, so the other tools can run from it (--snapshot) without the Understand API.
+# Strings are stored as one UTF-8 blob plus offsets, repetitive ones (kinds, libraries) as a table plus codes.
+from array import array
+import numpy as np
+from utilities.synthetic_metrics import SYNTHETIC_METRICS
+
+SNAPSHOT_FORMAT_VERSION = 1
+SCOPE_NAMES = ["File", "Class", "Routine"]
+METRICS_OPTION_BY_SCOPE = {"File": "--fileMetrics", "Class": "--classMetrics", "Routine": "--routineMetrics"} # of srcextract
+NO_FILE = -1
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _pack_strings(strings):
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(blob, offsets):
+    data = blob.tobytes()
+    offsets = offsets.tolist()
+    return [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def _save_strings(arrays, key, strings):
+    arrays["%s.blob" % key], arrays["%s.offsets" % key] = _pack_strings(strings)
+
+
+def _load_strings(arrays, key):
+    return _unpack_strings(arrays["%s.blob" % key], arrays["%s.offsets" % key])
+
+
+def _save_categories(arrays, key, values):
+    codes_by_value = {}
+    codes = array("i", [codes_by_value.setdefault(value, len(codes_by_value)) for value in values])
+    _save_strings(arrays, "%s.table" % key, list(codes_by_value.keys()))
+    arrays["%s.codes" % key] = np.asarray(codes, dtype=np.int32)
+
+
+def _load_categories(arrays, key):
+    table = _load_strings(arrays, "%s.table" % key)
+    return [table[code] for code in arrays["%s.codes" % key].tolist()]
+
+
+def _value_or_none(value):
+    if value != value: # NaN marks a metric Understand did not provide (None)
+        return None
+    return int(value) if value.is_integer() else value
+
+
+_parsed_kind_queries = {}
+
+
+def _parse_kind_query(query):
+    parsed = _parsed_kind_queries.get(query, None)
+    if parsed is not None:
+        return parsed
+    parsed = []
+    for alternative in query.split(","):
+        words = alternative.lower().split()
+        parsed.append([[word for word in words if not word.startswith("~")],
+                       [word[1:] for word in words if word.startswith("~")]])
+    _parsed_kind_queries[query] = parsed
+    return parsed
+
+
+def kind_matches_query(kind_name, query):
+    """Approximates Understand's kind filters: "method ~Unknown ~Unresolved, function" and the like."""
+    kind_words = kind_name.lower().split()
+    for wanted, unwanted in _parse_kind_query(query):
+        if all(word in kind_words for word in wanted) and not any(word in kind_words for word in unwanted):
+            return True
+    return False
+
+
+class MetricTable:
+    """The metric values of the entities of one scope, one column per metric (NaN for a missing value)."""
+
+    def __init__(self, scope_name, query, metric_names):
+        self.scope_name = scope_name
+        self.query = query
+        self.metric_names = list(metric_names)
+        self.longnames = []
+        self.relnames = []
+        self.kinds = []
+        self.libraries = []
+        self.file_indexes = array("i")
+        self.flat_values = array("d")
+        self.values = None # 2D numpy array, built on demand from flat_values
+
+    def __len__(self):
+        return len(self.longnames)
+
+    def append(self, longname, relname, kind, library, file_index, metric_dict):
+        self.longnames.append(longname)
+        self.relnames.append(relname)
+        self.kinds.append(kind)
+        self.libraries.append(library)
+        self.file_indexes.append(file_index)
+        for metric_name in self.metric_names:
+            value = metric_dict.get(metric_name, None)
+            self.flat_values.append(float("nan") if value is None else value)
+        self.values = None
+
+    def value_matrix(self):
+        if self.values is None:
+            self.values = np.frombuffer(self.flat_values, dtype=np.float64).reshape(len(self), len(self.metric_names))
+        return self.values
+
+    def save_to(self, arrays):
+        prefix = self.scope_name
+        _save_strings(arrays, "%s.query" % prefix, [self.query])
+        _save_strings(arrays, "%s.metric_names" % prefix, self.metric_names)
+        _save_strings(arrays, "%s.longname" % prefix, self.longnames)
+        _save_strings(arrays, "%s.relname" % prefix, self.relnames)
+        _save_categories(arrays, "%s.kind" % prefix, self.kinds)
+        _save_categories(arrays, "%s.library" % prefix, self.libraries)
+        arrays["%s.file" % prefix] = np.asarray(self.file_indexes, dtype=np.int32)
+        arrays["%s.values" % prefix] = self.value_matrix()
+
+    @classmethod
+    def load_from(cls, arrays, scope_name):
+        table = cls(scope_name, _load_strings(arrays, "%s.query" % scope_name)[0],
+                    _load_strings(arrays, "%s.metric_names" % scope_name))
+        table.longnames = _load_strings(arrays, "%s.longname" % scope_name)
+        table.relnames = _load_strings(arrays, "%s.relname" % scope_name)
+        table.kinds = _load_categories(arrays, "%s.kind" % scope_name)
+        table.libraries = _load_categories(arrays, "%s.library" % scope_name)
+        table.file_indexes = array("i", arrays["%s.file" % scope_name].tolist())
+        table.values = arrays["%s.values" % scope_name].reshape(len(table.longnames), len(table.metric_names))
+        return table
+
+
+class SnapshotRef:
+    def __init__(self, file):
+        self._file = file
+
+    def file(self):
+        return self._file
+
+
+class SnapshotFile:
+    """A container file of a snapshot entity."""
+
+    def __init__(self, index, longname):
+        self._index = index
+        self._longname = longname
+
+    def id(self):
+        return ("file", self._index)
+
+    def longname(self):
+        return self._longname
+
+    def relname(self):
+        return self._longname
+
+    def name(self):
+        return self._longname
+
+    def kindname(self):
+        return "File"
+
+    def library(self):
+        return ""
+
+    def __str__(self):
+        return self._longname
+
+
+class SnapshotEntity:
+    """Quacks like an Understand entity, for the subset of the API the srccheck tools use."""
+
+    def __init__(self, snapshot, table, row):
+        self._snapshot = snapshot
+        self._table = table
+        self._row = row
+        self._column_by_metric = snapshot.column_by_metric[table.scope_name]
+
+    def id(self):
+        return (self._table.scope_name, self._row)
+
+    def longname(self):
+        return self._table.longnames[self._row]
+
+    def relname(self):
+        return self._table.relnames[self._row]
+
+    def name(self):
+        return self._table.longnames[self._row]
+
+    def kindname(self):
+        return self._table.kinds[self._row]
+
+    def library(self):
+        return self._table.libraries[self._row]
+
+    def metrics(self):
+        return list(self._table.metric_names)
+
+    def _column(self, metric_name):
+        column = self._column_by_metric.get(metric_name, None)
+        if column is None and metric_name not in SYNTHETIC_METRICS: # synthetic ones may still be computed, from other columns
+            # not None, as Understand would say for a metric the entity lacks: a threshold on it would always pass
+            raise SnapshotError("%s is not in the %s metrics of the snapshot. Extract it with srcextract %s=..."
+                                % (metric_name, self._table.scope_name, METRICS_OPTION_BY_SCOPE.get(self._table.scope_name, "")))
+        return column
+
+    def metric(self, metric_names):
+        values = self._table.value_matrix()[self._row]
+        if isinstance(metric_names, str):
+            column = self._column(metric_names)
+            return None if column is None else _value_or_none(float(values[column]))
+        metric_dict = {}
+        for metric_name in metric_names:
+            column = self._column(metric_name)
+            metric_dict[metric_name] = None if column is None else _value_or_none(float(values[column]))
+        return metric_dict
+
+    def ref(self, refkindstring=None):
+        file_index = self._table.file_indexes[self._row]
+        if file_index == NO_FILE:
+            return None
+        return SnapshotRef(self._snapshot.file(file_index))
+
+    def ents(self, refkindstring=None, entkindstring=None):
+        raise SnapshotError("%s needs the Understand API. Extract the metric that needs it into the snapshot." % self.longname())
+
+    def __str__(self):
+        return self.longname()
+
+
+class SnapshotDb:
+    """Quacks like an Understand db, backed by the MetricTables of a snapshot."""
+
+    def __init__(self, name, language, file_longnames, tables, prj_metrics):
+        self._name = name
+        self._language = language
+        self.file_longnames = file_longnames
+        self.tables = tables
+        self.prj_metrics = prj_metrics
+        self._files = {}
+        self.column_by_metric = {table.scope_name: {metric_name: i for i, metric_name in enumerate(table.metric_names)}
+                                 for table in tables}
+
+    def name(self):
+        return self._name
+
+    def language(self):
+        return self._language
+
+    def metrics(self):
+        return list(self.prj_metrics.keys())
+
+    def metric(self, metric_names):
+        if isinstance(metric_names, str):
+            return self.prj_metrics.get(metric_names, None)
+        return {metric_name: self.prj_metrics.get(metric_name, None) for metric_name in metric_names}
+
+    def file(self, file_index):
+        file = self._files.get(file_index, None)
+        if file is None:
+            file = SnapshotFile(file_index, self.file_longnames[file_index])
+            self._files[file_index] = file
+        return file
+
+    def ents(self, query):
+        for table in self.tables:
+            if table.query == query:
+                return [SnapshotEntity(self, table, row) for row in range(len(table))]
+        entities = []
+        seen = set()
+        for table in self.tables: # a different query than the one used to extract: select by kind
+            for row, kind_name in enumerate(table.kinds):
+                key = (kind_name, table.longnames[row])
+                if key not in seen and kind_matches_query(kind_name, query):
+                    seen.add(key)
+                    entities.append(SnapshotEntity(self, table, row))
+        return entities
+
+    def close(self):
+        pass
+
+
+def save_snapshot(file_path, db_name, db_language, file_longnames, tables, prj_metrics):
+    arrays = {"format": np.asarray(SNAPSHOT_FORMAT_VERSION)}
+    _save_strings(arrays, "db.name", [db_name])
+    _save_strings(arrays, "db.language", db_language)
+    _save_strings(arrays, "files", file_longnames)
+    _save_strings(arrays, "scopes", [table.scope_name for table in tables])
+    for table in tables:
+        table.save_to(arrays)
+    prj_metric_names = sorted(prj_metrics.keys())
+    _save_strings(arrays, "Project.metric_names", prj_metric_names)
+    arrays["Project.values"] = np.asarray([float("nan") if prj_metrics[name] is None else prj_metrics[name] for name in prj_metric_names],
+                                          dtype=np.float64)
+    with open(file_path, "wb") as snapshot_file:
+        np.savez(snapshot_file, **arrays)
+    return file_path
+
+
+def load_snapshot(file_path):
+    try:
+        with np.load(file_path, allow_pickle=False) as arrays:
+            arrays = {key: arrays[key] for key in arrays.files}
+    except (IOError, ValueError) as exc:
+        raise SnapshotError("%s: %s" % (file_path, exc))
+    if int(arrays.get("format", -1)) != SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotError("%s: unsupported snapshot format" % file_path)
+    tables = [MetricTable.load_from(arrays, scope_name) for scope_name in _load_strings(arrays, "scopes")]
+    prj_metric_names = _load_strings(arrays, "Project.metric_names")
+    prj_metrics = {name: _value_or_none(float(value)) for name, value in zip(prj_metric_names, arrays["Project.values"].tolist())}
+    return SnapshotDb(_load_strings(arrays, "db.name")[0], _load_strings(arrays, "db.language"),
+                      _load_strings(arrays, "files"), tables, prj_metrics)
+
+
+def is_snapshot_path(file_path):
+    return file_path.lower().endswith(".npz")
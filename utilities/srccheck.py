@@ -1,7 +1,7 @@
 """Source Code Checker.
 
 Usage:
-  srccheck       --in=<inputUDB> \r\n \
+  srccheck       (--in=<inputUDB> | --snapshot=<snapshotFile>) \r\n \
                 [--outputDir=<path to dir where to save files>] \r\n \
                 [--dllDir=<dllDir>]\r\n \
                 [--skipLibs=<skipLibs>]\r\n \
@@ -23,16 +23,27 @@ Usage:
                 [--regexIgnoreRoutines=<regexIgnoreRoutines>] \r\n \
                 [--verbose] \r\n \
                 [--skipPrjMetrics=<skipPrjMetrics>]\r\n \
+                [--printPrjMetrics=<printPrjMetrics>]\r\n \
+                [--allPrjMetrics] \r\n \
                 [--skipZeroes] \r\n \
                 [--adaptive] \r\n \
                 [--logarithmic]  \r\n \
                 [--showMeanMedian]  \r\n \
                 [--showHighest]  \r\n \
-                [--histograms]
+                [--histograms] \r\n \
+                [--renderJobs=<renderJobs>] \r\n \
+                [--renderPool=<renderPool>] \r\n \
+                [--topViolators=<topViolators>] \r\n \
+                [--jobs=<jobs>] \r\n \
+                [--shards=<shards>] \r\n \
+                [--metricCache=<metricCache>] \r\n \
+                [--profileReport=<profileReport>] \r\n \
+                [--plotCache=<plotCache>]
 
 
 Options:
   --in=<inputUDB>                               Input UDB file path.
+  --snapshot=<snapshotFile>                     Snapshot file (.npz) saved by srcextract, to use instead of --in. No Understand license needed.
   --dllDir=<dllDir>                             Path to the dir with the Understand bin and DLLs.[default: C:/Program Files/SciTools/bin/pc-win64]
   --skipLibs=<skipLibs>                         false for full analysis. true if you want to skip libraries you import. [default: true]
   --fileQuery=<fileQuery>                       Kinds of files you want to traverse[default: file ~Unknown ~Unresolved]
@@ -55,11 +66,21 @@ Options:
   -z, --skipZeroes                              If you want to skip datapoints which are zero[default: false]
   -a, --adaptive                                If you want srccheck to be adaptive and update the input json files with current max values
   -H, --histograms                              If you want srccheck to save histograms, just like srchistplot does
+  --renderJobs=<renderJobs>                     Number of worker processes (or threads, see --renderPool) rendering the histograms, after the metrics are extracted. [default: 1]
+  --renderPool=<renderPool>                     process or thread: with threads, no process start-up nor copy of the values, but the GIL. [default: process]
+  --topViolators=<topViolators>                 Only print the K worst violators of each metric, ranked, with how many violators there are in total. The exit code still counts them all.
   -l, --logarithmic                             If you want logarithmic y scale. [default: false]
   -m, --showMeanMedian                          If you want to show dotted lines for mean (blue) and median (red) [default: false]
   -s, --showHighest                             If you want to show (print) the highest valued elements (highest metric) even if not a violation. [default: false]
-  --skipPrjMetrics=<skipPrjMetrics>             Skip these project metrics (CSV of values) when printing/processing all prj metrics (for speed) [default: CountDeclMethodAll,MaxInheritanceTree,Essential,MaxEssential,MaxEssentialKnots,MaxNesting]
+  --skipPrjMetrics=<skipPrjMetrics>             Skip these project metrics (CSV of values) when printing/processing all prj metrics (--allPrjMetrics) (for speed) [default: CountDeclMethodAll,MaxInheritanceTree,Essential,MaxEssential,MaxEssentialKnots,MaxNesting]
+  --printPrjMetrics=<printPrjMetrics>           Project metrics (CSV of values) to compute and print, besides the ones in --maxPrjMetrics [default: ]
+  --allPrjMetrics                               If you want all project metrics computed and printed (except --skipPrjMetrics), instead of only --maxPrjMetrics and --printPrjMetrics. Slow on big DBs. [default: false]
   --outputDir=<path>                            Where files should be generated. [default: .]
+  --jobs=<jobs>                                 Number of worker processes. With more than 1, File, Class and Routine metrics are processed in parallel, each worker opening the UDB/snapshot itself. [default: 1]
+  --shards=<shards>                             Number of worker processes extracting the metrics of each scope, entities split by container file. Combines with --jobs. [default: 1]
+  --metricCache=<metricCache>                   Path of a metric cache file (sqlite), created if needed. Entities of files unchanged since the previous run reuse the cached metrics instead of querying the UDB.
+  --profileReport=<profileReport>               Path of a JSON file to save the wall time, CPU time, peak memory and entity counts of each phase of the run to. Slows the run down.
+  --plotCache=<plotCache>                       Dir of a plot cache, created if needed. Plots drawn from the same values and options as in a previous run are hard-linked (or copied) from it instead of being rendered again.
 
 Errors:
   DBAlreadyOpen        - only one database may be open at once
@@ -83,32 +104,60 @@ Author:
 # Multi-platform: http://cx-freeze.sourceforge.net
 # Publishing in SONAR: http://docs.codehaus.org/pages/viewpage.action?pageId=229743270
 
+import concurrent.futures
+import contextlib
 import datetime
+import heapq
+import io
 import json
+import multiprocessing
 import os.path
 import statistics
 import sys
+import time
 
 from docopt import docopt
 
 from utilities import VERSION
-from utilities.utils import stream_of_entity_with_metric, save_histogram, save_csv, \
+from utilities.metriccache import MetricCache
+from utilities.plotcache import plot_cache
+from utilities.profiling import profiler
+from utilities.records import NumberColumn
+from utilities.sharding import sharded_stream_of_entity_with_metrics
+from utilities.stats import StreamingStats, metric_name_for_sorting, split_stats_metric
+from utilities.utils import stream_of_entity_with_metrics, filtered_metric_value, render_histograms, RENDER_POOLS, save_csv, \
     save_kiviat_with_values_and_thresholds, \
-    post_metrics_to_sonar, load_metrics_thresholds, insert_understand_in_path
+    post_metrics_to_sonar, load_metrics_thresholds, open_db_or_snapshot, entity_filter_from_arguments
 
-STATS_LAMBDAS = {"AVG": statistics.mean,
-                 "MEDIAN": statistics.median,
-                 "MEDIANHIGH": statistics.median_high,
-                 "MEDIANLOW": statistics.median_low,
-                 "MEDIANGROUPED": statistics.median_grouped,
-                 "MODE": statistics.mode,
-                 "STDEV": statistics.pstdev,
-                 "VARIANCE": statistics.pvariance}
 
 class DummyEntity:
     def longname(self):
         return ""
 
+
+class Violators:
+    """The violators of a metric: all of them in the order found or, with a max_kept, only the worst ones (bounded heap)."""
+
+    def __init__(self, max_kept=None):
+        self.max_kept = max_kept
+        self.count = 0
+        self._kept = [] # [entity, metric_value, container_file], or a min-heap of [metric_value, -count, entity, container_file]
+
+    def add(self, entity, metric_value, container_file):
+        self.count += 1
+        if self.max_kept is None:
+            self._kept.append([entity, metric_value, container_file])
+        elif len(self._kept) < self.max_kept:
+            heapq.heappush(self._kept, (metric_value, -self.count, entity, container_file)) # -count: on ties, the 1st found wins
+        elif (metric_value, -self.count) > self._kept[0][:2]:
+            heapq.heapreplace(self._kept, (metric_value, -self.count, entity, container_file))
+
+    def ranked(self):
+        """[entity, metric_value, container_file] in the order found or, with a max_kept, worst first."""
+        if self.max_kept is None:
+            return self._kept
+        return [[entity, metric_value, container_file] for metric_value, order, entity, container_file in sorted(self._kept, reverse=True)]
+
 def _print_routine_violation(routine, metric_name, metric_value, container_file=None):
     print("%s\t%s\t%s%s" % (metric_name, metric_value, routine.longname(),
                             "" if container_file == None else "\t(in %s)" % container_file.longname()))
@@ -124,10 +173,32 @@ def _print_metric_violation(metric_name, metric_value, max_value):
     print ("%s:\t%s>%s" % (metric_name, metric_value, max_value))
 
 def project_metrics(db, cmdline_arguments):
-    skip_set = set(cmdline_arguments["--skipPrjMetrics"].split(","))
-    all_metric_names = db.metrics()
-    selected_metric_names = [metric for metric in all_metric_names if metric not in skip_set]
-    return db.metric(selected_metric_names)
+    if cmdline_arguments.get("--allPrjMetrics", False):
+        skip_set = set(cmdline_arguments["--skipPrjMetrics"].split(","))
+        all_metric_names = db.metrics()
+        selected_metric_names = [metric for metric in all_metric_names if metric not in skip_set]
+        return db.metric(selected_metric_names)
+    # only what we need: some project metrics are very expensive on big DBs, so compute them one by one and time them
+    try:
+        max_metrics = load_metrics_thresholds(cmdline_arguments["--maxPrjMetrics"])
+    except Exception:
+        max_metrics = {} # process_prj_metrics reports it
+    if not isinstance(max_metrics, dict):
+        max_metrics = {}
+    selected_metric_names = list(max_metrics.keys())
+    for metric in (cmdline_arguments.get("--printPrjMetrics", None) or "").split(","):
+        if len(metric.strip()) > 0 and metric.strip() not in selected_metric_names:
+            selected_metric_names.append(metric.strip())
+    prj_metrics = {}
+    seconds_by_metric = {}
+    for metric in selected_metric_names:
+        start_time = time.perf_counter()
+        prj_metrics[metric] = db.metric([metric]).get(metric, None)
+        seconds_by_metric[metric] = time.perf_counter() - start_time
+    if cmdline_arguments["--verbose"]:
+        for metric, seconds in sorted(seconds_by_metric.items(), key=lambda item: item[1], reverse=True):
+            print("Computed %s in %.3fs" % (metric, seconds))
+    return prj_metrics
 
 def print_prj_metrics (prj_metrics):
     for k,v in sorted(prj_metrics.items()):
@@ -159,20 +230,10 @@ def process_prj_metrics (cmdline_arguments, prj_metrics):
                 violation_count = violation_count + 1
     return [violation_count, max_metrics_found, max_metrics]
 
-def metric_name_for_sorting(metric_name):
-    if ":" not in metric_name:
-        return metric_name
-    else:
-        parts = metric_name.split(":")
-        return parts[-1] + parts[0]
-
-def process_generic_metrics (db, cmdline_arguments, jsonCmdLineParam, entityQuery, lambda_to_print, regex_str_ignore_item, scope_name):
-    regex_str_traverse_files = cmdline_arguments.get("--regexTraverseFiles", "*")
-    regex_ignore_files = cmdline_arguments.get("--regexIgnoreFiles", None)
+def process_generic_metrics (db, cmdline_arguments, jsonCmdLineParam, entityQuery, lambda_to_print, entity_filter, scope_name):
     max_metrics_json = cmdline_arguments[jsonCmdLineParam]
     max_values_allowed_by_metric = {}
     violation_count = 0
-    entities = db.ents(entityQuery)
     skipLibraries = cmdline_arguments["--skipLibs"] == "true"
     skip_zeroes = cmdline_arguments.get("--skipZeroes", False)
     verbose = cmdline_arguments["--verbose"]
@@ -188,99 +249,106 @@ def process_generic_metrics (db, cmdline_arguments, jsonCmdLineParam, entityQuer
         print ("*** EMPTY Metrics. JSON error? (%s)" % max_metrics_json)
         return [0, {}, {}]
     highest_values_found_by_metric = {}
-    last_processed_metric = "" # fix for #21, to reuse values
-    last_all_values = [] # fix for #21, to reuse values
-    last_max_value_found = -1
-    stats_cache = {}  # fix for #22 - use cached value for stats
     sorted_metrics = sorted(max_values_allowed_by_metric.keys(), key=metric_name_for_sorting)
-    for metric in sorted_metrics:
-        max_allowed_value = max_values_allowed_by_metric[metric]
-        all_values = [] # we may need to collect all values, if we are going to save a histogram
-        lambda_stats = None
-        if metric.count(':') == 1: #fix for #42 - can have only 1 :
-            lambda_name, adjusted_metric = metric.split(":")
-            lambda_stats = STATS_LAMBDAS.get(lambda_name.upper().strip(), None)
-
-        if lambda_stats is None:  # regular, not stats
-            max_value_found = -1
-            entity_with_max_value_found = None
-            has_stats_counterpart = (":%s" % metric) in "".join(sorted_metrics)
-            for entity, container_file, metric, metric_value in stream_of_entity_with_metric(entities, metric, verbose, skipLibraries, regex_str_ignore_item, regex_str_traverse_files, regex_ignore_files, skip_zeroes=skip_zeroes):
-                if save_histograms or has_stats_counterpart: # fix for #22 - cache values for stats
-                    all_values.append(metric_value)
-                if metric_value > highest_values_found_by_metric.get(metric, -1): # even a zero we want to tag as a max
-                    highest_values_found_by_metric[metric] = metric_value
-                max_allowed = max_values_allowed_by_metric[metric]
-                if metric_value > max_allowed: # we found a violation
-                    violation_count = violation_count + 1
+    # Single pass: fetch every metric named in the thresholds with one entity.metric() call per entity
+    regular_metrics = [metric for metric in sorted_metrics if split_stats_metric(metric)[2] is None]
+    stats_metrics = [metric for metric in sorted_metrics if split_stats_metric(metric)[2] is not None]
+    metrics_to_fetch = sorted(set(regular_metrics) | set(split_stats_metric(metric)[1] for metric in stats_metrics))
+    stats_by_metric = {split_stats_metric(metric)[1]: StreamingStats() for metric in stats_metrics} # one pass, no list of values
+    all_values_by_metric = {metric: NumberColumn() for metric in regular_metrics} if save_histograms else {} # only for histograms
+    max_value_found_by_metric = {metric: -1 for metric in metrics_to_fetch}
+    max_found_by_metric = {} # metric -> [entity, container_file] with the max value found, which could be a violator or not
+    top_violators = cmdline_arguments.get("--topViolators", None)
+    violations_by_metric = {metric: Violators(None if top_violators is None else int(top_violators)) # printed per metric after the pass, in sorted order
+                            for metric in regular_metrics}
+    metric_cache = None
+    shard_count = int(cmdline_arguments.get("--shards", 1) or 1)
+    if shard_count > 1:
+        snapshot = cmdline_arguments["--snapshot"] is not None
+        entity_stream = sharded_stream_of_entity_with_metrics(cmdline_arguments["--snapshot"] if snapshot else cmdline_arguments["--in"],
+                                                              cmdline_arguments["--dllDir"], snapshot, entityQuery, metrics_to_fetch,
+                                                              verbose, skipLibraries, cmdline_arguments, scope_name, shard_count)
+    else:
+        if cmdline_arguments.get("--metricCache", None) is not None:
+            metric_cache = MetricCache(cmdline_arguments["--metricCache"])
+        entity_stream = stream_of_entity_with_metrics(db.ents(entityQuery), metrics_to_fetch, verbose, skipLibraries, entity_filter, scope_name,
+                                                      metric_cache=metric_cache)
+    for entity, container_file, metric_dict in profiler.counted("%s extraction" % scope_name, entity_stream):
+        for metric in metrics_to_fetch:
+            metric_value = filtered_metric_value(entity, metric, metric_dict, verbose, skip_zeroes=skip_zeroes)
+            if metric_value is None:
+                continue
+            if metric in stats_by_metric:
+                stats_by_metric[metric].add(metric_value)
+            if metric in all_values_by_metric:
+                all_values_by_metric[metric].append(metric_value)
+            if metric_value > max_value_found_by_metric[metric]: # max found, which could be a violator or not
+                max_value_found_by_metric[metric] = metric_value
+                max_found_by_metric[metric] = [entity, container_file]
+            if metric in violations_by_metric and metric_value > max_values_allowed_by_metric[metric]: # we found a violation
+                violations_by_metric[metric].add(entity, metric_value, container_file)
+    if metric_cache is not None:
+        metric_cache.close()
+        print(metric_cache.summary())
+
+    histograms = [] # rendered after the stats, possibly in parallel (--renderJobs)
+    with profiler.phase("%s stats" % scope_name):
+        for metric in sorted_metrics:
+            max_allowed_value = max_values_allowed_by_metric[metric]
+            lambda_name, adjusted_metric, lambda_stats = split_stats_metric(metric)
+            all_values = all_values_by_metric.get(adjusted_metric, NumberColumn()).array
+            max_value_found = max_value_found_by_metric[adjusted_metric]
+            if lambda_stats is None:  # regular, not stats
+                violators = violations_by_metric[metric]
+                violation_count = violation_count + violators.count
+                if violators.max_kept is not None and violators.count > 0:
+                    print("Top %i of %i %s violators of %s:" % (min(violators.max_kept, violators.count), violators.count, scope_name, metric))
+                for rank, [entity, metric_value, container_file] in enumerate(violators.ranked()):
+                    if violators.max_kept is not None:
+                        print("%i.\t" % (rank + 1), end="")
                     lambda_to_print(entity, metric, metric_value, container_file=container_file)
-                if metric_value > max_value_found: # max found, which could be a violator or not
-                    max_value_found = metric_value
-                    entity_with_max_value_found = entity
-            if entity_with_max_value_found is not None:
-                if bool(cmdline_arguments["--showHighest"]):
-                    print("...........................................")
-                    kind = "violator"
-                    if max_value_found <= max_allowed_value:
-                        kind = "non violator"
-                    print("INFO: HIGHEST %s %s found (violation threshold is %s):\t" % (metric, kind, max_allowed_value), end="")
-                    lambda_to_print(entity_with_max_value_found, metric, max_value_found, container_file=container_file) # prints the max found, which may be a violator or not
-                    print("...........................................")
-            last_processed_metric = metric  # fix for #21, to reuse values
-            last_all_values = all_values  # fix for #21, to reuse values
-            last_max_value_found = max_value_found
-        else: # stats, compute on the whole population
-            def metric_values(): # generator of a stream of float values, to be consumed by the stats functions
-                for entity, container_file, metric, metric_value in stream_of_entity_with_metric(entities, adjusted_metric,
-                                                                                                 verbose, skipLibraries,
-                                                                                                 regex_str_ignore_item,
-                                                                                                 regex_str_traverse_files,
-                                                                                                 regex_ignore_files,
-                                                                                                 skip_zeroes=skip_zeroes):
-                    yield metric_value
-
-            if adjusted_metric == last_processed_metric: # fix for #21 - reuses values, thanks to sorting we know teh pure metric must have come just before
-                all_values = last_all_values
-                max_value_found = last_max_value_found
-            else:
-                all_values = [value for value in metric_values()]
-                if save_histograms:
-                    max_value_found = max(all_values) if len(all_values) > 0 else 0
-                    last_max_value_found = max_value_found  # fix for #21, same as above
-                last_processed_metric = adjusted_metric  # fix for 21. in case only stats functions are used, not the pure one.
-                last_all_values = all_values  # fix for #21, same as above
-            stats_value = stats_cache.get(adjusted_metric, {}).get(lambda_name, None) # fix for #22 - used cached value for stats
-            if stats_value is None:
+                if metric in max_found_by_metric:
+                    highest_values_found_by_metric[metric] = max_value_found # even a zero we want to tag as a max
+                    if bool(cmdline_arguments["--showHighest"]):
+                        entity_with_max_value_found, container_file = max_found_by_metric[metric]
+                        print("...........................................")
+                        kind = "violator"
+                        if max_value_found <= max_allowed_value:
+                            kind = "non violator"
+                        print("INFO: HIGHEST %s %s found (violation threshold is %s):\t" % (metric, kind, max_allowed_value), end="")
+                        lambda_to_print(entity_with_max_value_found, metric, max_value_found, container_file=container_file) # prints the max found, which may be a violator or not
+                        print("...........................................")
+            else: # stats, compute on the whole population
                 try:
-                    stats_value = lambda_stats(all_values)
+                    stats_value = lambda_stats(stats_by_metric[adjusted_metric])
                 except statistics.StatisticsError as se:
                     print ("ERROR in %s: %s" % (metric, se))
                     continue
 
-            highest_values_found_by_metric[metric] = stats_value
-            if stats_value > max_allowed_value:  # we found a violation
-                violation_count = violation_count + 1
-                lambda_to_print(DummyEntity(), metric, stats_value)
-            else:
-                if bool(cmdline_arguments["--showHighest"]):
-                    print("...........................................")
-                    print("INFO(STATS): %s = %s (violation threshold is %s):" % (metric, stats_value, max_allowed_value))
-                    print("...........................................")
-        if save_histograms and len(all_values) > 0 and lambda_stats is None:
-            output_dir = cmdline_arguments["--outputDir"]
-            file_prefix = "%s%s%s" % (output_dir, os.sep, os.path.split(db.name())[-1])
-            file_name, mean, median, pstdev = save_histogram(bool(cmdline_arguments["--showMeanMedian"]),
-                                       bool(cmdline_arguments["--logarithmic"]),
-                                       file_prefix,
-                                       max_value_found,
-                                       metric,
-                                       all_values,
-                                       scope_name)
-            if mean is not None:
-                stats_cache[metric] = {"AVG": mean, "MEDIAN": median, "STDEV": pstdev} # fix for #22 - used cached value for stats
-            if verbose:
-                print("Saved %s" % file_name)
-
+                highest_values_found_by_metric[metric] = stats_value
+                if stats_value > max_allowed_value:  # we found a violation
+                    violation_count = violation_count + 1
+                    lambda_to_print(DummyEntity(), metric, stats_value)
+                else:
+                    if bool(cmdline_arguments["--showHighest"]):
+                        print("...........................................")
+                        print("INFO(STATS): %s = %s (violation threshold is %s):" % (metric, stats_value, max_allowed_value))
+                        print("...........................................")
+            if save_histograms and len(all_values) > 0 and lambda_stats is None:
+                output_dir = cmdline_arguments["--outputDir"]
+                file_prefix = "%s%s%s" % (output_dir, os.sep, os.path.split(db.name())[-1])
+                histograms.append([bool(cmdline_arguments["--showMeanMedian"]),
+                                   bool(cmdline_arguments["--logarithmic"]),
+                                   file_prefix,
+                                   max_value_found,
+                                   metric,
+                                   all_values,
+                                   scope_name])
+
+    for file_name, mean, median, pstdev in render_histograms(histograms, int(cmdline_arguments.get("--renderJobs", 1) or 1),
+                                                             cmdline_arguments.get("--renderPool", "process") or "process"):
+        if verbose:
+            print("Saved %s" % file_name)
     return [violation_count, highest_values_found_by_metric, max_values_allowed_by_metric]
 
 
@@ -295,14 +363,14 @@ def write_metrics_thresholds(json_path, new_max_metrics):
         with open(json_path, "w") as json_file:
             json.dump(original_thresholds, json_file, sort_keys=True) # at this point, original_thresholds has been adapted
 
-def process_file_metrics (db, cmdline_arguments):
-    return process_generic_metrics(db,cmdline_arguments,"--maxFileMetrics", cmdline_arguments["--fileQuery"], _print_file_violation, cmdline_arguments.get("--regexIgnoreFiles", None), "File")
+def process_file_metrics (db, cmdline_arguments, entity_filter):
+    return process_generic_metrics(db,cmdline_arguments,"--maxFileMetrics", cmdline_arguments["--fileQuery"], _print_file_violation, entity_filter, "File")
 
-def process_class_metrics (db, cmdline_arguments):
-    return process_generic_metrics(db,cmdline_arguments,"--maxClassMetrics", cmdline_arguments["--classQuery"], _print_class_violation, cmdline_arguments.get("--regexIgnoreClasses", None), "Class")
+def process_class_metrics (db, cmdline_arguments, entity_filter):
+    return process_generic_metrics(db,cmdline_arguments,"--maxClassMetrics", cmdline_arguments["--classQuery"], _print_class_violation, entity_filter, "Class")
 
-def process_routine_metrics (db, cmdline_arguments):
-    return process_generic_metrics(db,cmdline_arguments,"--maxRoutineMetrics", cmdline_arguments["--routineQuery"], _print_routine_violation, cmdline_arguments.get("--regexIgnoreRoutines", None), "Routine")
+def process_routine_metrics (db, cmdline_arguments, entity_filter):
+    return process_generic_metrics(db,cmdline_arguments,"--maxRoutineMetrics", cmdline_arguments["--routineQuery"], _print_routine_violation, entity_filter, "Routine")
 
 def append_dict_with_key_prefix (dict_to_grow, dict_to_append, prefix):
     for k,v in dict_to_append.items():
@@ -323,29 +391,65 @@ def save_kiviat_of_metrics(tracked_metrics, max_metrics, arguments, filename_pre
     return save_kiviat_with_values_and_thresholds(all_labels, all_values, all_thresholds, filename, None, max_vals = all_max_values, min_vals=min_vals)
 
 
+SCOPES = [["File", process_file_metrics, "--maxFileMetrics", "\r\n====== File Metrics that failed the filters  ==========="],
+          ["Class", process_class_metrics, "--maxClassMetrics", "\r\n====== Class Metrics that failed the filters  =========="],
+          ["Routine", process_routine_metrics, "--maxRoutineMetrics", "\r\n====== Routine Metrics that failed the filters =========="]]
+
+def open_db(arguments):
+    return open_db_or_snapshot(arguments["--snapshot"] or arguments["--in"], arguments["--dllDir"], snapshot=arguments["--snapshot"] is not None)
+
+def process_scope_in_worker(scope_index, arguments):
+    # Understand allows only one open db per process (DBAlreadyOpen), so each worker process opens its own.
+    # What the scope prints is captured and replayed by the parent, in scope order.
+    output = io.StringIO()
+    profiler.start(arguments["--profileReport"], "srccheck")
+    plot_cache.start(arguments["--plotCache"])
+    with contextlib.redirect_stdout(output):
+        try:
+            db = open_db(arguments)
+            try:
+                scope_name, process_lambda, json_param, header = SCOPES[scope_index]
+                result = process_lambda(db, arguments, entity_filter_from_arguments(arguments))
+                if plot_cache.enabled:
+                    print(plot_cache.summary())
+            finally:
+                db.close()
+        except SystemExit as exc: # open_db_or_snapshot & co print why, then exit: the parent replays that and exits
+            result = exc
+    return [output.getvalue(), result, profiler.phase_dicts]
+
 def main():
     start_time = datetime.datetime.now()
     arguments = docopt(__doc__, version=VERSION)
 
-    insert_understand_in_path(arguments["--dllDir"])
-
     print ("\r\n====== srccheck @ https://github.com/sglebs/srccheck ==========")
     print(arguments)
     try:
-        import understand
-    except:
-        print ("Can' find the Understand DLL. Use --dllDir=...")
-        print ("Please set PYTHONPATH to point an Understand's C:/Program Files/SciTools/bin/pc-win64 or equivalent")
-        sys.exit(-1)
-    try:
-        db = understand.open(arguments["--in"])
-    except understand.UnderstandError as exc:
-        print ("Error opening input file: %s" % exc)
-        sys.exit(-2)
+        entity_filter = entity_filter_from_arguments(arguments)
+    except ValueError as exc:
+        print ("Invalid regex: %s" % exc)
+        sys.exit(-3)
+    if arguments["--renderPool"] not in RENDER_POOLS:
+        print ("Invalid --renderPool: %s (use %s)" % (arguments["--renderPool"], " or ".join(sorted(RENDER_POOLS))))
+        sys.exit(-3)
+    if arguments["--topViolators"] is not None and (not arguments["--topViolators"].isdigit() or int(arguments["--topViolators"]) < 1):
+        print ("Invalid --topViolators: %s (use a number of violators per metric, 1 or more)" % arguments["--topViolators"])
+        sys.exit(-3)
+    profiler.start(arguments["--profileReport"], "srccheck")
+    plot_cache.start(arguments["--plotCache"])
+    db = open_db(arguments)
+    jobs = int(arguments["--jobs"])
+    executor = None
+    scope_futures = []
+    if jobs > 1: # the scopes run in worker processes while we compute the project metrics here
+        # spawned, not forked: a forked worker would inherit our open db, and Understand allows only one per process (DBAlreadyOpen)
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(SCOPES)), mp_context=multiprocessing.get_context("spawn"))
+        scope_futures = [executor.submit(process_scope_in_worker, scope_index, arguments) for scope_index in range(len(SCOPES))]
 
     adaptive = arguments.get("--adaptive", False)
     print ("\r\n====== Project Metrics (%s) (%s) ==========" % (db.name(), db.language()[0]))
-    prj_metrics = project_metrics(db, arguments)
+    with profiler.phase("project metrics"):
+        prj_metrics = project_metrics(db, arguments)
     print_prj_metrics(prj_metrics)
     print ("")
     print ("\r\n====== Project Metrics that failed the filters  ===========")
@@ -353,35 +457,37 @@ def main():
     if adaptive:
         write_metrics_thresholds(arguments.get("--maxPrjMetrics", False), prj_tracked_metrics)
     print ("")
-    print ("\r\n====== File Metrics that failed the filters  ===========")
-    [violation_count, file_tracked_metrics, file_max_metrics ] = process_file_metrics(db, arguments)
-    total_violation_count = total_violation_count + violation_count
-    if adaptive:
-        write_metrics_thresholds(arguments.get("--maxFileMetrics"), file_tracked_metrics)
-    print ("")
-    print ("\r\n====== Class Metrics that failed the filters  ==========")
-    [violation_count, class_tracked_metrics, class_max_metrics ] = process_class_metrics(db, arguments)
-    total_violation_count = total_violation_count + violation_count
-    if adaptive:
-        write_metrics_thresholds(arguments.get("--maxClassMetrics"), class_tracked_metrics)
-    print ("")
-    print ("\r\n====== Routine Metrics that failed the filters ==========")
-    [violation_count, routine_tracked_metrics, routine_max_metrics ] = process_routine_metrics(db, arguments)
-    total_violation_count = total_violation_count + violation_count
-    if adaptive:
-        write_metrics_thresholds(arguments.get("--maxRoutineMetrics"), routine_tracked_metrics)
-    print ("")
+    tracked_metrics_by_scope = {}
+    max_metrics_by_scope = {}
+    for scope_index, [scope_name, process_lambda, json_param, header] in enumerate(SCOPES):
+        print (header)
+        if executor is None:
+            [violation_count, scope_tracked_metrics, scope_max_metrics ] = process_lambda(db, arguments, entity_filter)
+        else:
+            scope_output, scope_result, scope_phases = scope_futures[scope_index].result()
+            profiler.add_phase_dicts(scope_phases, "worker")
+            print (scope_output, end="")
+            if isinstance(scope_result, SystemExit):
+                executor.shutdown(cancel_futures=True)
+                sys.exit(scope_result.code)
+            [violation_count, scope_tracked_metrics, scope_max_metrics ] = scope_result
+        total_violation_count = total_violation_count + violation_count
+        if adaptive:
+            write_metrics_thresholds(arguments.get(json_param), scope_tracked_metrics)
+        tracked_metrics_by_scope[scope_name] = scope_tracked_metrics
+        max_metrics_by_scope[scope_name] = scope_max_metrics
+        print ("")
+    if executor is not None:
+        executor.shutdown()
     print ("\r\n====== Publishing selected metrics  ===========")
     tracked_metrics = {}
     append_dict_with_key_prefix (tracked_metrics, prj_tracked_metrics, "Prj")
-    append_dict_with_key_prefix (tracked_metrics, file_tracked_metrics, "File")
-    append_dict_with_key_prefix (tracked_metrics, class_tracked_metrics, "Class")
-    append_dict_with_key_prefix (tracked_metrics, routine_tracked_metrics, "Routine")
+    for scope_name, scope_tracked_metrics in tracked_metrics_by_scope.items():
+        append_dict_with_key_prefix (tracked_metrics, scope_tracked_metrics, scope_name)
     max_metrics = {}
     append_dict_with_key_prefix (max_metrics, prj_max_metrics, "Prj")
-    append_dict_with_key_prefix (max_metrics, file_max_metrics, "File")
-    append_dict_with_key_prefix (max_metrics, class_max_metrics, "Class")
-    append_dict_with_key_prefix (max_metrics, routine_max_metrics, "Routine")
+    for scope_name, scope_max_metrics in max_metrics_by_scope.items():
+        append_dict_with_key_prefix (max_metrics, scope_max_metrics, scope_name)
     output_dir = arguments["--outputDir"]
     file_prefix = "%s%s%s" % (output_dir, os.sep, os.path.split(db.name())[-1])
     file_name = save_kiviat_of_metrics(tracked_metrics, max_metrics, arguments, file_prefix)
@@ -395,6 +501,8 @@ def main():
 
     post_metrics_to_sonar(arguments, tracked_metrics)
     print ("")
+    if plot_cache.enabled:
+        print(plot_cache.summary())
     end_time = datetime.datetime.now()
     print ("\r\n--------------------------------------------------")
     print ("Started : %s" % str(start_time))
@@ -403,6 +511,7 @@ def main():
     print ("Violations: %i" % total_violation_count)
     print ("--------------------------------------------------")
     db.close()
+    profiler.save()
     sys.exit(total_violation_count)
 
 if __name__ == '__main__':
@@ -18,6 +18,8 @@ Usage:
                 [--regexIgnoreRoutines=<regexIgnoreRoutines>] \r\n \
                 [--ballSize=<ballSize>] \r\n \
                 [--minChange=<minChange>] \r\n \
+                [--maxPoints=<maxPoints>] \r\n \
+                [--htmlWriter=<htmlWriter>] \r\n \
                 [--showMeanMedian] \r\n \
                 [--skipPrjMetrics=<skipPrjMetrics>]\r\n \
                 [--outputCSV=<outputCSV>] \r\n \
@@ -25,11 +27,13 @@ Usage:
                 [--sonarPrj=<sonarPrj>] \r\n \
                 [--sonarUser=<sonarUser>] \r\n \
                 [--sonarPass=<sonarPass>] \r\n \
-                [--verbose]
+                [--verbose] \r\n \
+                [--profileReport=<profileReport>] \r\n \
+                [--plotCache=<plotCache>]
 
 Options:
-  --before=<inputUDB>                           File path to a UDB with the "before" state of your sources
-  --after=<inputUDB>                            File path to a UDB with the "after" state of your sources
+  --before=<inputUDB>                           File path to a UDB (or a .npz snapshot saved by srcextract) with the "before" state of your sources
+  --after=<inputUDB>                            File path to a UDB (or a .npz snapshot saved by srcextract) with the "after" state of your sources
   --dllDir=<dllDir>                             Path to the dir with the Understand bin and DLLs.[default: C:/Program Files/SciTools/bin/pc-win64]
   --skipLibs=<skipLibs>                         false for full analysis. true if you want to skip libraries you import. [default: true]
   --fileQuery=<fileQuery>                       Kinds of files you want to traverse[default: file ~Unknown ~Unresolved]
@@ -45,6 +49,8 @@ Options:
   --regexIgnoreRoutines=<regexIgnoreRoutines>   A regex to filter routines out
   --ballSize=<ballSize>                         Size of the ball (circles) in the plots [Default: 40]
   --minChange=<minChange>                       Minimum change in metric value to be considered for the plot [Default: 1]
+  --maxPoints=<maxPoints>                       Max circles (each with its tooltip) per plot. Beyond that, only the outliers (and the stats of -m) are circles, the other entities are counted in grey cells. 0 for no limit. [default: 0]
+  --htmlWriter=<htmlWriter>                     mpld3 (the whole figure) or compact (the points as typed arrays, drawn by srcscatter.js, saved next to the HTML files): much smaller files, which open faster. [default: mpld3]
   -v, --verbose                                 If you want lots of messages printed. [default: false]
   -m, --showMeanMedian                          If you want to show circles for mean (blue), median (yellow), stdev (cyan) [default: false]
   --skipPrjMetrics=<skipPrjMetrics>             Skip these project metrics (CSV of values) when printing/processing all prj metrics (for speed) [default: CountDeclMethodAll,MaxInheritanceTree,Essential,MaxEssential,MaxEssentialKnots,MaxNesting]
@@ -54,6 +60,8 @@ Options:
   --sonarPass=<sonarPass>                       Password for Sonar authentication [default: admin]
   --outputCSV=<outputCSV>                       Output CSV file path with the prj growth ratios for metrics listed at --maxPrjMetrics. Useful with the Jenkins/Plot plugin [default: diffmetrics.csv]
   --outputDir=<path>                            Where files should be generated. [default: .]
+  --profileReport=<profileReport>               Path of a JSON file to save the wall time, CPU time, peak memory and entity counts of each phase of the run to. Slows the run down.
+  --plotCache=<plotCache>                       Dir of a plot cache, created if needed. Plots drawn from the same values and options as in a previous run are hard-linked (or copied) from it instead of being rendered again.
 
 Errors:
   DBAlreadyOpen        - only one database may be open at once
@@ -76,18 +84,16 @@ import sys
 from docopt import docopt
 
 from utilities import VERSION
-from utilities.utils import stream_of_entity_with_metrics, save_scatter, save_kiviat_with_values_and_thresholds, \
-    post_metrics_to_sonar, save_csv, insert_understand_in_path
+from utilities.plotcache import plot_cache
+from utilities.profiling import profiler
+from utilities.records import BeforeAfterTable
+from utilities.utils import stream_of_entity_with_metrics, save_scatter, HTML_WRITERS, save_kiviat_with_values_and_thresholds, \
+    post_metrics_to_sonar, save_csv, open_db_or_snapshot, entity_filter_from_arguments
 
 
-def plot_diff_file_metrics (db_before, db_after, cmdline_arguments):
-    return plot_diff_generic_metrics(db_before, db_after, cmdline_arguments, cmdline_arguments["--fileMetrics"], cmdline_arguments["--fileQuery"], cmdline_arguments.get("--regexIgnoreFiles", None), "File")
-
-def plot_diff_class_metrics (db_before, db_after, cmdline_arguments):
-    return plot_diff_generic_metrics(db_before, db_after, cmdline_arguments, cmdline_arguments["--classMetrics"], cmdline_arguments["--classQuery"], cmdline_arguments.get("--regexIgnoreClasses", None), "Class")
-
-def plot_diff_routine_metrics (db_before, db_after, cmdline_arguments):
-    return plot_diff_generic_metrics(db_before, db_after, cmdline_arguments, cmdline_arguments["--routineMetrics"], cmdline_arguments["--routineQuery"], cmdline_arguments.get("--regexIgnoreRoutines", None), "Routine")
+SCOPES = [["File", "--fileMetrics", "--fileQuery"],
+          ["Class", "--classMetrics", "--classQuery"],
+          ["Routine", "--routineMetrics", "--routineQuery"]]
 
 def _name_of_entity(entity, scope):
     if scope == "File":
@@ -95,43 +101,32 @@ def _name_of_entity(entity, scope):
     else:
         return entity.longname()
 
-def compute_metrics_before_after (db_before, db_after, cmdline_arguments, metrics_as_string, entityQuery, regex_str_ignore_item, scope_name):
-    regex_str_traverse_files = cmdline_arguments.get("--regexTraverseFiles", "*")
-    regex_ignore_files = cmdline_arguments.get("--regexIgnoreFiles", None)
+def _metric_names(metrics_as_string):
+    return [metric.strip() for metric in metrics_as_string.split(",")]
+
+def extract_metrics (db, tag, before_after_by_scope, cmdline_arguments, entity_filter):
+    # Fills the tag ("before" or "after") columns of the BeforeAfterTable of each scope. One db at a time:
+    # Understand allows only one open db per process (DBAlreadyOpen)
     skipLibraries = cmdline_arguments["--skipLibs"] == "true"
     verbose = cmdline_arguments["--verbose"]
-    metrics = [metric.strip() for metric in metrics_as_string.split(",")]
-    before_after_by_entity_name = {}
-    for entity, container_file, metric_dict in \
-            stream_of_entity_with_metrics(db_before.ents(entityQuery), metrics,
-                                          verbose, skipLibraries,
-                                         regex_str_ignore_item,
-                                         regex_str_traverse_files,
-                                         regex_ignore_files):
-        attribs = {}
-        attribs["before"] = metric_dict
-        before_after_by_entity_name[_name_of_entity(entity,scope_name)] = attribs
-    for entity, container_file, metric_dict in \
-            stream_of_entity_with_metrics(db_after.ents(entityQuery), metrics,
-                                          verbose, skipLibraries,
-                                         regex_str_ignore_item,
-                                         regex_str_traverse_files,
-                                         regex_ignore_files):
-        attribs = before_after_by_entity_name.get(_name_of_entity(entity,scope_name),{}) # maybe it is already there... maybe not
-        attribs["after"] = metric_dict
-        before_after_by_entity_name[_name_of_entity(entity,scope_name)] = attribs
-    return before_after_by_entity_name
-
-
-def collect_values_that_changed (before_after_by_entity_name, tag_before, tag_after, metric_name, minimal_change):
+    for scope_name, metrics_option, query_option in SCOPES:
+        metrics = _metric_names(cmdline_arguments[metrics_option])
+        before_after = before_after_by_scope.setdefault(scope_name, BeforeAfterTable(metrics))
+        for entity, container_file, metric_dict in profiler.counted("%s %s extraction" % (scope_name, tag),
+                stream_of_entity_with_metrics(db.ents(cmdline_arguments[query_option]), metrics,
+                                              verbose, skipLibraries,
+                                              entity_filter,
+                                              scope_name)):
+            before_after.set_metrics(tag, _name_of_entity(entity,scope_name), metric_dict) # maybe it is already there... maybe not
+
+
+def collect_values_that_changed (before_after, tag_before, tag_after, metric_name, minimal_change):
     results_before = []
     results_after = []
     names = []
-    for entity_name, entity_props in before_after_by_entity_name.items():
-        value_before = entity_props.get(tag_before, {}).get(metric_name, 0)
-        value_before = 0 if value_before is None else value_before
-        value_after = entity_props.get(tag_after, {}).get(metric_name, 0)
-        value_after = 0 if value_after is None else value_after
+    for entity_name, value_before, value_after in zip(before_after.entity_names,
+                                                      before_after.column(tag_before, metric_name),
+                                                      before_after.column(tag_after, metric_name)):
         if abs(value_before - value_after) >= minimal_change:
             results_before.append(value_before)
             results_after.append(value_after)
@@ -160,20 +155,17 @@ def add_stats(all_before, all_after, entity_names, colors):
     colors.append("c")
 
 
-def plot_diff_generic_metrics (db_before, db_after, cmdline_arguments, metrics_as_string, entityQuery, regex_str_ignore_item, scope_name):
-    before_after_by_entity_name = compute_metrics_before_after(db_before, db_after, cmdline_arguments,
-                                                               metrics_as_string, entityQuery, regex_str_ignore_item,
-                                                               scope_name)
-
-    metric_names = [metric.strip() for metric in metrics_as_string.split(",")]
-    for i, metric_name in enumerate(metric_names):
-        all_before, all_after, entity_names = collect_values_that_changed(before_after_by_entity_name, "before", "after", metric_name, int(cmdline_arguments["--minChange"]))
+def plot_diff_generic_metrics (db_names, cmdline_arguments, before_after, scope_name):
+    for i, metric_name in enumerate(before_after.metric_names):
+        all_before, all_after, entity_names = collect_values_that_changed(before_after, "before", "after", metric_name, int(cmdline_arguments["--minChange"]))
         if len(all_before) > 0:
             colors = ["r" if y > x else "g" for x,y in zip(all_before,all_after)]
+            always_show = [False] * len(all_before)
             if bool(cmdline_arguments["--showMeanMedian"]):
                 add_stats(all_before, all_after, entity_names, colors)
+                always_show.extend([True] * (len(all_before) - len(always_show)))
             output_dir = cmdline_arguments["--outputDir"]
-            file_prefix = "%s%s%s" % (output_dir, os.sep, os.path.split(db_before.name())[-1] + "-" + os.path.split(db_after.name())[-1] + "-" + metric_name)
+            file_prefix = "%s%s%s" % (output_dir, os.sep, os.path.split(db_names[0])[-1] + "-" + os.path.split(db_names[1])[-1] + "-" + metric_name)
             file_name = save_scatter(all_before, "Before",
                                      all_after, "After",
                                      int(cmdline_arguments["--ballSize"]), metric_name,
@@ -182,9 +174,12 @@ def plot_diff_generic_metrics (db_before, db_after, cmdline_arguments, metrics_a
                                      file_prefix,
                                      scope_name,
                                      show_diagonal=True,
-                                     format="html")
+                                     format="html",
+                                     max_points=int(cmdline_arguments["--maxPoints"]),
+                                     always_show=always_show,
+                                     html_writer=cmdline_arguments["--htmlWriter"])
             print("Saved %s" % file_name)
-    return before_after_by_entity_name
+    return before_after
 
 def print_growth_rates(all_metric_names, all_growth_rates):
     print("\nMetric Growth Rate in Project")
@@ -193,9 +188,7 @@ def print_growth_rates(all_metric_names, all_growth_rates):
         print("%s:\t%f" % (name.replace("\n", " "), growth_rate))
 
 
-def collect_metric_names_with_values_and_growth(db_after, db_before, prj_metric_names):
-    prj_metrics_before = db_before.metric(prj_metric_names)
-    prj_metrics_after = db_after.metric(prj_metric_names)
+def collect_metric_names_with_values_and_growth(prj_metrics_after, prj_metrics_before, prj_metric_names):
     all_metric_names = []
     all_metric_values_before = []
     all_metric_values_after = []
@@ -216,39 +209,39 @@ def main():
     start_time = datetime.datetime.now()
     arguments = docopt(__doc__, version=VERSION)
 
-    insert_understand_in_path(arguments["--dllDir"])
-
     print ("\r\n====== srcdiffplot @ https://github.com/sglebs/srccheck ==========")
     print(arguments)
     try:
-        import understand
-    except:
-        print ("Can' find the Understand DLL. Use --dllDir=...")
-        print ("Please set PYTHONPATH to point an Understand's C:/Program Files/SciTools/bin/pc-win64 or equivalent")
-        sys.exit(-1)
-    try:
-        db_before = understand.open(arguments["--before"])
-    except understand.UnderstandError as exc:
-        print ("Error opening input file: %s" % exc)
-        sys.exit(-2)
-    try:
-        db_after = understand.open(arguments["--after"])
-    except understand.UnderstandError as exc:
-        print ("Error opening input file: %s" % exc)
-        sys.exit(-2)
-
-    print("Processing %s and %s" % (db_before.name(), db_after.name()))
-
-    for plot_lambda in [plot_diff_file_metrics, plot_diff_class_metrics,plot_diff_routine_metrics]:
-        plot_lambda(db_before, db_after, arguments)
-
-
+        entity_filters = [entity_filter_from_arguments(arguments), entity_filter_from_arguments(arguments)]
+    except ValueError as exc:
+        print ("Invalid regex: %s" % exc)
+        sys.exit(-3)
+    if arguments["--htmlWriter"] not in HTML_WRITERS:
+        print ("Invalid --htmlWriter: %s (use %s)" % (arguments["--htmlWriter"], " or ".join(HTML_WRITERS)))
+        sys.exit(-3)
+    profiler.start(arguments["--profileReport"], "srcdiffplot")
+    plot_cache.start(arguments["--plotCache"])
     prj_metric_names = [metric.strip() for metric in arguments["--prjMetrics"].split(",")]
     prj_metric_names = [metric for metric in prj_metric_names if len(metric)>0 ]
+    before_after_by_scope = {}
+    db_names = []
+    prj_metrics_by_tag = {}
+    for tag, entity_filter in zip(["before", "after"], entity_filters): # the before db is closed before the after db is opened
+        db = open_db_or_snapshot(arguments["--%s" % tag], arguments["--dllDir"])
+        db_names.append(db.name())
+        print("Processing %s" % db.name())
+        extract_metrics(db, tag, before_after_by_scope, arguments, entity_filter)
+        with profiler.phase("project metrics %s" % tag):
+            prj_metrics_by_tag[tag] = db.metric(prj_metric_names)
+        db.close()
+
+    for scope_name, metrics_option, query_option in SCOPES:
+        plot_diff_generic_metrics(db_names, arguments, before_after_by_scope[scope_name], scope_name)
+
     all_metric_names, all_metric_values_before, all_metric_values_after, all_growth_rates = collect_metric_names_with_values_and_growth(
-        db_after, db_before, prj_metric_names)
+        prj_metrics_by_tag["after"], prj_metrics_by_tag["before"], prj_metric_names)
     output_dir = arguments["--outputDir"]
-    file_name = os.path.split(db_before.name())[-1] + "-" + os.path.split(db_after.name())[-1] + "-diff-kiviat.png"
+    file_name = os.path.split(db_names[0])[-1] + "-" + os.path.split(db_names[1])[-1] + "-diff-kiviat.png"
     absolute_file_name = "%s%s%s" % (output_dir, os.sep, file_name)
     if len (all_metric_names) > 0:
         saved_file_name = save_kiviat_with_values_and_thresholds(all_metric_names, all_metric_values_after, all_metric_values_before, absolute_file_name, "Prj Metrics", thresholdslabel="before", valueslabel="after")
@@ -263,14 +256,15 @@ def main():
     else:
         print("\n*** Problems creating CSV file %s" % absolute_csv_path)
     post_metrics_to_sonar(arguments, rates_by_adjusted_metric_name)
+    if plot_cache.enabled:
+        print(plot_cache.summary())
     end_time = datetime.datetime.now()
     print("\r\n--------------------------------------------------")
     print("Started : %s" % str(start_time))
     print("Finished: %s" % str(end_time))
     print("Total: %s" % str(end_time - start_time))
     print("--------------------------------------------------")
-    db_before.close()
-    db_after.close()
+    profiler.save()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+"""Source Code Metrics Extractor.
+
+Usage:
+  srcextract    --in=<inputUDB> --out=<snapshotFile> \r\n \
+                [--dllDir=<dllDir>]\r\n \
+                [--skipLibs=<skipLibs>]\r\n \
+                [--fileQuery=<fileQuery>]\r\n \
+                [--classQuery=<classQuery>]\r\n \
+                [--routineQuery=<routineQuery>]\r\n \
+                [--fileMetrics=<fileMetrics>]\r\n \
+                [--classMetrics=<classMetrics>]\r\n \
+                [--routineMetrics=<routineMetrics>]\r\n \
+                [--skipPrjMetrics=<skipPrjMetrics>]\r\n \
+                [--verbose]
+
+
+Options:
+  --in=<inputUDB>                               Input UDB file path.
+  --out=<snapshotFile>                          Output snapshot file path (.npz), to be used with --snapshot by srccheck, srchistplot, srcscatterplot and srcdiffplot.
+  --dllDir=<dllDir>                             Path to the dir with the Understand bin and DLLs.[default: C:/Program Files/SciTools/bin/pc-win64]
+  --skipLibs=<skipLibs>                         false for full analysis. true if you want to skip libraries you import. [default: true]
+  --fileQuery=<fileQuery>                       Kinds of files you want to traverse[default: file ~Unknown ~Unresolved]
+  --classQuery=<classQuery>                     Kinds of classes your language has. [default: class ~Unknown ~Unresolved, interface ~Unknown ~Unresolved]
+  --routineQuery=<routineQuery>                 Kinds of routines your language has. [default: function ~Unknown ~Unresolved,method ~Unknown ~Unresolved,procedure ~Unknown ~Unresolved,routine ~Unknown ~Unresolved,classmethod ~Unknown ~Unresolved]
+  --fileMetrics=<fileMetrics>                   A CSV containing file metric names you want to extract [default: CountLineCode,CountDeclFunction,CountDeclClass,CountDeclModule,MaxCyclomaticModified,MaxNesting]
+  --classMetrics=<classMetrics>                 A CSV containing class metric names you want to extract [default: CountDeclMethod,CountDeclMethodNonStub,PercentLackOfCohesion,MaxInheritanceTree,CountClassCoupled,CountLineCode]
+  --routineMetrics=<routineMetrics>             A CSV containing routine metric names you want to extract [default: CountLineCode,CountParams,CyclomaticStrict,CyclomaticModified,MaxNesting]
+  --skipPrjMetrics=<skipPrjMetrics>             Skip these project metrics (CSV of values) when extracting all prj metrics (for speed) [default: CountDeclMethodAll,MaxInheritanceTree,Essential,MaxEssential,MaxEssentialKnots,MaxNesting]
+  -v, --verbose                                 If you want lots of messages printed. [default: false]
+
+Errors:
+  DBAlreadyOpen        - only one database may be open at once
+  DBCorrupt            - bad database file
+  DBOldVersion         - database needs to be rebuilt
+  DBUnknownVersion     - database needs to be rebuilt
+  DBUnableOpen         - database is unreadable or does not exist
+  NoApiLicense         - Understand license required
+
+Author:
+  Marcio Marchini (marcio@BetterDeveloper.net)
+
+"""
+
+import datetime
+from docopt import docopt
+from utilities.utils import open_db_or_snapshot, entity_metrics, EntityFilter
+from utilities.snapshot import MetricTable, save_snapshot
+from utilities.synthetic_metrics import plan_for_metrics
+from utilities import VERSION
+
+
+def extract_scope_metrics (db, cmdline_arguments, entity_filter, file_index_by_longname, entityQuery, metrics_as_string, scope_name):
+    skipLibraries = cmdline_arguments["--skipLibs"] == "true"
+    verbose = cmdline_arguments["--verbose"]
+    metrics = [metric.strip() for metric in metrics_as_string.split(",") if len(metric.strip()) > 0]
+    metrics = plan_for_metrics(metrics)[0] # plus the base metrics of the synthetic ones, which the tools fetch along with them
+    table = MetricTable(scope_name, entityQuery, metrics)
+    for entity in db.ents(entityQuery):
+        resolved = entity_filter.resolve(entity)
+        if resolved.library_name != "" and skipLibraries:
+            continue
+        if resolved.is_unknown():
+            continue
+        container_file = entity_filter.container_file_of(entity, resolved)
+        file_index = -1
+        if container_file is None:
+            if verbose:
+                print("WARNING: no container file: %s" % resolved.longname)
+        else:
+            file_index = file_index_by_longname.setdefault(entity_filter.resolve(container_file).longname, len(file_index_by_longname))
+        table.append(resolved.longname, entity.relname(), resolved.kind_name, resolved.library_name, file_index,
+                     entity_metrics(entity, metrics))
+    print("%s: %i entities, %i metrics" % (scope_name, len(table), len(metrics)))
+    return table
+
+
+def extract_prj_metrics (db, cmdline_arguments):
+    skip_set = set(cmdline_arguments["--skipPrjMetrics"].split(","))
+    selected_metric_names = [metric for metric in db.metrics() if metric not in skip_set]
+    return db.metric(selected_metric_names)
+
+
+def main():
+    start_time = datetime.datetime.now()
+    arguments = docopt(__doc__, version=VERSION)
+    print ("\r\n====== srcextract @ https://github.com/sglebs/srccheck ==========")
+    print(arguments)
+    db = open_db_or_snapshot(arguments["--in"], arguments["--dllDir"], snapshot=False)
+
+    print("Processing %s" % db.name())
+    entity_filter = EntityFilter(None, None, {}) # no regex filtering here: the tools reading the snapshot apply their own
+    file_index_by_longname = {}
+    tables = [extract_scope_metrics(db, arguments, entity_filter, file_index_by_longname, arguments["--fileQuery"], arguments["--fileMetrics"], "File"),
+              extract_scope_metrics(db, arguments, entity_filter, file_index_by_longname, arguments["--classQuery"], arguments["--classMetrics"], "Class"),
+              extract_scope_metrics(db, arguments, entity_filter, file_index_by_longname, arguments["--routineQuery"], arguments["--routineMetrics"], "Routine")]
+    file_longnames = sorted(file_index_by_longname.keys(), key=file_index_by_longname.get)
+    file_name = save_snapshot(arguments["--out"], db.name(), db.language(), file_longnames, tables, extract_prj_metrics(db, arguments))
+    print("Saved %s" % file_name)
+    end_time = datetime.datetime.now()
+    print("\r\n--------------------------------------------------")
+    print("Started : %s" % str(start_time))
+    print("Finished: %s" % str(end_time))
+    print("Total: %s" % str(end_time - start_time))
+    print("--------------------------------------------------")
+    db.close()
+
+if __name__ == '__main__':
+    main()
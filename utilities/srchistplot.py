@@ -1,7 +1,7 @@
 """Source Code Histogram Plot.
 
 Usage:
-  srchistplot   --in=<inputUDB> \r\n \
+  srchistplot   (--in=<inputUDB> | --snapshot=<snapshotFile>) \r\n \
                 [--outputDir=<path to dir where to save files>] \r\n \
                 [--dllDir=<dllDir>]\r\n \
                 [--skipLibs=<skipLibs>]\r\n \
@@ -18,11 +18,16 @@ Usage:
                 [--verbose]  \r\n \
                 [--logarithmic]  \r\n \
                 [--skipZeroes]  \r\n \
-                [--showMeanMedian]
+                [--showMeanMedian] \r\n \
+                [--renderJobs=<renderJobs>] \r\n \
+                [--renderPool=<renderPool>] \r\n \
+                [--profileReport=<profileReport>] \r\n \
+                [--plotCache=<plotCache>]
 
 
 Options:
   --in=<inputUDB>                               Input UDB file path.
+  --snapshot=<snapshotFile>                     Snapshot file (.npz) saved by srcextract, to use instead of --in. No Understand license needed.
   --dllDir=<dllDir>                             Path to the dir with the Understand bin and DLLs.[default: C:/Program Files/SciTools/bin/pc-win64]
   --skipLibs=<skipLibs>                         false for full analysis. true if you want to skip libraries you import. [default: true]
   --fileQuery=<fileQuery>                       Kinds of files you want to traverse[default: file ~Unknown ~Unresolved]
@@ -40,6 +45,10 @@ Options:
   -z, --skipZeroes                              If you want to skip datapoints which are zero[default: false]
   -m, --showMeanMedian                          If you want to show dotted lines for mean (blue) and median (red) [default: false]
   --outputDir=<path>                            Where files should be generated. [default: .]
+  --renderJobs=<renderJobs>                     Number of worker processes (or threads, see --renderPool) rendering the histograms, after the metrics of all scopes are extracted. [default: 1]
+  --renderPool=<renderPool>                     process or thread: with threads, no process start-up nor copy of the values, but the GIL. [default: process]
+  --profileReport=<profileReport>               Path of a JSON file to save the wall time, CPU time, peak memory and entity counts of each phase of the run to. Slows the run down.
+  --plotCache=<plotCache>                       Dir of a plot cache, created if needed. Plots drawn from the same values and options as in a previous run are hard-linked (or copied) from it instead of being rendered again.
 
 Errors:
   DBAlreadyOpen        - only one database may be open at once
@@ -58,75 +67,80 @@ import datetime
 import sys
 import os
 from docopt import docopt
-from utilities.utils import stream_of_entity_with_metric, save_histogram, insert_understand_in_path
+from utilities.plotcache import plot_cache
+from utilities.profiling import profiler
+from utilities.records import NumberColumn
+from utilities.utils import stream_of_entity_with_metric, render_histograms, RENDER_POOLS, open_db_or_snapshot, entity_filter_from_arguments
 from utilities import VERSION
 
 
-def plot_hist_file_metrics (db, cmdline_arguments):
-    plot_hist_generic_metrics(db, cmdline_arguments, cmdline_arguments["--fileMetrics"], cmdline_arguments["--fileQuery"], cmdline_arguments.get("--regexIgnoreFiles", None), "File")
+def plot_hist_file_metrics (db, cmdline_arguments, entity_filter):
+    return plot_hist_generic_metrics(db, cmdline_arguments, cmdline_arguments["--fileMetrics"], cmdline_arguments["--fileQuery"], entity_filter, "File")
 
-def plot_hist_class_metrics (db, cmdline_arguments):
-    plot_hist_generic_metrics(db, cmdline_arguments, cmdline_arguments["--classMetrics"], cmdline_arguments["--classQuery"], cmdline_arguments.get("--regexIgnoreClasses", None), "Class")
+def plot_hist_class_metrics (db, cmdline_arguments, entity_filter):
+    return plot_hist_generic_metrics(db, cmdline_arguments, cmdline_arguments["--classMetrics"], cmdline_arguments["--classQuery"], entity_filter, "Class")
 
-def plot_hist_routine_metrics (db, cmdline_arguments):
-    plot_hist_generic_metrics(db, cmdline_arguments, cmdline_arguments["--routineMetrics"], cmdline_arguments["--routineQuery"], cmdline_arguments.get("--regexIgnoreRoutines", None), "Routine")
+def plot_hist_routine_metrics (db, cmdline_arguments, entity_filter):
+    return plot_hist_generic_metrics(db, cmdline_arguments, cmdline_arguments["--routineMetrics"], cmdline_arguments["--routineQuery"], entity_filter, "Routine")
 
-def plot_hist_generic_metrics (db, cmdline_arguments, metrics_as_string, entityQuery, regex_str_ignore_item, scope_name):
-    regex_str_traverse_files = cmdline_arguments.get("--regexTraverseFiles", "*")
-    regex_ignore_files = cmdline_arguments.get("--regexIgnoreFiles", None)
+def plot_hist_generic_metrics (db, cmdline_arguments, metrics_as_string, entityQuery, entity_filter, scope_name):
     entities = db.ents(entityQuery)
     skipLibraries = cmdline_arguments["--skipLibs"] == "true"
     skip_zeroes = cmdline_arguments.get("--skipZeroes", False)
     verbose = cmdline_arguments["--verbose"]
     metrics = [metric.strip() for metric in metrics_as_string.split(",")]
+    histograms = [] # the arguments of save_histogram, rendered once all values are extracted (see render_histograms)
     for metric in sorted(metrics):
         local_metric = metric
         def metric_values(): # generator of a stream of float values, to be consumed by the stats functions
-            for entity, container_file, metric, metric_value in stream_of_entity_with_metric(entities, local_metric,
+            for entity, container_file, metric, metric_value in profiler.counted("%s %s extraction" % (scope_name, local_metric),
+                                                                                 stream_of_entity_with_metric(entities, local_metric,
                                                                                              verbose, skipLibraries,
-                                                                                             regex_str_ignore_item,
-                                                                                             regex_str_traverse_files,
-                                                                                             regex_ignore_files,
-                                                                                             skip_zeroes=skip_zeroes):
+                                                                                             entity_filter,
+                                                                                             scope_name,
+                                                                                             skip_zeroes=skip_zeroes)):
                 yield metric_value
 
-        metric_values_as_list = [value for value in metric_values()]
+        metric_values_as_list = NumberColumn(metric_values()).array
         max_value = max(metric_values_as_list) if len(metric_values_as_list)>0 else 0
         #bin_count = max (10, int (20 * math.log(abs(1+max_value),10)))
         output_dir = cmdline_arguments["--outputDir"]
         file_prefix = "%s%s%s" % (output_dir, os.sep, os.path.split(db.name())[-1])
-        file_name, mean, median, pstdev = save_histogram(bool(cmdline_arguments["--showMeanMedian"]),
-                                   bool(cmdline_arguments["--logarithmic"]),
-                                   file_prefix,
-                                   max_value,
-                                   metric,
-                                   metric_values_as_list,
-                                   scope_name)
-        print("Saved %s" % file_name)
+        histograms.append([bool(cmdline_arguments["--showMeanMedian"]),
+                           bool(cmdline_arguments["--logarithmic"]),
+                           file_prefix,
+                           max_value,
+                           metric,
+                           metric_values_as_list,
+                           scope_name])
+    return histograms
 
 
 def main():
     start_time = datetime.datetime.now()
     arguments = docopt(__doc__, version=VERSION)
-    insert_understand_in_path(arguments["--dllDir"])
     print ("\r\n====== srchistplot @ https://github.com/sglebs/srccheck ==========")
     print(arguments)
     try:
-        import understand
-    except:
-        print ("Can' find the Understand DLL. Use --dllDir=...")
-        print ("Please set PYTHONPATH to point an Understand's C:/Program Files/SciTools/bin/pc-win64 or equivalent")
-        sys.exit(-1)
-    try:
-        db = understand.open(arguments["--in"])
-    except understand.UnderstandError as exc:
-        print ("Error opening input file: %s" % exc)
-        sys.exit(-2)
+        entity_filter = entity_filter_from_arguments(arguments)
+    except ValueError as exc:
+        print ("Invalid regex: %s" % exc)
+        sys.exit(-3)
+    if arguments["--renderPool"] not in RENDER_POOLS:
+        print ("Invalid --renderPool: %s (use %s)" % (arguments["--renderPool"], " or ".join(sorted(RENDER_POOLS))))
+        sys.exit(-3)
+    profiler.start(arguments["--profileReport"], "srchistplot")
+    plot_cache.start(arguments["--plotCache"])
+    db = open_db_or_snapshot(arguments["--snapshot"] or arguments["--in"], arguments["--dllDir"], snapshot=arguments["--snapshot"] is not None)
 
     print("Processing %s" % db.name())
-    plot_hist_file_metrics(db, arguments)
-    plot_hist_class_metrics(db, arguments)
-    plot_hist_routine_metrics(db, arguments)
+    histograms = plot_hist_file_metrics(db, arguments, entity_filter)
+    histograms.extend(plot_hist_class_metrics(db, arguments, entity_filter))
+    histograms.extend(plot_hist_routine_metrics(db, arguments, entity_filter))
+    for file_name, mean, median, pstdev in render_histograms(histograms, int(arguments["--renderJobs"]), arguments["--renderPool"]):
+        print("Saved %s" % file_name)
+    if plot_cache.enabled:
+        print(plot_cache.summary())
     end_time = datetime.datetime.now()
     print("\r\n--------------------------------------------------")
     print("Started : %s" % str(start_time))
@@ -134,6 +148,7 @@ def main():
     print("Total: %s" % str(end_time - start_time))
     print("--------------------------------------------------")
     db.close()
+    profiler.save()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -10,7 +10,9 @@ Usage:
                 [--instabilityColumn=<columnName>] \r\n \
                 [--ballSizeMin=<ballSizeMin>] \r\n \
                 [--ballSizeMax=<ballSizeMax>] \r\n \
-                [--ballSizeRate=<ballSizeRate>]
+                [--ballSizeRate=<ballSizeRate>] \r\n \
+                [--htmlWriter=<htmlWriter>] \r\n \
+                [--plotCache=<plotCache>]
 
 
 
@@ -25,6 +27,8 @@ Options:
     --ballSizeMax=<ballSizeMax>         Maximum size of the ball [Default: 5000]
     --ballSizeRate=<ballSizeRate>       Rate at which the ball size grows per unit of the metric. [Default: 0.1]
     --outputDir=<path>                  Where files should be generated. [default: .]
+    --htmlWriter=<htmlWriter>           mpld3 (the whole figure) or compact (the points as typed arrays, drawn by srcscatter.js, saved next to the HTML files): much smaller files, which open faster. [default: mpld3]
+    --plotCache=<plotCache>             Dir of a plot cache, created if needed. Plots drawn from the same values and options as in a previous run are hard-linked (or copied) from it instead of being rendered again.
 
 
 Author:
@@ -34,9 +38,11 @@ Author:
 
 import datetime
 import os
+import sys
 import csv
 from docopt import docopt
-from utilities.utils import save_abstractness_x_instability_scatter
+from utilities.plotcache import plot_cache
+from utilities.utils import save_abstractness_x_instability_scatter, HTML_WRITERS
 from utilities import VERSION
 
 def scatter_plot (cmdline_arguments):
@@ -69,7 +75,8 @@ def scatter_plot (cmdline_arguments):
     output_dir = cmdline_arguments["--outputDir"]
     file_prefix = "%s%s%s" % (output_dir, os.sep, os.path.split(inputCSV)[-1])
     file_name = save_abstractness_x_instability_scatter(x_values, abstractnessColumn, y_values, instabilityColumn, ball_values, sizeColumn,
-                                                        color_values, complexityColumn, annotations, file_prefix, "Component")
+                                                        color_values, complexityColumn, annotations, file_prefix, "Component",
+                                                        html_writer=cmdline_arguments["--htmlWriter"])
     print("Saved %s" % file_name)
 
 
@@ -78,7 +85,13 @@ def main():
     arguments = docopt(__doc__, version=VERSION)
     print("\r\n====== srcinstplot @ https://github.com/sglebs/srccheck ==========")
     print("Processing %s" % arguments["--in"])
+    if arguments["--htmlWriter"] not in HTML_WRITERS:
+        print ("Invalid --htmlWriter: %s (use %s)" % (arguments["--htmlWriter"], " or ".join(HTML_WRITERS)))
+        sys.exit(-3)
+    plot_cache.start(arguments["--plotCache"])
     scatter_plot(arguments)
+    if plot_cache.enabled:
+        print(plot_cache.summary())
     end_time = datetime.datetime.now()
     print("\r\n--------------------------------------------------")
     print("Started : %s" % str(start_time))
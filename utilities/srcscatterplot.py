@@ -1,7 +1,7 @@
 """Source Code Stats Scatter Plot.
 
 Usage:
-  srcscatterplot    --in=<inputUDB> \r\n \
+  srcscatterplot    (--in=<inputUDB> | --snapshot=<snapshotFile>) \r\n \
                     [--outputDir=<path to dir where to save files>] \r\n \
                     [--dllDir=<dllDir>]\r\n \
                     [--skipLibs=<skipLibs>]\r\n \
@@ -13,10 +13,15 @@ Usage:
                     [--regexIgnoreClasses=<regexIgnoreClasses>] \r\n \
                     [--regexIgnoreRoutines=<regexIgnoreRoutines>] \r\n \
                     [--config=<jsonOrJsonFile>]\r\n \
-                    [--verbose]
+                    [--maxPoints=<maxPoints>]\r\n \
+                    [--htmlWriter=<htmlWriter>]\r\n \
+                    [--verbose] \r\n \
+                    [--profileReport=<profileReport>] \r\n \
+                    [--plotCache=<plotCache>]
 
 Options:
   --in=<inputUDB>                               Input UDB file path.
+  --snapshot=<snapshotFile>                     Snapshot file (.npz) saved by srcextract, to use instead of --in. No Understand license needed.
   --dllDir=<dllDir>                             Path to the dir with the Understand bin and DLLs.[default: C:/Program Files/SciTools/bin/pc-win64]
   --skipLibs=<skipLibs>                         false for full analysis. true if you want to skip libraries you import. [default: true]
   --fileQuery=<fileQuery>                       Kinds of files you want to traverse [default: file ~Unknown ~Unresolved]
@@ -27,9 +32,13 @@ Options:
   --regexIgnoreClasses=<regexIgnoreClasses>     A regex to filter classes out
   --regexIgnoreRoutines=<regexIgnoreRoutines>   A regex to filter routines out
   --config=<jsonOrJsonFile>                     A json which configures the plots for the supported scopes (File, Class, Routine). [default: {"File":[{"xMetric":"CountLineCode", "yMetric":"MaxCyclomaticModified", "ballMetric":"MaxNesting"}], "Class":[{"xMetric":"CountLineCode", "yMetric":"CountClassCoupled", "ballMetric":"PercentLackOfCohesion"}], "Routine":[{"xMetric":"CountLineCode", "yMetric":"CyclomaticModified", "ballMetric":"MaxNesting"}]}]
+  --maxPoints=<maxPoints>                       Max circles (each with its tooltip) per plot. Beyond that, only the outliers are circles, the other entities are counted in grey cells, so the HTML stays small. 0 for no limit. [default: 0]
+  --htmlWriter=<htmlWriter>                     mpld3 (the whole figure) or compact (the points as typed arrays, drawn by srcscatter.js, saved next to the HTML files): much smaller files, which open faster. [default: mpld3]
   -v, --verbose                                 If you want lots of messages printed. [default: false]
   -z, --skipZeroes                              If you want to skip datapoints which are zero [default: false]
   --outputDir=<path>                            Where files should be generated. [default: .]
+  --profileReport=<profileReport>               Path of a JSON file to save the wall time, CPU time, peak memory and entity counts of each phase of the run to. Slows the run down.
+  --plotCache=<plotCache>                       Dir of a plot cache, created if needed. Plots drawn from the same values and options as in a previous run are hard-linked (or copied) from it instead of being rendered again.
 
 Errors:
   DBAlreadyOpen        - only one database may be open at once
@@ -51,7 +60,9 @@ import datetime
 import sys
 import os
 from docopt import docopt
-from utilities.utils import stream_of_entity_with_metrics, save_scatter, load_json, insert_understand_in_path
+from utilities.plotcache import plot_cache
+from utilities.profiling import profiler
+from utilities.utils import stream_of_entity_with_metrics, save_scatter, HTML_WRITERS, load_json, open_db_or_snapshot, entity_filter_from_arguments
 from utilities import VERSION
 
 def load_config(config_json_or_path):
@@ -61,9 +72,71 @@ def load_config(config_json_or_path):
         return {}
 
 
+def is_well_formed_config(scope_config, scope_name):
+    if not isinstance(scope_config, dict):
+        print("WARNING/SKIPPING: Malformed config for scope %s" % scope_name)
+        return False
+    return True
+
+
+def metric_names_of_config(scope_config):
+    return [scope_config.get("xMetric", "CountLineCode"),
+            scope_config.get("yMetric", "AvgCyclomaticModified"),
+            scope_config.get("ballMetric", "MaxNesting")]
+
+
+def optional_float(value):
+    return None if value is None else float(value)
+
+
+class ScopeTable:
+    """The metrics of the entities of a scope, extracted in one pass for all the plots of that scope.
+    Values are None where an entity does not have the metric."""
+
+    def __init__(self, metric_names):
+        self.metric_names = list(metric_names)
+        self.entity_names = []
+        self.color_values = []
+        self.values_by_metric = {metric_name: [] for metric_name in self.metric_names}
+        self.first_missing_by_metric = {} # metric -> [row, kind name, entity name, container file] of the 1st entity without it
+
+    def append(self, entity, entity_name, container_file, metric_dict):
+        row = len(self.entity_names)
+        self.entity_names.append(entity_name)
+        self.color_values.append(0 if container_file is None else hash(os.path.dirname(container_file.longname())))
+        for metric_name, values in self.values_by_metric.items():
+            value = metric_dict[metric_name]
+            if value is None and metric_name not in self.first_missing_by_metric:
+                self.first_missing_by_metric[metric_name] = [row, entity.kindname(), entity_name, container_file]
+            values.append(value)
+
+    def first_missing(self, metric_names):
+        """[metric, kind name, entity name, container file] of the 1st entity missing one of metric_names, or None."""
+        missing = [[self.first_missing_by_metric[metric_name], metric_name] for metric_name in metric_names
+                   if metric_name in self.first_missing_by_metric]
+        if len(missing) == 0:
+            return None
+        [row, kind_name, entity_name, container_file], metric_name = min(missing, key=lambda row_and_metric: row_and_metric[0][0])
+        return [metric_name, kind_name, entity_name, container_file]
+
+
+def extract_scope_table(db, cmdline_arguments, entityQuery, entity_filter, scope_name, metric_names):
+    entities = db.ents(entityQuery)
+    skipLibraries = cmdline_arguments["--skipLibs"] == "true"
+    verbose = cmdline_arguments["--verbose"]
+    table = ScopeTable(metric_names)
+    for entity, container_file, metric_dict in profiler.counted("%s %s extraction" % (scope_name, "_".join(metric_names)),
+                                                                stream_of_entity_with_metrics(entities, metric_names,
+                                                                                     verbose, skipLibraries,
+                                                                                     entity_filter,
+                                                                                     scope_name.capitalize())):
+        entity_name = entity.relname() if scope_name == "File" else entity.longname()
+        table.append(entity, entity_name, container_file, metric_dict)
+    return table
+
+
 def scatter_plot (db, cmdline_arguments,
-                  entityQuery,
-                  regex_str_ignore_item,
+                  table,
                   scope_name,
                   x_metric_name,
                   y_metric_name,
@@ -73,48 +146,47 @@ def scatter_plot (db, cmdline_arguments,
                   ball_size_rate,
                   x_metric_min_value=0.0,
                   y_metric_min_value=0.0,
-                  ball_metric_min_value=0.0):
-    regex_str_traverse_files = cmdline_arguments.get("--regexTraverseFiles", "*")
-    regex_ignore_files = cmdline_arguments.get("--regexIgnoreFiles", None)
-    entities = db.ents(entityQuery)
-    skipLibraries = cmdline_arguments["--skipLibs"] == "true"
-    verbose = cmdline_arguments["--verbose"]
+                  ball_metric_min_value=0.0,
+                  x_metric_always_show_value=None,
+                  y_metric_always_show_value=None,
+                  ball_metric_always_show_value=None):
+    first_missing = table.first_missing([x_metric_name, y_metric_name])
+    if first_missing is not None:
+        metric_name, kind_name, entity_name, container_file = first_missing
+        print("ERROR. Missing metric %s for %s Axis (entity=%s (%s), file=%s)" % (metric_name, "X" if metric_name == x_metric_name else "Y",
+                                                                                  kind_name, entity_name, container_file))
+        return False
 
     annotations = []
     x_values = []
     y_values = []
     ball_values = []
     color_values = []
-    metric_names = [x_metric_name, y_metric_name, ball_metric_name]
-    for entity, container_file, metric_dict in stream_of_entity_with_metrics(entities, metric_names,
-                                                                                     verbose, skipLibraries,
-                                                                                     regex_str_ignore_item,
-                                                                                     regex_str_traverse_files,
-                                                                                     regex_ignore_files):
-        entity_name = entity.relname() if scope_name == "File" else entity.longname()
-        x_metric_value = metric_dict[x_metric_name]
-        if x_metric_value is None:
-            print("ERROR. Missing metric %s for X Axis (entity=%s (%s), file=%s)" % (x_metric_name, entity.kindname(), entity_name, container_file))
-            return False
-        y_metric_value = metric_dict[y_metric_name]
-        if y_metric_value is None:
-            print("ERROR. Missing metric %s for Y Axis (entity=%s (%s), file=%s)" % (y_metric_name, entity.kindname(), entity_name, container_file))
-            return False
-        ball_metric_value = metric_dict[ball_metric_name]
+    always_show = []
+    for entity_name, x_metric_value, y_metric_value, ball_metric_value, color_value in zip(table.entity_names,
+                                                                                          table.values_by_metric[x_metric_name],
+                                                                                          table.values_by_metric[y_metric_name],
+                                                                                          table.values_by_metric[ball_metric_name],
+                                                                                          table.color_values):
         if ball_metric_value is None:
             ball_metric_value = 0
         if x_metric_value < float(x_metric_min_value) and y_metric_value < float(y_metric_min_value) and ball_metric_value < float(ball_metric_min_value):
             continue # fix for #59 - able to toss uninteresting elements out
+        always_show.append(any(value is not None and metric_value >= value for metric_value, value in
+                               [(x_metric_value, x_metric_always_show_value), (y_metric_value, y_metric_always_show_value),
+                                (ball_metric_value, ball_metric_always_show_value)]))
         entity_name += ": "  + str(ball_metric_value)
         annotations.append(entity_name)
         x_values.append(x_metric_value)
         y_values.append(y_metric_value)
         ball_values.append(min(ball_size_max,ball_size_rate * ball_metric_value + ball_size_min))
-        color_values.append(0 if container_file is None else hash(os.path.dirname(container_file.longname())))
+        color_values.append(color_value)
     output_dir = cmdline_arguments["--outputDir"]
     file_prefix = "%s%s%s" % (output_dir, os.sep, os.path.split(db.name())[-1])
     file_name = save_scatter(x_values, x_metric_name, y_values, y_metric_name, ball_values, ball_metric_name,
-                             color_values, "directory", annotations, file_prefix, scope_name)
+                             color_values, "directory", annotations, file_prefix, scope_name,
+                             max_points=int(cmdline_arguments["--maxPoints"]), always_show=always_show,
+                             html_writer=cmdline_arguments["--htmlWriter"])
     print("Saved %s" % file_name)
     return True
 
@@ -122,20 +194,19 @@ def scatter_plot (db, cmdline_arguments,
 def main():
     start_time = datetime.datetime.now()
     arguments = docopt(__doc__, version=VERSION)
-    insert_understand_in_path(arguments["--dllDir"])
     print ("\r\n====== srcscatterplot @ https://github.com/sglebs/srccheck ==========")
     print(arguments)
     try:
-        import understand
-    except:
-        print ("Can' find the Understand DLL. Use --dllDir=...")
-        print ("Please set PYTHONPATH to point an Understand's C:/Program Files/SciTools/bin/pc-win64 or equivalent")
-        sys.exit(-1)
-    try:
-        db = understand.open(arguments["--in"])
-    except understand.UnderstandError as exc:
-        print ("Error opening input file: %s" % exc)
-        sys.exit(-2)
+        entity_filter = entity_filter_from_arguments(arguments)
+    except ValueError as exc:
+        print ("Invalid regex: %s" % exc)
+        sys.exit(-3)
+    if arguments["--htmlWriter"] not in HTML_WRITERS:
+        print ("Invalid --htmlWriter: %s (use %s)" % (arguments["--htmlWriter"], " or ".join(HTML_WRITERS)))
+        sys.exit(-3)
+    profiler.start(arguments["--profileReport"], "srcscatterplot")
+    plot_cache.start(arguments["--plotCache"])
+    db = open_db_or_snapshot(arguments["--snapshot"] or arguments["--in"], arguments["--dllDir"], snapshot=arguments["--snapshot"] is not None)
 
     print("Processing %s" % db.name())
     end_time = datetime.datetime.now()
@@ -144,7 +215,6 @@ def main():
         print ("Malformed config value.")
         exit(1)
     query_by_scope_name = {"file": arguments["--fileQuery"], "class": arguments["--classQuery"], "routine": arguments["--routineQuery"]}
-    regex_by_scope_name = {"file": arguments["--regexIgnoreFiles"], "class": arguments["--regexIgnoreClasses"], "routine": arguments["--regexIgnoreRoutines"]}
     for scope_name, scope_configs in config.items():
         if scope_name.lower() not in query_by_scope_name:
             print("WARNING/SKIPPING:Unsupported scope %s" % scope_name)
@@ -152,34 +222,46 @@ def main():
         if not isinstance(scope_configs, list):
             print("WARNING/SKIPPING: Malformed configs for scope %s" % scope_name)
             continue
+        scope_configs = [scope_config for scope_config in scope_configs if is_well_formed_config(scope_config, scope_name)]
+        if len(scope_configs) == 0:
+            continue
+        metric_names = [] # of all the plots of the scope, extracted in one pass
         for scope_config in scope_configs:
-            if not isinstance(scope_config, dict):
-                print("WARNING/SKIPPING: Malformed config for scope %s" % scope_name)
-                continue
+            for metric_name in metric_names_of_config(scope_config):
+                if metric_name not in metric_names:
+                    metric_names.append(metric_name)
+        table = extract_scope_table(db, arguments, query_by_scope_name[scope_name.lower()], entity_filter, scope_name, metric_names)
+        for scope_config in scope_configs:
+            x_metric_name, y_metric_name, ball_metric_name = metric_names_of_config(scope_config)
             ok = scatter_plot(db,
                           arguments,
-                          query_by_scope_name[scope_name.lower()],
-                          regex_by_scope_name[scope_name.lower()],
+                          table,
                           scope_name,
-                          scope_config.get("xMetric", "CountLineCode"),
-                          scope_config.get("yMetric", "AvgCyclomaticModified"),
-                          scope_config.get("ballMetric", "MaxNesting"),
+                          x_metric_name,
+                          y_metric_name,
+                          ball_metric_name,
                           float(scope_config.get("ballSizeMin", 40)),
                           float(scope_config.get("ballSizeMax", 4000)),
                           float(scope_config.get("ballSizeRate", 10)),
                           x_metric_min_value=float(scope_config.get("xMetricMinValue", 0.0)),
                           y_metric_min_value=float(scope_config.get("yMetricMinValue", 0.0)),
-                          ball_metric_min_value=float(scope_config.get("ballMetricMinValue", 0.0))
+                          ball_metric_min_value=float(scope_config.get("ballMetricMinValue", 0.0)),
+                          x_metric_always_show_value=optional_float(scope_config.get("xMetricAlwaysShow", None)),
+                          y_metric_always_show_value=optional_float(scope_config.get("yMetricAlwaysShow", None)),
+                          ball_metric_always_show_value=optional_float(scope_config.get("ballMetricAlwaysShow", None))
                         )
             if not ok:
                 print("WARNING/SKIPPING: Could not create plot for scope %s with config %s" % (scope_name, scope_config))
                 continue
+    if plot_cache.enabled:
+        print(plot_cache.summary())
     print("\r\n--------------------------------------------------")
     print("Started : %s" % str(start_time))
     print("Finished: %s" % str(end_time))
     print("Total: %s" % str(end_time - start_time))
     print("--------------------------------------------------")
     db.close()
+    profiler.save()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,367 @@
+# Streaming statistics for the stats thresholds (AVG:, MEDIAN:, STDEV: ...) of srccheck and csvkaloi: values are
+# added one at a time, straight from the entity stream, so a population never has to be kept in a list.
+# Mean and variance are kept with Welford's algorithm. Values are also counted: metric values repeat a lot (a big DB
+# has millions of routines but a few hundred distinct CountLineCode values), so the counts give an exact MODE and
+# exact medians, and AVG/STDEV/VARIANCE computed exactly from them match the statistics module to the last digit.
+# Past max_distinct_values distinct values, the counts are folded into a log-scale sketch (relative error
+# SKETCH_ACCURACY) for MODE and medians, and Welford's mean and variance are used.
+# A population already in a column (CSV columns in csvkaloi, the values of a histogram) goes through column_stats
+# instead: one NumPy sort gives the medians and the counts of each value, for all the stats of the column at once.
+# Percentiles (P90:, P99.9: ... any Pnn:) interpolate linearly between the closest ranks, like numpy.percentile.
+# On a column they are selected with one np.partition for all the percentiles asked for, no sort needed.
+import bisect
+import math
+import re
+import statistics
+import sys
+from collections import Counter
+from fractions import Fraction
+
+import numpy as np
+
+MAX_DISTINCT_VALUES = 65536
+SKETCH_ACCURACY = 0.01
+_SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+_SKETCH_LOG_GAMMA = math.log(_SKETCH_GAMMA)
+
+
+def _sketch_bucket(value):
+    if value == 0:
+        return 0
+    index = int(math.ceil(math.log(abs(value)) / _SKETCH_LOG_GAMMA))
+    return index + 1 if value > 0 else -index - 1 # negative values, negative buckets
+
+
+def _sketch_value(bucket):
+    if bucket == 0:
+        return 0.0
+    index = bucket - 1 if bucket > 0 else -bucket - 1
+    value = 2 * (_SKETCH_GAMMA ** index) / (_SKETCH_GAMMA + 1)
+    return value if bucket > 0 else -value
+
+
+def _sqrt_of_fraction(fraction):
+    """Correctly rounded, like statistics.pstdev: round-to-odd integer square root with enough extra bits."""
+    n, m = fraction.numerator, fraction.denominator
+    q = (n.bit_length() - m.bit_length() - 2 * sys.float_info.mant_dig - 3) // 2
+    if q >= 0:
+        m = m << 2 * q
+    else:
+        n = n << -2 * q
+    root = math.isqrt(n // m)
+    root = root | (root * root * m != n)
+    return root * (1 << q) if q >= 0 else root / (1 << -q)
+
+
+class StreamingStats:
+    """Mean, median(s), mode, variance and standard deviation of a stream of numbers, in one pass."""
+    __slots__ = ["count", "max_distinct_values", "_mean", "_m2", "_counts", "_all_ints", "_sketch", "_sorted"]
+
+    def __init__(self, values=(), max_distinct_values=MAX_DISTINCT_VALUES):
+        self.count = 0
+        self.max_distinct_values = max_distinct_values
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._counts = Counter() # in order of 1st appearance, so MODE ties go to the 1st one, like statistics.mode
+        self._all_ints = True # ints in, ints out (when exact), like the statistics module
+        self._sketch = None # bucket -> count, once there are too many distinct values
+        self._sorted = None # [distinct values sorted, cumulative counts], for the order stats, until the next add
+        for value in values:
+            self.add(value)
+
+    @classmethod
+    def from_counts(cls, values, counts):
+        """values in order of 1st appearance (see mode), each with its count. Exact, whatever the number of values."""
+        stats = cls(max_distinct_values=None)
+        stats._counts = Counter(dict(zip(values, counts)))
+        stats.count = sum(counts)
+        stats._all_ints = all([isinstance(value, int) for value in values])
+        return stats
+
+    @property
+    def exact(self):
+        return self._sketch is None
+
+    def add(self, value):
+        self.count += 1
+        self._sorted = None
+        delta = value - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (value - self._mean)
+        if self._all_ints and not isinstance(value, int):
+            self._all_ints = False
+        if self._sketch is None:
+            self._counts[value] += 1
+            if self.max_distinct_values is not None and len(self._counts) > self.max_distinct_values:
+                self._fold_into_sketch()
+        else:
+            self._sketch[_sketch_bucket(value)] += 1
+
+    def _fold_into_sketch(self):
+        self._sketch = Counter()
+        for value, count in self._counts.items():
+            self._sketch[_sketch_bucket(value)] += count
+        self._counts = None
+
+    def _sorted_counts(self):
+        if self._sorted is None:
+            if self._sketch is None:
+                sorted_counts = sorted(self._counts.items())
+            else:
+                sorted_counts = sorted([(_sketch_value(bucket), count) for bucket, count in self._sketch.items()])
+            cumulative_counts = []
+            seen = 0
+            for value, count in sorted_counts:
+                seen += count
+                cumulative_counts.append(seen)
+            self._sorted = [[value for value, count in sorted_counts], cumulative_counts]
+        return self._sorted
+
+    def _value_at(self, position):
+        """The value at a 0-based position of the sorted population."""
+        values, cumulative_counts = self._sorted_counts()
+        return values[bisect.bisect_right(cumulative_counts, position)]
+
+    def _exact(self, fraction):
+        if self._all_ints and fraction.denominator == 1:
+            return int(fraction)
+        return float(fraction)
+
+    def _check_not_empty(self, message):
+        if self.count == 0:
+            raise statistics.StatisticsError(message)
+
+    def mean(self):
+        self._check_not_empty("mean requires at least one data point")
+        if self._sketch is not None:
+            return self._mean
+        total = sum([Fraction(value) * count for value, count in self._counts.items()])
+        return self._exact(total / self.count)
+
+    def median(self):
+        self._check_not_empty("no median for empty data")
+        if self.count % 2 == 1:
+            return self._value_at(self.count // 2)
+        return (self._value_at(self.count // 2 - 1) + self._value_at(self.count // 2)) / 2
+
+    def median_low(self):
+        self._check_not_empty("no median for empty data")
+        return self._value_at((self.count - 1) // 2)
+
+    def median_high(self):
+        self._check_not_empty("no median for empty data")
+        return self._value_at(self.count // 2)
+
+    def median_grouped(self, interval=1):
+        self._check_not_empty("no median for empty data")
+        values, cumulative_counts = self._sorted_counts()
+        i = bisect.bisect_right(cumulative_counts, self.count // 2)
+        below = cumulative_counts[i - 1] if i > 0 else 0 # values below the median class
+        return (values[i] - interval / 2) + interval * (self.count / 2 - below) / (cumulative_counts[i] - below)
+
+    def percentile(self, percent):
+        self._check_not_empty("no percentile for empty data")
+        return _interpolated_percentile(self._value_at, self.count, percent)
+
+    def mode(self):
+        self._check_not_empty("no mode for empty data")
+        if self._sketch is not None:
+            return _sketch_value(self._sketch.most_common(1)[0][0])
+        return self._counts.most_common(1)[0][0]
+
+    def _exact_pvariance(self):
+        total = 0
+        total_of_squares = 0
+        for value, count in self._counts.items():
+            value = Fraction(value)
+            total += value * count
+            total_of_squares += value * value * count
+        return (total_of_squares - total * total / self.count) / self.count
+
+    def pvariance(self):
+        self._check_not_empty("pvariance requires at least one data point")
+        if self._sketch is not None:
+            return self._m2 / self.count
+        return self._exact(self._exact_pvariance())
+
+    def pstdev(self):
+        self._check_not_empty("pstdev requires at least one data point")
+        if self._sketch is not None:
+            return math.sqrt(self._m2 / self.count)
+        return float(_sqrt_of_fraction(self._exact_pvariance()))
+
+
+class _SortedColumnStats:
+    """Stats of a column with too many distinct values to count them in Python: all NumPy, on the sorted column.
+    Exact, except for AVG, STDEV and VARIANCE of floats, in float64 (may differ in the last digits)."""
+
+    def __init__(self, sorted_values, distinct_values, counts, first_positions):
+        self.count = len(sorted_values)
+        self._sorted_values = sorted_values
+        self._distinct_values = distinct_values
+        self._counts = counts
+        self._first_positions = first_positions
+        self._all_ints = sorted_values.dtype.kind in "iub"
+
+    def _exact(self, fraction):
+        return int(fraction) if fraction.denominator == 1 else float(fraction)
+
+    def _exact_pvariance(self):
+        values = self._sorted_values.astype(object) # Python ints, no overflow
+        total = int(values.sum())
+        return Fraction(int((values * values).sum()) * self.count - total * total, self.count * self.count)
+
+    def mean(self):
+        if self._all_ints:
+            return self._exact(Fraction(int(self._sorted_values.astype(object).sum()), self.count))
+        return self._sorted_values.mean().item()
+
+    def median(self):
+        if self.count % 2 == 1:
+            return self._sorted_values[self.count // 2].item()
+        return (self._sorted_values[self.count // 2 - 1].item() + self._sorted_values[self.count // 2].item()) / 2
+
+    def median_low(self):
+        return self._sorted_values[(self.count - 1) // 2].item()
+
+    def median_high(self):
+        return self._sorted_values[self.count // 2].item()
+
+    def percentile(self, percent):
+        return _interpolated_percentile(lambda position: self._sorted_values[position].item(), self.count, percent)
+
+    def median_grouped(self, interval=1):
+        value = self._sorted_values[self.count // 2].item()
+        below = int(np.searchsorted(self._sorted_values, value, side="left"))
+        count = int(np.searchsorted(self._sorted_values, value, side="right")) - below
+        return (value - interval / 2) + interval * (self.count / 2 - below) / count
+
+    def mode(self):
+        most_common = np.flatnonzero(self._counts == self._counts.max())
+        return self._distinct_values[most_common[np.argmin(self._first_positions[most_common])]].item() # 1st one, on ties
+
+    def pvariance(self):
+        if self._all_ints:
+            return self._exact(self._exact_pvariance())
+        return self._sorted_values.var(dtype=np.float64).item()
+
+    def pstdev(self):
+        if self._all_ints:
+            return float(_sqrt_of_fraction(self._exact_pvariance()))
+        return self._sorted_values.std(dtype=np.float64).item()
+
+
+def _interpolated_percentile(value_at, count, percent):
+    """Linear interpolation between the closest ranks, like numpy.percentile. The value itself when on a rank."""
+    position = (count - 1) * percent / 100.0
+    low = int(math.floor(position))
+    low_value = value_at(low)
+    if position == low:
+        return low_value
+    return low_value + (value_at(low + 1) - low_value) * (position - low)
+
+
+STATS_LAMBDAS = {"AVG": lambda stats: stats.mean(),
+                 "MEDIAN": lambda stats: stats.median(),
+                 "MEDIANHIGH": lambda stats: stats.median_high(),
+                 "MEDIANLOW": lambda stats: stats.median_low(),
+                 "MEDIANGROUPED": lambda stats: stats.median_grouped(),
+                 "MODE": lambda stats: stats.mode(),
+                 "STDEV": lambda stats: stats.pstdev(),
+                 "VARIANCE": lambda stats: stats.pvariance()}
+
+
+def metric_name_for_sorting(metric_name):
+    if ":" not in metric_name:
+        return metric_name
+    else:
+        parts = metric_name.split(":")
+        return parts[-1] + parts[0]
+
+
+_PERCENTILE_PATTERN = re.compile(r"^P(\d+(?:\.\d+)?)$")
+_percentile_lambdas = {}
+
+
+def percent_of_stat(stat_name):
+    """90.0 for P90, 99.9 for P99.9... None if not a percentile."""
+    match = _PERCENTILE_PATTERN.match(stat_name.upper().strip())
+    if match is None or float(match.group(1)) > 100:
+        return None
+    return float(match.group(1))
+
+
+def stats_lambda(stat_name):
+    """The function to compute a stat (AVG, MEDIAN, P90...) from StreamingStats or the like, or None."""
+    lambda_stats = STATS_LAMBDAS.get(stat_name.upper().strip(), None)
+    if lambda_stats is None:
+        percent = percent_of_stat(stat_name)
+        if percent is not None:
+            lambda_stats = _percentile_lambdas.get(percent, None)
+            if lambda_stats is None:
+                lambda_stats = lambda stats: stats.percentile(percent)
+                _percentile_lambdas[percent] = lambda_stats
+    return lambda_stats
+
+
+def split_stats_metric(metric):
+    if metric.count(':') == 1: #fix for #42 - can have only 1 :
+        lambda_name, adjusted_metric = metric.split(":")
+        lambda_stats = stats_lambda(lambda_name)
+        if lambda_stats is not None:
+            return [lambda_name, adjusted_metric, lambda_stats]
+    return [None, metric, None]
+
+
+def stats_of_column(column):
+    """StreamingStats-like stats of a whole column (list, array, NumberColumn...), with one NumPy sort."""
+    values = np.asarray(column)
+    if len(values) == 0:
+        return StreamingStats()
+    order = np.argsort(values, kind="stable") # stable: the 1st position of each value is the 1st of its run
+    sorted_values = values[order]
+    run_starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+    counts = np.diff(np.r_[run_starts, len(sorted_values)])
+    distinct_values = sorted_values[run_starts]
+    first_positions = order[run_starts]
+    if len(distinct_values) > MAX_DISTINCT_VALUES:
+        return _SortedColumnStats(sorted_values, distinct_values, counts, first_positions)
+    in_order_of_appearance = np.argsort(first_positions)
+    return StreamingStats.from_counts(distinct_values[in_order_of_appearance].tolist(), counts[in_order_of_appearance].tolist())
+
+
+def column_percentiles(column, percents):
+    """The percentiles of a column, with a single selection (np.partition) for all of them: percent -> value."""
+    values = np.asarray(column)
+    if len(values) == 0:
+        raise statistics.StatisticsError("no percentile for empty data")
+    positions = set()
+    for percent in percents:
+        position = (len(values) - 1) * percent / 100.0
+        positions.update([int(math.floor(position)), int(math.ceil(position))])
+    partitioned = np.partition(values, sorted(positions))
+    return {percent: _interpolated_percentile(lambda position: partitioned[position].item(), len(values), percent) for percent in percents}
+
+
+def column_stats(column, stat_names):
+    """All the stats (AVG, MEDIAN, P90...) asked for of a column, at once: stat name -> value, or the StatisticsError."""
+    values_by_stat_name = {}
+    percents_by_stat_name = {stat_name: percent_of_stat(stat_name) for stat_name in stat_names}
+    percents = [percent for percent in percents_by_stat_name.values() if percent is not None]
+    if len(percents) > 0:
+        try:
+            values_by_percent = column_percentiles(column, percents)
+        except statistics.StatisticsError as se:
+            values_by_percent = {percent: se for percent in percents}
+        for stat_name, percent in percents_by_stat_name.items():
+            if percent is not None:
+                values_by_stat_name[stat_name] = values_by_percent[percent]
+    other_stat_names = [stat_name for stat_name, percent in percents_by_stat_name.items() if percent is None]
+    if len(other_stat_names) > 0:
+        stats = stats_of_column(column)
+        for stat_name in other_stat_names:
+            try:
+                values_by_stat_name[stat_name] = STATS_LAMBDAS[stat_name.upper().strip()](stats)
+            except statistics.StatisticsError as se:
+                values_by_stat_name[stat_name] = se
+    return values_by_stat_name
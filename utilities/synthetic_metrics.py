@@ -0,0 +1,72 @@
+# Synthetic metrics: metrics Understand does not have natively, computed from other metrics of the entity
+# (or, when there is no other way, from the API). Each one declares the metrics it is computed from, which are
+# fetched with the same entity.metric() call as the metrics asked for, so there is no extra round-trip per entity.
+# A synthetic metric is only computed when asked for, and only if the entity did not provide it already (a snapshot may have it).
+
+
+class SyntheticMetric:
+    def __init__(self, name, base_metrics, compute):
+        self.name = name
+        self.base_metrics = list(base_metrics)
+        self.compute = compute # compute(entity, metric_dict) -> value, metric_dict having the base metrics
+
+
+SYNTHETIC_METRICS = {}
+_plans_by_metrics = {} # tuple of metric names -> [metrics to fetch, synthetic metrics to compute in dependency order]
+
+
+def register_synthetic_metric(name, base_metrics, compute):
+    SYNTHETIC_METRICS[name] = SyntheticMetric(name, base_metrics, compute)
+    _plans_by_metrics.clear()
+
+
+def _add_to_plan(metric, metrics_to_fetch, synthetic_metrics, visiting):
+    if metric not in metrics_to_fetch:
+        metrics_to_fetch.append(metric) # even a synthetic one: the entity may have it already
+    synthetic_metric = SYNTHETIC_METRICS.get(metric, None)
+    if synthetic_metric is None or synthetic_metric in synthetic_metrics:
+        return
+    if metric in visiting:
+        raise ValueError("Synthetic metric %s depends on itself" % metric)
+    visiting.add(metric)
+    for base_metric in synthetic_metric.base_metrics:
+        _add_to_plan(base_metric, metrics_to_fetch, synthetic_metrics, visiting)
+    visiting.discard(metric)
+    synthetic_metrics.append(synthetic_metric)
+
+
+def plan_for_metrics(metrics):
+    metrics = tuple(metrics)
+    plan = _plans_by_metrics.get(metrics, None)
+    if plan is None:
+        metrics_to_fetch = []
+        synthetic_metrics = []
+        for metric in metrics:
+            _add_to_plan(metric, metrics_to_fetch, synthetic_metrics, set())
+        plan = [metrics_to_fetch, synthetic_metrics]
+        _plans_by_metrics[metrics] = plan
+    return plan
+
+
+def metrics_with_synthetic_metrics(entity, metrics):
+    metrics_to_fetch, synthetic_metrics = plan_for_metrics(metrics)
+    metric_dict = entity.metric(metrics_to_fetch)
+    for synthetic_metric in synthetic_metrics:
+        if metric_dict.get(synthetic_metric.name, None) is None:
+            metric_dict[synthetic_metric.name] = synthetic_metric.compute(entity, metric_dict)
+    if len(metrics_to_fetch) == len(metrics):
+        return metric_dict
+    return {metric: metric_dict[metric] for metric in metrics} # only what was asked for
+
+
+def _count_params(entity, metric_dict):
+    return len(entity.ents("Define", "Parameter ~Catch"))
+
+
+def _count_decl_method_non_stub(entity, metric_dict):
+    # note we can't always multiply by 2 (not always a getter and setter) but this is the best we can do
+    return max(0, (metric_dict.get("CountDeclMethod", 0) or 0) - (2 * int(metric_dict.get("CountDeclPropertyAuto", 0) or 0)))
+
+
+register_synthetic_metric("CountParams", [], _count_params)
+register_synthetic_metric("CountDeclMethodNonStub", ["CountDeclMethod", "CountDeclPropertyAuto"], _count_decl_method_non_stub) # see #39
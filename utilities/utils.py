@@ -1,18 +1,22 @@
+import concurrent.futures
+import contextlib
+import math
 import os.path
 import re
 import statistics
 import json
-import requests
-import urllib.request
-from matplotlib import use as backend_use
-backend_use('Agg') # fixes #32 - change backend to simple one, BEFORE any other import.
-from matplotlib import pyplot as plt
-plt.ioff()  # fixes #32 - no need for an interactive backend
-import mpld3
-from utilities.complex_radar import ComplexRadar
+# matplotlib, mpld3, numpy, requests & co are imported by the functions that need them, on first use: every tool
+# (say, xmlkaloi, which never plots) would otherwise pay for all of them at start-up, even for --help.
+from utilities.plotcache import plot_cache
+from utilities.profiling import profiler
+from utilities.records import EntityRecord, MetricValues, metric_index
+from utilities.synthetic_metrics import metrics_with_synthetic_metrics
 import sys
+import zlib
 
 def insert_understand_in_path(dllDir):
+    if dllDir in sys.path:
+        return # already done, say for a 2nd db
     sys.path.insert(0, dllDir)  # add the dir with the DLLs - Qt etc
     os.environ["PATH"] = dllDir + os.pathsep + os.environ["PATH"]  # prepend
     sys.path.insert(0, os.path.join(dllDir, "Python"))  # also needed, For interop
@@ -21,287 +25,562 @@ def insert_understand_in_path(dllDir):
     # hangs!!!!! os.environ["PYTHONPATH"] = os.path.join(dllDir,"python") + os.pathsep + os.environ.get("PYTHONPATH", "") # prepend
 
 
-class ClickSendToBack(mpld3.plugins.PluginBase):
-    """Plugin for sending element to the back. Combined https://mpld3.github.io/notebooks/custom_plugins.html and http://bl.ocks.org/eesur/4e0a69d57d3bfc8a82c2"""
-
-    JAVASCRIPT = """
-    d3.selection.prototype.moveToBack = function() {
-        return this.each(function() {
-            var firstChild = this.parentNode.firstChild;
-            if (firstChild) {
-                this.parentNode.insertBefore(this, firstChild);
-            }
-        });
-    };
-    mpld3.register_plugin("clicksendtoback", ClickSendToBackPlugin);
-    ClickSendToBackPlugin.prototype = Object.create(mpld3.Plugin.prototype);
-    ClickSendToBackPlugin.prototype.constructor = ClickSendToBackPlugin;
-    ClickSendToBackPlugin.prototype.requiredProps = ["id"];
-    function ClickSendToBackPlugin(fig, props){
-        mpld3.Plugin.call(this, fig, props);
-    };
-
-    ClickSendToBackPlugin.prototype.draw = function(){
-        var obj = mpld3.get_element(this.props.id);
-        obj.elements().on("mousedown",
-                          function(d, i){d3.select(this).moveToBack();});
-    }
-    """
-
-    def __init__(self, points):
-        self.dict_ = {"type": "clicksendtoback",
-                      "id": mpld3.utils.get_id(points)}
-
-
-def stream_of_entity_with_metrics (entities, metrics, verbose, skipLibraries,regex_str_ignore_item, regex_str_traverse_files, regex_ignore_files ):
+def open_db_or_snapshot(file_path, dllDir, snapshot=None):
+    """Opens a UDB through the Understand API, or a snapshot saved by srcextract (by default, detected by the .npz extension)."""
+    with profiler.phase("open %s" % os.path.basename(file_path)):
+        from utilities.snapshot import load_snapshot, is_snapshot_path, SnapshotError
+        if snapshot is None:
+            snapshot = is_snapshot_path(file_path)
+        if snapshot:
+            try:
+                return load_snapshot(file_path)
+            except SnapshotError as exc:
+                print ("Error opening snapshot file: %s" % exc)
+                sys.exit(-2)
+        insert_understand_in_path(dllDir)
+        try:
+            import understand
+        except:
+            print ("Can' find the Understand DLL. Use --dllDir=...")
+            print ("Please set PYTHONPATH to point an Understand's C:/Program Files/SciTools/bin/pc-win64 or equivalent")
+            sys.exit(-1)
+        try:
+            return understand.open(file_path)
+        except understand.UnderstandError as exc:
+            print ("Error opening input file: %s" % exc)
+            sys.exit(-2)
+
+
+REGEX_IGNORE_OPTION_BY_SCOPE = {"File": "--regexIgnoreFiles",
+                                "Class": "--regexIgnoreClasses",
+                                "Routine": "--regexIgnoreRoutines"}
+
+
+def _compile_regex(regex_filter, option_name):
+    if regex_filter is None or len(regex_filter) == 0:  # fixes #33 - empty string is the same as no parameter
+        return None
+    try:
+        return re.compile(regex_filter)
+    except re.error as exc:
+        raise ValueError("%s=%s is not a valid regex: %s" % (option_name, regex_filter, exc))
+
+
+class ResolvedEntity:
+    """What the filters need to know about an entity, fetched from Understand at most once per run."""
+    __slots__ = ("longname", "library_name", "kind_name", "container_file", "container_resolved")
+
+    def __init__(self, longname, library_name, kind_name):
+        self.longname = longname
+        self.library_name = library_name
+        self.kind_name = kind_name
+        self.container_file = None
+        self.container_resolved = False # the definein/declarein ref lookup is slow, only done for entities that get that far
+
+    def is_unknown(self):
+        return str.find(self.kind_name, "Unknown") >= 0 or str.find(self.kind_name, "Unresolved") >= 0
+
+
+class EntityFilter:
+    """The --regexTraverseFiles/--regexIgnoreFiles/--regexIgnore* patterns, compiled and validated once per run.
+    The traverse/ignore verdict of each container file is memoized, so all entities of a file share one decision.
+    It also caches, by entity id, each entity's longname, kind and container file, shared by all scopes and metric passes.
+    Entity ids are only unique inside one database, so use one EntityFilter per open database."""
+
+    def __init__(self, regex_traverse_files, regex_ignore_files, regex_ignore_item_by_scope):
+        self.regex_traverse_files = _compile_regex(regex_traverse_files, "--regexTraverseFiles")
+        self.regex_ignore_files = _compile_regex(regex_ignore_files, "--regexIgnoreFiles")
+        self.regex_ignore_item_by_scope = {scope_name: _compile_regex(regex, REGEX_IGNORE_OPTION_BY_SCOPE.get(scope_name, scope_name))
+                                           for scope_name, regex in regex_ignore_item_by_scope.items()}
+        self.skip_reason_by_file_id = {}
+        self.resolved_by_entity_id = {}
+
+    def resolve(self, entity):
+        entity_id = entity.id()
+        resolved = self.resolved_by_entity_id.get(entity_id, None)
+        if resolved is None:
+            resolved = ResolvedEntity(entity.longname(), entity.library(), entity.kindname())
+            self.resolved_by_entity_id[entity_id] = resolved
+        return resolved
+
+    def container_file_of(self, entity, resolved):
+        if not resolved.container_resolved:
+            if str.find(resolved.kind_name, "File") >= 0:
+                resolved.container_file = entity
+            else:
+                container_ref = entity.ref("definein, declarein")
+                resolved.container_file = container_ref.file() if container_ref is not None else None
+            resolved.container_resolved = True
+        return resolved.container_file
+
+    def ignores_item(self, longname, scope_name):
+        regex = self.regex_ignore_item_by_scope.get(scope_name, None)
+        return regex is not None and regex.search(longname) is not None
+
+    def file_skip_reason(self, container_file):
+        """None if the file should be traversed, otherwise the reason to skip all its entities."""
+        file_id = container_file.id()
+        if file_id in self.skip_reason_by_file_id:
+            return self.skip_reason_by_file_id[file_id]
+        longname = self.resolve(container_file).longname
+        reason = None
+        if self.regex_traverse_files is not None and self.regex_traverse_files.search(longname) is None:
+            reason = "SKIP due to file traverse regex non-match: %s" % longname
+        elif self.regex_ignore_files is not None and self.regex_ignore_files.search(longname) is not None:
+            reason = "SKIP due to file ignore regex match: %s" % longname
+        self.skip_reason_by_file_id[file_id] = reason
+        return reason
+
+
+def entity_filter_from_arguments(cmdline_arguments):
+    regex_ignore_item_by_scope = {scope_name: cmdline_arguments.get(option_name, None)
+                                  for scope_name, option_name in REGEX_IGNORE_OPTION_BY_SCOPE.items()}
+    return EntityFilter(cmdline_arguments.get("--regexTraverseFiles", None),
+                        cmdline_arguments.get("--regexIgnoreFiles", None),
+                        regex_ignore_item_by_scope)
+
+
+def shard_of_entity (entity, resolved, entity_filter, shard_count):
+    # stable across processes and runs (unlike hash()), so every worker agrees on who owns what.
+    # By container file, so all entities of a file land in the same shard
+    container_file = entity_filter.container_file_of(entity, resolved)
+    key = resolved.longname if container_file is None else entity_filter.resolve(container_file).longname
+    return zlib.crc32(key.encode("utf-8")) % shard_count
+
+
+def stream_of_entity_with_metrics (entities, metrics, verbose, skipLibraries, entity_filter, scope_name, shard = None, metric_cache = None):
+    # shard is [shard_index, shard_count]: only entities of that shard are streamed (see sharding.py)
+    # metric_cache is a MetricCache, to reuse the metrics of entities of unchanged files (see metriccache.py)
+    # Yields EntityRecords, which unpack as [entity, container_file, metric_dict] (see records.py)
+    index = metric_index(metrics)
     for entity in entities:
-        library_name = entity.library()
-        if library_name is not "" and skipLibraries:
+        resolved = entity_filter.resolve(entity)
+        if resolved.library_name != "" and skipLibraries:
             #            if verbose:
-            #                print ("LIBRARY/SKIP: %s" % entity.longname())
+            #                print ("LIBRARY/SKIP: %s" % resolved.longname)
             continue
-        if matches_regex(entity, regex_str_ignore_item, verbose):
-            if verbose:
-                print("ENTITY REGEX/SKIP: %s" % entity.longname())
+        if entity_filter.ignores_item(resolved.longname, scope_name):
+            if verbose and (shard is None or shard[0] == 0): # said once, by the first shard
+                print("ENTITY REGEX/SKIP: %s" % resolved.longname)
             continue
-        ent_kind = entity.kindname()
-        if str.find(ent_kind, "Unknown") >= 0 or str.find(ent_kind, "Unresolved") >= 0:
+        if resolved.is_unknown():
             continue
-        container_file = None
-        if str.find(ent_kind, "File") >= 0:
-            container_file = entity
-        else:
-            container_ref = entity.ref("definein, declarein")
-            container_file = container_ref.file() if container_ref is not None else None
+        # after the cheap name/kind filters: the container file the shard is hashed from takes a (slow) ref lookup,
+        # which every shard still does for every entity that gets here
+        if shard is not None and shard_of_entity(entity, resolved, entity_filter, shard[1]) != shard[0]:
+            continue # another worker takes care of it (and of its verbose messages)
+        container_file = entity_filter.container_file_of(entity, resolved)
         if container_file is None:
             if verbose:
-                print("WARNING: no container file: %s. NOT SKIPPING to be safe" % entity.longname())
+                print("WARNING: no container file: %s. NOT SKIPPING to be safe" % resolved.longname)
         else:
-            if not matches_regex(container_file, regex_str_traverse_files, verbose):
+            skip_reason = entity_filter.file_skip_reason(container_file)
+            if skip_reason is not None:
                 if verbose:
-                    print("SKIP due to file traverse regex non-match: %s" % container_file.longname())
-                continue
-            if matches_regex(container_file, regex_ignore_files, verbose):
-                if verbose:
-                    print("SKIP due to file ignore regex match: %s" % container_file.longname())
+                    print(skip_reason)
                 continue
         # real work
-        metric_dict = entity.metric(metrics)
-        if "CountParams" in metric_dict:
-            metric_dict ["CountParams"] = len(entity.ents("Define", "Parameter ~Catch"))
-        if "CountDeclMethodNonStub" in metric_dict:
-            extra_metrics = entity.metric(["CountDeclMethod" , "CountDeclPropertyAuto"])
-            metric_dict["CountDeclMethodNonStub"] = max(0,extra_metrics.get("CountDeclMethod",0) -
-                                                        (2 * int(extra_metrics.get("CountDeclPropertyAuto",0) or 0))) # note we can't always multiply by 2 (not always a getter and setter) but this is the best we can do
-        yield [entity, container_file, metric_dict]
+        if metric_cache is None:
+            yield EntityRecord(entity, container_file, MetricValues.from_dict(index, entity_metrics(entity, metrics)))
+            continue
+        container_path = None if container_file is None else entity_filter.resolve(container_file).longname
+        cache_key, metric_dict = metric_cache.lookup(container_path, scope_name, resolved.longname, resolved.kind_name, metrics)
+        if metric_dict is None:
+            metric_dict = entity_metrics(entity, metrics)
+            metric_cache.store(cache_key, metric_dict)
+        yield EntityRecord(entity, container_file, MetricValues.from_dict(index, metric_dict))
+
+
+def _snapshot_error():
+    from utilities.snapshot import SnapshotError # only when an exception is being handled: numpy is not imported for UDBs
+    return SnapshotError
 
 
+def entity_metrics (entity, metrics):
+    try:
+        return metrics_with_synthetic_metrics(entity, metrics) # CountParams & co are computed there, see synthetic_metrics.py
+    except _snapshot_error() as exc: # a metric the snapshot lacks, or that needs the Understand API
+        print ("Error reading snapshot: %s" % exc)
+        sys.exit(-2)
+
 
-def stream_of_entity_with_metric (entities, metric, verbose, skipLibraries,regex_str_ignore_item, regex_str_traverse_files, regex_ignore_files, skip_zeroes = False ):
+def stream_of_entity_with_metric (entities, metric, verbose, skipLibraries, entity_filter, scope_name, skip_zeroes = False ):
     for entity, container_file, metric_dict in stream_of_entity_with_metrics(entities,
                                                                                       (metric,),
                                                                                      verbose, skipLibraries,
-                                                                                     regex_str_ignore_item,
-                                                                                     regex_str_traverse_files,
-                                                                                     regex_ignore_files):
-        metric_value = metric_dict.get(metric, 0)  # the call returns a dict
+                                                                                     entity_filter,
+                                                                                     scope_name):
+        metric_value = filtered_metric_value(entity, metric, metric_dict, verbose, skip_zeroes=skip_zeroes)
         if metric_value is None:
             continue
-        if metric_value == 0:
-            if skip_zeroes:
-                continue
-            if verbose:
-                print("WARNING: %s=0 for %s" % (metric, entity))
-        if metric_value < 0:
-            if verbose:
-                print("WARNING: %s<0 for %s" % (metric, entity))
         yield [entity, container_file, metric, metric_value]
 
 
+def filtered_metric_value (entity, metric, metric_dict, verbose, skip_zeroes = False):
+    metric_value = metric_dict.get(metric, 0)  # the call returns a dict
+    if metric_value is None:
+        return None
+    if metric_value == 0:
+        if skip_zeroes:
+            return None
+        if verbose:
+            print("WARNING: %s=0 for %s" % (metric, entity))
+    if metric_value < 0:
+        if verbose:
+            print("WARNING: %s<0 for %s" % (metric, entity))
+    return metric_value
+
+
+FIGURE_CANVAS_CLASS = None # the canvas of every figure, pluggable (say, FigureCanvasSVG or FigureCanvasCairo). None: Agg
+
 
-def matches_regex (entity, regex_filter, verbose=False):
-    if regex_filter is None:
-        return False
-    if len(regex_filter) == 0:  # fixes #33 - empty string is the same as no parameter
-        return False
+@contextlib.contextmanager
+def rendering_figure(canvas_class=None, **figure_kwargs):
+    """A new Figure on its own canvas (FIGURE_CANVAS_CLASS by default), for one plot. Not known to pyplot (no global
+    "current figure", so plots can be rendered by several threads at once, and no pyplot reference keeping it alive),
+    cleared on the way out so even a figure still referenced (say, by mpld3) does not keep its artists: memory stays
+    flat however many plots."""
+    from matplotlib.figure import Figure
+    if canvas_class is None and FIGURE_CANVAS_CLASS is None:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg as canvas_class
+    fig = Figure(**figure_kwargs)
+    (canvas_class or FIGURE_CANVAS_CLASS)(fig)
     try:
-        longname = entity.longname()
-        regex_result = re.search(regex_filter, longname)
-        return regex_result is not None
-    except:
-        if verbose:
-            print ("REGEX/EXCEPTION: %s" % regex_filter)
-        return False
+        yield fig
+    finally:
+        fig.clear()
+
+
+def _plot_cache_key(kind, *inputs): # the canvas draws the plot too
+    return plot_cache.key(kind, None if FIGURE_CANVAS_CLASS is None else FIGURE_CANVAS_CLASS.__name__, *inputs)
 
 
 def save_histogram(show_mean_median, use_logarithmic_scale, filename_prefix, max_value, metric, metric_values_as_list, scope_name, mean = None, median = None, pstdev = None):
-    plt.figure()  # new one, or they will be mixed
-    n, bins, patches = plt.hist(metric_values_as_list, "doane", facecolor='green', alpha=0.75)
-    plt.xlabel("%s   (max=%3.2f)" % (metric, max_value))
-    plt.ylabel('Value')
-    plt.title("%s %s (%i values in %i bins)" % (scope_name, metric, len(metric_values_as_list), len(bins)))
-    plt.grid(True)
-    if show_mean_median:
-        try:
-            mean = statistics.mean(metric_values_as_list) if mean is None else mean
-            plt.axvline(mean, color='b', linestyle='dashed', linewidth=3, alpha=0.8, dash_capstyle="round")
-            median = statistics.median(metric_values_as_list) if median is None else median
-            plt.axvline(median, color='y', linestyle='dashed', linewidth=3, alpha=0.8, dash_capstyle="butt")
-            pstdev = statistics.pstdev(metric_values_as_list, mean) if pstdev is None else pstdev
-            plt.xlabel(
-                "%s   (avg=%3.2f, median=%3.2f, stdev=%3.2f, max=%3.2f)" % (metric, mean, median, pstdev, max_value))
-        except statistics.StatisticsError as se:
-            pass
-    if use_logarithmic_scale:
-        plt.yscale('symlog', basey=10, linthreshy=10, subsy=[2, 3, 4, 5, 6, 7, 8,
-                                                             9])  # http://stackoverflow.com/questions/17952279/logarithmic-y-axis-bins-in-python
-    filename = "%s-%s-%s.png" % (filename_prefix, scope_name, metric)
-    plt.savefig(filename, dpi=72)
-    return [filename, mean, median, pstdev]
-
-
-def _save_figure_as_html(fig, filename):
-    with open(filename, "w") as output_file:
-        output_file.write("<html><head></head><body>")
-        mpld3.save_html(fig, output_file)
-        output_file.write("</body></html>")
-
-
-def save_scatter(x_values, x_label, y_values, y_label, ball_values, ball_label, color_values, color_label, annotations, filename_prefix, scope_name, show_diagonal=False, format="html"):
-    #plt.figure()  # new one, or they will be mixed
-    fig, ax = plt.subplots()
-    plt.xlabel(x_label)
-    plt.ylabel(y_label)
-    plt.title("%i %s items. Circles: %s & %s" % (len(x_values), scope_name, ball_label, color_label))
-    if show_diagonal:
-        max_max = max(max(x_values), max(y_values))
-        ax.plot([0.0, max_max], [0.0, max_max], ls="--", lw=2, alpha=0.5,
-                color='green')  # http://matplotlib.org/api/lines_api.html
-    scatter = ax.scatter(x_values, y_values, ball_values, alpha=0.5, c=color_values)
-    filename = "%s-scatter-%s-%s_%s_%s.%s" % (filename_prefix, scope_name, x_label, y_label, ball_label, format)
-    if format == "html":
-        tooltip = mpld3.plugins.PointHTMLTooltip(scatter, labels=annotations, hoffset=10, voffset=-25)
-        mpld3.plugins.connect(fig, tooltip)
-        mpld3.plugins.connect(fig, mpld3.plugins.MousePosition(fmt=".2f"))
-        mpld3.plugins.connect(fig, ClickSendToBack(scatter))
-        _save_figure_as_html(fig, filename)
-    else:
-        plt.savefig(filename, dpi=72)
-    return filename
-
-def save_abstractness_x_instability_scatter(x_values, x_label, y_values, y_label, ball_values, ball_label, color_values, color_label, annotations, filename_prefix, scope_name, show_diagonal=True):
-    #plt.figure()  # new one, or they will be mixed
-    fig, ax = plt.subplots()
-    ax.set_xticks([0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]) # http://stackoverflow.com/questions/8209568/how-do-i-draw-a-grid-onto-a-plot-in-python
-    ax.set_yticks([0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0])
-    plt.grid()
-    if show_diagonal:
-        plt.plot([0.0, 1.0], [1.0, 0.0], 'k-', ls="--", lw=2, alpha=0.5, color='green') # http://matplotlib.org/api/lines_api.html
-
-        plt.plot([0.0, 0.7], [0.7, 0.0], 'k-', ls="--", lw=1, alpha=0.7, color='orange')  # http://matplotlib.org/api/lines_api.html
-        plt.plot([0.3, 1.0], [1.0, 0.3], 'k-', ls="--", lw=1, alpha=0.7, color='orange')  # http://matplotlib.org/api/lines_api.html
-
-        plt.plot([0.0, 0.4], [0.4, 0.0], 'k-', ls="--", lw=1, alpha=0.9, color='red')  # http://matplotlib.org/api/lines_api.html
-        plt.plot([0.6, 1.0], [1.0, 0.6], 'k-', ls="--", lw=1, alpha=0.9, color='red')  # http://matplotlib.org/api/lines_api.html
-
-    scatter = ax.scatter(x_values, y_values, ball_values, alpha=0.5, c=color_values)
-    plt.xlabel(x_label)
-    plt.ylabel(y_label)
-    plt.title("%i %s items. Circles: %s & %s" % (len(x_values), scope_name, ball_label, color_label))
-    tooltip = mpld3.plugins.PointHTMLTooltip(scatter, labels=annotations, hoffset=10, voffset=-25)
-    mpld3.plugins.connect(fig, tooltip)
-    mpld3.plugins.connect(fig, mpld3.plugins.MousePosition(fmt=".2f"))
-    mpld3.plugins.connect(fig, ClickSendToBack(scatter))
-    filename = "%s-scatter-%s-%s_%s_%s.html" % (filename_prefix, scope_name, x_label, y_label, ball_label)
-    _save_figure_as_html(fig, filename)
-    return filename
+    with profiler.phase("histogram %s %s" % (scope_name, metric)):
+        show_stats = False
+        if show_mean_median:
+            if None in [mean, median, pstdev]:
+                from utilities.stats import column_stats
+                stats_values = column_stats(metric_values_as_list, ["AVG", "MEDIAN", "STDEV"])
+                mean = stats_values["AVG"] if mean is None else mean
+                median = stats_values["MEDIAN"] if median is None else median
+                pstdev = stats_values["STDEV"] if pstdev is None else pstdev
+            if not isinstance(mean, statistics.StatisticsError):
+                show_stats = True
+            else:
+                mean, median, pstdev = None, None, None
+        filename = "%s-%s-%s.png" % (filename_prefix, scope_name, metric)
+        cache_key = _plot_cache_key("histogram", scope_name, metric, max_value, use_logarithmic_scale,
+                                    [mean, median, pstdev] if show_stats else None, metric_values_as_list)
+        if plot_cache.restore(cache_key, filename):
+            return [filename, mean, median, pstdev]
+        with rendering_figure() as fig:
+            ax = fig.add_subplot(111)
+            n, bins, patches = ax.hist(metric_values_as_list, "doane", facecolor='green', alpha=0.75)
+            ax.set_xlabel("%s   (max=%3.2f)" % (metric, max_value))
+            ax.set_ylabel('Value')
+            ax.set_title("%s %s (%i values in %i bins)" % (scope_name, metric, len(metric_values_as_list), len(bins)))
+            ax.grid(True)
+            if show_stats:
+                ax.axvline(mean, color='b', linestyle='dashed', linewidth=3, alpha=0.8, dash_capstyle="round")
+                ax.axvline(median, color='y', linestyle='dashed', linewidth=3, alpha=0.8, dash_capstyle="butt")
+                ax.set_xlabel(
+                    "%s   (avg=%3.2f, median=%3.2f, stdev=%3.2f, max=%3.2f)" % (metric, mean, median, pstdev, max_value))
+            if use_logarithmic_scale:
+                ax.set_yscale('symlog', basey=10, linthreshy=10, subsy=[2, 3, 4, 5, 6, 7, 8,
+                                                                        9])  # http://stackoverflow.com/questions/17952279/logarithmic-y-axis-bins-in-python
+            fig.savefig(filename, dpi=72)
+        plot_cache.store(cache_key, filename)
+        return [filename, mean, median, pstdev]
+
+
+def _save_histogram_of_arguments(arguments):
+    return save_histogram(*arguments)
+
+
+def _start_render_worker(canvas_class, profile_report_path, plot_cache_dir):
+    # initializer of the render processes: spawned ones (Windows, macOS) start from scratch, without our settings
+    global FIGURE_CANVAS_CLASS
+    FIGURE_CANVAS_CLASS = canvas_class
+    profiler.start(profile_report_path)
+    plot_cache.start(plot_cache_dir)
+
+
+def _save_histogram_in_worker(arguments):
+    """save_histogram in a render process, plus what it profiled and counted there, for the parent's report & summary."""
+    phase_count = len(profiler.phase_dicts)
+    reused_count, rendered_count = plot_cache.reused_count, plot_cache.rendered_count
+    saved = save_histogram(*arguments)
+    return [saved, profiler.phase_dicts[phase_count:],
+            plot_cache.reused_count - reused_count, plot_cache.rendered_count - rendered_count]
+
+
+RENDER_POOLS = {"process": "ProcessPoolExecutor",
+                "thread": "ThreadPoolExecutor"} # in concurrent.futures. threads: no process start-up nor copy of the values
+HTML_WRITERS = ["mpld3", "compact"] # how scatter plots are saved as HTML: the mpld3 figure, or compact_html
+
+
+def render_histograms(histograms, render_jobs=1, render_pool="process"):
+    """save_histogram for each list of its arguments, in a pool of render_jobs processes (or threads) if more than 1.
+    Returns [filename, mean, median, pstdev] of each, in order."""
+    if render_jobs <= 1 or len(histograms) <= 1:
+        return [save_histogram(*arguments) for arguments in histograms]
+    with profiler.phase("%i histograms in %i %ss" % (len(histograms), render_jobs, render_pool)):
+        max_workers = min(render_jobs, len(histograms))
+        if render_pool == "thread": # threads share our settings
+            with getattr(concurrent.futures, RENDER_POOLS[render_pool])(max_workers=max_workers) as executor:
+                return list(executor.map(_save_histogram_of_arguments, histograms))
+        with getattr(concurrent.futures, RENDER_POOLS[render_pool])(max_workers=max_workers, initializer=_start_render_worker,
+                                                                   initargs=(FIGURE_CANVAS_CLASS, profiler.report_path,
+                                                                             plot_cache.cache_dir)) as executor:
+            saved_histograms = []
+            for saved, phase_dicts, reused_count, rendered_count in executor.map(_save_histogram_in_worker, histograms):
+                profiler.add_phase_dicts(phase_dicts, "render worker")
+                plot_cache.add_counts(reused_count, rendered_count)
+                saved_histograms.append(saved)
+            return saved_histograms
+
+
+LOD_GRID_SIZE = 64 # cells per axis of the grey density layer of a level-of-detail scatter
+LOD_CELL_SIZE = 30 # area of the square drawn for each cell, in points^2: about a 64th of the plot's width
+
+
+def _cell_range(values): # of a numpy array
+    low, high = float(values.min()), float(values.max())
+    return [low, high] if high > low else [low - 0.5, high + 0.5]
+
+
+def level_of_detail(x_values, y_values, ball_values, max_points, always_show=None):
+    """For a scatter of more than max_points points: the indices (in order) of the max_points points still drawn one by
+    one, and [x centers, y centers, counts] of the non-empty grid cells the other points are binned into.
+    The points kept are the outliers: those ranking highest in x, y or ball (when balls differ), those in always_show first."""
+    import numpy as np
+    x_array = np.asarray(x_values, dtype=np.float64)
+    y_array = np.asarray(y_values, dtype=np.float64)
+    point_count = len(x_array)
+    dimensions = [x_array, y_array]
+    if np.ndim(ball_values) > 0:
+        dimensions.append(np.asarray(ball_values, dtype=np.float64))
+    extremeness = np.zeros(point_count)
+    for values in dimensions: # rank / count, so metrics of any scale weigh the same
+        ranks = np.empty(point_count)
+        ranks[np.argsort(values, kind="stable")] = np.arange(point_count)
+        np.maximum(extremeness, ranks / point_count, out=extremeness)
+    if always_show is not None:
+        extremeness += np.asarray(always_show, dtype=bool) # above every rank
+    kept = np.sort(np.argsort(-extremeness, kind="stable")[:max_points])
+    binned = np.ones(point_count, dtype=bool)
+    binned[kept] = False
+    counts, x_edges, y_edges = np.histogram2d(x_array[binned], y_array[binned], bins=LOD_GRID_SIZE,
+                                              range=[_cell_range(x_array), _cell_range(y_array)])
+    x_cells, y_cells = np.nonzero(counts)
+    x_centers = (x_edges[x_cells] + x_edges[x_cells + 1]) / 2.0
+    y_centers = (y_edges[y_cells] + y_edges[y_cells + 1]) / 2.0
+    return [kept.tolist(), [x_centers.tolist(), y_centers.tolist(), counts[x_cells, y_cells].astype(int).tolist()]]
+
+
+def _subset(values, indices):
+    import numpy as np
+    return [values[i] for i in indices] if np.ndim(values) > 0 else values # a scalar (say, one ball size) applies to all
+
+
+def save_scatter(x_values, x_label, y_values, y_label, ball_values, ball_label, color_values, color_label, annotations, filename_prefix, scope_name, show_diagonal=False, format="html", max_points=0, always_show=None, html_writer="mpld3"):
+    with profiler.phase("scatter %s %s %s %s" % (scope_name, x_label, y_label, ball_label)):
+        filename = "%s-scatter-%s-%s_%s_%s.%s" % (filename_prefix, scope_name, x_label, y_label, ball_label, format)
+        cache_key = None # compact HTML is written without matplotlib, no faster from the cache
+        if format != "html" or html_writer != "compact":
+            cache_key = _plot_cache_key("scatter", scope_name, x_label, y_label, ball_label, color_label, show_diagonal, format, max_points,
+                                        x_values, y_values, ball_values, color_values, annotations, always_show)
+        if plot_cache.restore(cache_key, filename):
+            return filename
+        title = "%i %s items. Circles: %s & %s" % (len(x_values), scope_name, ball_label, color_label)
+        lines = []
+        if show_diagonal:
+            max_max = max(max(x_values), max(y_values))
+            lines.append([0.0, 0.0, max_max, max_max, "green", 2, 0.5])
+        cells = None
+        if 0 < max_points < len(x_values): # level of detail: too many points for a browser, bin all but the outliers
+            kept, cells = level_of_detail(x_values, y_values, ball_values, max_points, always_show)
+            title = "%i %s items (%i in grey cells). Circles: %s & %s" % (len(x_values), scope_name, sum(cells[2]), ball_label, color_label)
+            x_values, y_values, ball_values = _subset(x_values, kept), _subset(y_values, kept), _subset(ball_values, kept)
+            color_values, annotations = _subset(color_values, kept), _subset(annotations, kept)
+        if format == "html" and html_writer == "compact":
+            from utilities.compact_html import scatter_layer, save_compact_scatter_html
+            layers = [] if cells is None else [_cells_layer(cells)]
+            layers.append(scatter_layer(x_values, y_values, ball_values, color_values, annotations))
+            save_compact_scatter_html(filename, title, x_label, y_label, layers, lines=lines)
+            return filename
+        if format == "html":
+            from utilities.mpld3_plugins import mpld3, ClickSendToBack, save_figure_as_html
+        with rendering_figure() as fig:
+            ax = fig.add_subplot(111)
+            ax.set_xlabel(x_label)
+            ax.set_ylabel(y_label)
+            for x0, y0, x1, y1, color, width, alpha in lines:
+                ax.plot([x0, x1], [y0, y1], ls="--", lw=width, alpha=alpha, color=color)  # http://matplotlib.org/api/lines_api.html
+            if cells is not None:
+                x_centers, y_centers, counts = cells
+                cell_scatter = ax.scatter(x_centers, y_centers, LOD_CELL_SIZE, marker="s", c=[math.log1p(count) for count in counts], cmap="Greys", vmin=-1.0, alpha=0.6)
+                if format == "html":
+                    mpld3.plugins.connect(fig, mpld3.plugins.PointHTMLTooltip(cell_scatter, labels=["%i items" % count for count in counts],
+                                                                              hoffset=10, voffset=-25))
+            ax.set_title(title)
+            scatter = ax.scatter(x_values, y_values, ball_values, alpha=0.5, c=color_values)
+            if format == "html":
+                tooltip = mpld3.plugins.PointHTMLTooltip(scatter, labels=annotations, hoffset=10, voffset=-25)
+                mpld3.plugins.connect(fig, tooltip)
+                mpld3.plugins.connect(fig, mpld3.plugins.MousePosition(fmt=".2f"))
+                mpld3.plugins.connect(fig, ClickSendToBack(scatter))
+                save_figure_as_html(fig, filename)
+            else:
+                fig.savefig(filename, dpi=72)
+        plot_cache.store(cache_key, filename)
+        return filename
+
+
+def _cells_layer(cells):
+    from utilities.compact_html import scatter_layer
+    x_centers, y_centers, counts = cells
+    return scatter_layer(x_centers, y_centers, LOD_CELL_SIZE, [math.log1p(count) for count in counts], ["%i items" % count for count in counts],
+                         alpha=0.6, marker="square", cmap="Greys", vmin=-1.0)
+
+
+INSTABILITY_TICKS = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+INSTABILITY_LINES = [[0.0, 1.0, 1.0, 0.0, "green", 2, 0.5], # the main sequence
+                     [0.0, 0.7, 0.7, 0.0, "orange", 1, 0.7],
+                     [0.3, 1.0, 1.0, 0.3, "orange", 1, 0.7],
+                     [0.0, 0.4, 0.4, 0.0, "red", 1, 0.9],
+                     [0.6, 1.0, 1.0, 0.6, "red", 1, 0.9]]
+
+
+def save_abstractness_x_instability_scatter(x_values, x_label, y_values, y_label, ball_values, ball_label, color_values, color_label, annotations, filename_prefix, scope_name, show_diagonal=True, html_writer="mpld3"):
+    with profiler.phase("scatter %s %s %s %s" % (scope_name, x_label, y_label, ball_label)):
+        title = "%i %s items. Circles: %s & %s" % (len(x_values), scope_name, ball_label, color_label)
+        lines = INSTABILITY_LINES if show_diagonal else []
+        filename = "%s-scatter-%s-%s_%s_%s.html" % (filename_prefix, scope_name, x_label, y_label, ball_label)
+        if html_writer == "compact":
+            from utilities.compact_html import scatter_layer, save_compact_scatter_html
+            save_compact_scatter_html(filename, title, x_label, y_label,
+                                      [scatter_layer(x_values, y_values, ball_values, color_values, annotations)],
+                                      lines=lines, x_ticks=INSTABILITY_TICKS, y_ticks=INSTABILITY_TICKS, grid=True)
+            return filename
+        cache_key = _plot_cache_key("instability scatter", scope_name, x_label, y_label, ball_label, color_label, show_diagonal,
+                                    x_values, y_values, ball_values, color_values, annotations)
+        if plot_cache.restore(cache_key, filename):
+            return filename
+        from utilities.mpld3_plugins import mpld3, ClickSendToBack, save_figure_as_html
+        with rendering_figure() as fig:
+            ax = fig.add_subplot(111)
+            ax.set_xticks(INSTABILITY_TICKS) # http://stackoverflow.com/questions/8209568/how-do-i-draw-a-grid-onto-a-plot-in-python
+            ax.set_yticks(INSTABILITY_TICKS)
+            ax.grid()
+            for x0, y0, x1, y1, color, width, alpha in lines:
+                ax.plot([x0, x1], [y0, y1], 'k-', ls="--", lw=width, alpha=alpha, color=color)  # http://matplotlib.org/api/lines_api.html
+            scatter = ax.scatter(x_values, y_values, ball_values, alpha=0.5, c=color_values)
+            ax.set_xlabel(x_label)
+            ax.set_ylabel(y_label)
+            ax.set_title(title)
+            tooltip = mpld3.plugins.PointHTMLTooltip(scatter, labels=annotations, hoffset=10, voffset=-25)
+            mpld3.plugins.connect(fig, tooltip)
+            mpld3.plugins.connect(fig, mpld3.plugins.MousePosition(fmt=".2f"))
+            mpld3.plugins.connect(fig, ClickSendToBack(scatter))
+            save_figure_as_html(fig, filename)
+        plot_cache.store(cache_key, filename)
+        return filename
 
 def save_csv (csv_path, cur_tracked_metrics_for_csv):
-    try:
-        file = open(csv_path, "w")
-        sep = ""
-        for metric_name,metric_value in sorted(cur_tracked_metrics_for_csv.items()):
-            file.write(sep)
-            file.write(metric_name)
-            sep = ","
-        file.write("\n")
-        sep = ""
-        for metric_name,metric_value in sorted(cur_tracked_metrics_for_csv.items()):
-            file.write(sep)
-            file.write(str(metric_value))
-            sep = ","
-        file.write("\n")
-        file.close()
-        return True
-    except:
-        return False
+    with profiler.phase("CSV write"):
+        try:
+            file = open(csv_path, "w")
+            sep = ""
+            for metric_name,metric_value in sorted(cur_tracked_metrics_for_csv.items()):
+                file.write(sep)
+                file.write(metric_name)
+                sep = ","
+            file.write("\n")
+            sep = ""
+            for metric_name,metric_value in sorted(cur_tracked_metrics_for_csv.items()):
+                file.write(sep)
+                file.write(str(metric_value))
+                sep = ","
+            file.write("\n")
+            file.close()
+            return True
+        except:
+            return False
 
 
 def save_kiviat_with_values_and_thresholds (labels, values, threshold_values, file_name, title=None, max_vals = None, min_vals = None, thresholdslabel="limits", valueslabel="current"):
-    if min_vals is None:
-        min_vals = [min(round(t/2), round(v/2)) for v, t in zip(values, threshold_values)] # /2 because we want to avoid having all min points in the origin, for looks
-    if max_vals is None:
-        max_vals = [max(v, t, m + 0.001) for v, t, m in zip(values, threshold_values, min_vals)] #minimum plus 0.001 to prevent DivideBy Zero when max=min, bug #53
-    ranges = [(x,y) for x,y in zip (min_vals, max_vals)]
-    fig1 = plt.figure(figsize=(12, 12))
-    radar = ComplexRadar(fig1, labels, ranges, precision=1)
-    radar.plot(threshold_values, color="green", label=thresholdslabel)
-    radar.fill(threshold_values, color="green", alpha=0.5)
-    radar = ComplexRadar(fig1, labels, ranges, precision=1)
-    radar.plot(values, color="orangered", label=valueslabel)
-    radar.fill(values, color="orangered", alpha=0.5)
-    radar.ax.legend(loc='upper center', bbox_to_anchor=(0.9, 1.10),
-                    fancybox=False, shadow=False, ncol=48)
-    if title is not None:
-        plt.title(title, y=1.08)
-    plt.savefig(file_name, dpi=72)
-    return file_name
+    with profiler.phase("kiviat"):
+        cache_key = _plot_cache_key("kiviat", labels, values, threshold_values, title, max_vals, min_vals, thresholdslabel, valueslabel)
+        if plot_cache.restore(cache_key, file_name):
+            return file_name
+        from utilities.complex_radar import ComplexRadar
+        with rendering_figure(figsize=(12, 12)) as fig1:
+            if min_vals is None:
+                min_vals = [min(round(t/2), round(v/2)) for v, t in zip(values, threshold_values)] # /2 because we want to avoid having all min points in the origin, for looks
+            if max_vals is None:
+                max_vals = [max(v, t, m + 0.001) for v, t, m in zip(values, threshold_values, min_vals)] #minimum plus 0.001 to prevent DivideBy Zero when max=min, bug #53
+            ranges = [(x,y) for x,y in zip (min_vals, max_vals)]
+            radar = ComplexRadar(fig1, labels, ranges, precision=1)
+            radar.plot(threshold_values, color="green", label=thresholdslabel)
+            radar.fill(threshold_values, color="green", alpha=0.5)
+            radar.plot(values, color="orangered", label=valueslabel)
+            radar.fill(values, color="orangered", alpha=0.5)
+            radar.ax.legend(loc='upper center', bbox_to_anchor=(0.9, 1.10),
+                            fancybox=False, shadow=False, ncol=48)
+            if title is not None:
+                fig1.gca().set_title(title, y=1.08) # the last axes added, as with pyplot
+            fig1.savefig(file_name, dpi=72)
+        plot_cache.store(cache_key, file_name)
+        return file_name
 
 
 def post_metrics_to_sonar (cmdline_arguments, cur_tracked_metrics):
-    TIMEOUT = 4
-    sonar_url = cmdline_arguments["--sonarURL"]
-    sonar_prj = cmdline_arguments["--sonarPrj"]
-    sonar_user = cmdline_arguments["--sonarUser"]
-    sonar_pass = cmdline_arguments["--sonarPass"]
-    if sonar_prj == "#":
-        print("*** Skipping posting to Sonar (PRJ=%s)" % sonar_prj)
-        return
-    for metric, value in cur_tracked_metrics.items():
-        metric_name = metric.lower().replace(" ", "_").replace(":", "_") # SONAR wants its key, which is lowercase. get rid of stats special char :
-        try:
-            url = "%s/api/manual_measures" % sonar_url
-            params = {"resource": sonar_prj, "metric": metric_name, "val": value}
-            response = requests.post(url, params, timeout=TIMEOUT, auth=(sonar_user, sonar_pass))
-            if response.status_code != 200: # Fix for #57 - try newer SONAR API
-                url = "%s/api/custom_measures/create" % sonar_url
-                params = {"projectKey": sonar_prj, "metricKey": metric_name,"value": value}
-                response = requests.post(url, params, timeout=TIMEOUT,
-                                         auth=(sonar_user, sonar_pass))
-                if response.status_code == 400: # metric already created, we need to update it. But we need the metric ID for that
-                    url = "%s/api/custom_measures/search" % sonar_url
-                    params = {"projectKey": sonar_prj}
+    with profiler.phase("Sonar post"):
+        TIMEOUT = 4
+        sonar_url = cmdline_arguments["--sonarURL"]
+        sonar_prj = cmdline_arguments["--sonarPrj"]
+        sonar_user = cmdline_arguments["--sonarUser"]
+        sonar_pass = cmdline_arguments["--sonarPass"]
+        if sonar_prj == "#":
+            print("*** Skipping posting to Sonar (PRJ=%s)" % sonar_prj)
+            return
+        import requests
+        for metric, value in cur_tracked_metrics.items():
+            metric_name = metric.lower().replace(" ", "_").replace(":", "_") # SONAR wants its key, which is lowercase. get rid of stats special char :
+            try:
+                url = "%s/api/manual_measures" % sonar_url
+                params = {"resource": sonar_prj, "metric": metric_name, "val": value}
+                response = requests.post(url, params, timeout=TIMEOUT, auth=(sonar_user, sonar_pass))
+                if response.status_code != 200: # Fix for #57 - try newer SONAR API
+                    url = "%s/api/custom_measures/create" % sonar_url
+                    params = {"projectKey": sonar_prj, "metricKey": metric_name,"value": value}
                     response = requests.post(url, params, timeout=TIMEOUT,
-                                         auth=(sonar_user, sonar_pass))
-                    metric_id = extract_metric_id_from_sonar_metric_search(metric_name, json.loads(response.text))
-                    if metric_id is not None:
-                        url = "%s/api/custom_measures/update" % sonar_url
-                        params = {"projectKey": sonar_prj, "id": metric_id,"value": value}
+                                             auth=(sonar_user, sonar_pass))
+                    if response.status_code == 400: # metric already created, we need to update it. But we need the metric ID for that
+                        url = "%s/api/custom_measures/search" % sonar_url
+                        params = {"projectKey": sonar_prj}
                         response = requests.post(url, params, timeout=TIMEOUT,
-                                                 auth=(sonar_user, sonar_pass))
-            if response.status_code != 200:
-                print("*** Response error %s for metric '%s' when connecting to %s with params %s: \t%s" % (response.status_code, metric, url, params, str(response.content)))
-            else:
-                print("+++ Metric %s=%s posted to prj %s in %s (%s)" % (metric, value, sonar_prj, sonar_url, str(response.content)))
-        except requests.exceptions.Timeout:
-            print("*** Timeout connecting to %s" % sonar_url)
-            return
-        except requests.exceptions.HTTPError:
-            print("*** HTTP Error connecting to %s" % sonar_url)
-            return
-        except requests.exceptions.ConnectionError:
-            print("*** Connection Error connecting to %s" % sonar_url)
-            return
+                                             auth=(sonar_user, sonar_pass))
+                        metric_id = extract_metric_id_from_sonar_metric_search(metric_name, json.loads(response.text))
+                        if metric_id is not None:
+                            url = "%s/api/custom_measures/update" % sonar_url
+                            params = {"projectKey": sonar_prj, "id": metric_id,"value": value}
+                            response = requests.post(url, params, timeout=TIMEOUT,
+                                                     auth=(sonar_user, sonar_pass))
+                if response.status_code != 200:
+                    print("*** Response error %s for metric '%s' when connecting to %s with params %s: \t%s" % (response.status_code, metric, url, params, str(response.content)))
+                else:
+                    print("+++ Metric %s=%s posted to prj %s in %s (%s)" % (metric, value, sonar_prj, sonar_url, str(response.content)))
+            except requests.exceptions.Timeout:
+                print("*** Timeout connecting to %s" % sonar_url)
+                return
+            except requests.exceptions.HTTPError:
+                print("*** HTTP Error connecting to %s" % sonar_url)
+                return
+            except requests.exceptions.ConnectionError:
+                print("*** Connection Error connecting to %s" % sonar_url)
+                return
 
 def extract_metric_id_from_sonar_metric_search(metric_key_to_find, json_response):
     for entry_as_dict in json_response.get("customMeasures", []):
@@ -325,6 +604,7 @@ def load_json(max_metrics_json_or_path):
         with open(max_metrics_json_or_path) as max_metrics_json:
             return json.load(max_metrics_json)
     elif is_url(max_metrics_json_or_path):
+        import urllib.request
         with  urllib.request.urlopen(max_metrics_json_or_path) as url_connection:
         #with requests.get(max_metrics_json_or_path) as url_connection:
         #    return json.loads(url_connection.text)
@@ -1,7 +1,7 @@
 """XML KALOI (Keep a Lid On It).
 
 Usage:
-  xmlkaloi      --in=<inputXML> [--maxMetrics=<maxPrjMetrics>] [--xpathForEachMetric=<xpaths>] [--adaptive] [--outputDir=<path to dir where to save files>] [--outputCSV=<outputCSV>] [--sonarURL=<sonarURL>] [--sonarPrj=<sonarPrj>] [--sonarUser=<sonarUser>] [--sonarPass=<sonarPass>]
+  xmlkaloi      --in=<inputXML> [--maxMetrics=<maxPrjMetrics>] [--xpathForEachMetric=<xpaths>] [--adaptive] [--outputDir=<path to dir where to save files>] [--outputCSV=<outputCSV>] [--sonarURL=<sonarURL>] [--sonarPrj=<sonarPrj>] [--sonarUser=<sonarUser>] [--sonarPass=<sonarPass>] [--profileReport=<profileReport>]
 
 
 Options:
@@ -15,6 +15,7 @@ Options:
   --sonarPass=<sonarPass>             Password for Sonar authentication [default: admin]
   --outputCSV=<outputCSV>             Output CSV file path with the current metrics listed at --maxPrjMetrics. Useful with the Jenkins/Plot plugin [default: srcmetrics.csv]
   --outputDir=<path>                  Where files should be generated. [default: .]
+  --profileReport=<profileReport>     Path of a JSON file to save the wall time, CPU time and peak memory of each phase of the run to. Slows the run down.
 
 
 Author:
@@ -33,6 +34,7 @@ from docopt import docopt
 from utilities import VERSION
 import xml.etree.ElementTree as ET
 import re
+from utilities.profiling import profiler
 from utilities.utils import post_metrics_to_sonar, save_csv
 
 def load_xml(xml_path):
@@ -96,15 +98,18 @@ def main():
     arguments = docopt(__doc__, version=VERSION)
     print("\r\n====== xmlkaloi @ https://github.com/sglebs/srccheck ==========")
     print(arguments)
+    profiler.start(arguments["--profileReport"], "xmlkaloi")
 
     adaptive = arguments.get("--adaptive", False)
     print("\r\n====== XML KALOI Metrics (%s) ==========" % arguments.get("--maxMetrics", False))
     max_metrics = load_json(arguments.get("--maxMetrics", False))
     xpaths = load_json(arguments.get("--xpathForEachMetric", False))
-    xml = load_xml(arguments.get("--in", ""))
+    with profiler.phase("XML load"):
+        xml = load_xml(arguments.get("--in", ""))
     print(xpaths)
     print("\r\n====== XML Metrics that failed the filters  ===========")
-    [total_violation_count, current_values, violators] = process_xml_metrics(max_metrics, xpaths, xml)
+    with profiler.phase("XML metrics"):
+        [total_violation_count, current_values, violators] = process_xml_metrics(max_metrics, xpaths, xml)
     print ("%s  (Current values: %s)" % (violators, current_values))
     if adaptive:
         write_json(arguments.get("--maxMetrics", False), current_values)
@@ -122,6 +127,7 @@ def main():
     print("Finished: %s" % str(end_time))
     print("Total: %s" % str(end_time-start_time))
     print("--------------------------------------------------")
+    profiler.save()
     sys.exit(total_violation_count)
 
 if __name__ == '__main__':